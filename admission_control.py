@@ -0,0 +1,287 @@
+"""Admission control for bot commands.
+
+Every expensive handler is wrapped with :meth:`AdmissionController.wrap`,
+which applies, in order:
+
+1. Token buckets per user and per (user, command), so one user can't flood
+   the bot. Requests over the limit are rejected with a "try again in Ns"
+   reply.
+2. A cap on how many requests a single user may have in flight.
+3. A concurrency limit per provider with a priority queue in front of it.
+   Cheap text commands outrank heavy media ones, and queued requests get an
+   immediate "queued, position N" reply.
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import functools
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Tuple
+from telegram import Update
+from telegram.ext import ContextTypes
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Priorities: lower runs first
+PRIORITY_TEXT = 0
+PRIORITY_IMAGE_ANALYSIS = 1
+PRIORITY_IMAGE_GENERATION = 2
+PRIORITY_VIDEO = 3
+
+MAX_INFLIGHT_PER_USER = int(os.getenv('ADMISSION_MAX_INFLIGHT_PER_USER', '3'))
+USER_RATE = float(os.getenv('ADMISSION_USER_RATE', '1.0'))  # Requests per second across all commands
+USER_BURST = int(os.getenv('ADMISSION_USER_BURST', '10'))
+MAX_QUEUE_PER_PROVIDER = int(os.getenv('ADMISSION_MAX_QUEUE', '200'))
+
+DEFAULT_PROVIDER_CONCURRENCY = {
+    "groq": 32,
+    "together": 4,
+    "gemini": 2,
+}
+
+
+@dataclass(frozen=True)
+class CommandPolicy:
+    provider: str
+    priority: int
+    rate: float  # Tokens refilled per second
+    burst: int  # Bucket capacity
+
+
+COMMAND_POLICIES: Dict[str, CommandPolicy] = {
+    "chat": CommandPolicy("groq", PRIORITY_TEXT, rate=0.5, burst=5),
+    "text": CommandPolicy("groq", PRIORITY_TEXT, rate=0.5, burst=5),
+    "enhance": CommandPolicy("groq", PRIORITY_TEXT, rate=0.2, burst=3),
+    "describe": CommandPolicy("groq", PRIORITY_IMAGE_ANALYSIS, rate=0.1, burst=3),
+    "caption": CommandPolicy("groq", PRIORITY_IMAGE_ANALYSIS, rate=0.1, burst=3),
+    "imagine": CommandPolicy("together", PRIORITY_IMAGE_GENERATION, rate=1 / 30, burst=3),
+    "analyze_video": CommandPolicy("gemini", PRIORITY_VIDEO, rate=1 / 60, burst=2),
+}
+
+
+class TokenBucket:
+    """Classic token bucket: ``capacity`` tokens, refilled at ``rate`` per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, tokens: float = 1.0) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def time_until(self, tokens: float = 1.0) -> float:
+        """Seconds until ``tokens`` are available."""
+        self._refill(time.monotonic())
+        missing = tokens - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    async def take(self, tokens: float = 1.0):
+        """Wait until ``tokens`` are available, then take them."""
+        while not self.try_take(tokens):
+            await asyncio.sleep(self.time_until(tokens))
+
+    @property
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class PriorityGate:
+    """Concurrency limiter whose waiters are served in priority order."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def try_acquire(self) -> bool:
+        if self.active < self.limit and not self.queue_depth:
+            self.active += 1
+            return True
+        return False
+
+    def enqueue(self, priority: int) -> Tuple[int, int, asyncio.Future]:
+        entry = (priority, next(self._seq), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, entry)
+        return entry
+
+    def position(self, entry: Tuple[int, int, asyncio.Future]) -> int:
+        """1-based position of a waiter in the queue."""
+        key = entry[:2]
+        return 1 + sum(
+            1 for waiter in self._waiters
+            if waiter[:2] < key and not waiter[2].done()
+        )
+
+    def release(self):
+        # Hand the slot straight to the best live waiter
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.active -= 1
+
+
+class AdmissionController:
+    """Rate limiting, per-user caps and priority queueing in front of handlers."""
+
+    def __init__(self, policies: Dict[str, CommandPolicy] = COMMAND_POLICIES):
+        self.policies = policies
+        self._user_buckets: Dict[int, TokenBucket] = {}
+        self._command_buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._inflight: Dict[int, int] = {}
+        self._gates: Dict[str, PriorityGate] = {}
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def gate(self, provider: str) -> PriorityGate:
+        gate = self._gates.get(provider)
+        if gate is None:
+            limit = int(os.getenv(
+                f"ADMISSION_{provider.upper()}_CONCURRENCY",
+                str(DEFAULT_PROVIDER_CONCURRENCY.get(provider, 4))
+            ))
+            gate = PriorityGate(limit)
+            self._gates[provider] = gate
+        return gate
+
+    def _check_rate(self, user_id: int, command: str, policy: CommandPolicy) -> float:
+        """Return 0 if the request may proceed, else seconds to wait."""
+        user_bucket = self._user_buckets.get(user_id)
+        if user_bucket is None:
+            user_bucket = self._user_buckets[user_id] = TokenBucket(USER_RATE, USER_BURST)
+        command_bucket = self._command_buckets.get((user_id, command))
+        if command_bucket is None:
+            command_bucket = TokenBucket(policy.rate, policy.burst)
+            self._command_buckets[(user_id, command)] = command_bucket
+
+        wait = max(user_bucket.time_until(), command_bucket.time_until())
+        if wait > 0:
+            return wait
+        user_bucket.try_take()
+        command_bucket.try_take()
+        return 0.0
+
+    def _prune_buckets(self):
+        # Full buckets hold no state worth keeping
+        if len(self._command_buckets) > 10000:
+            self._command_buckets = {k: b for k, b in self._command_buckets.items() if not b.is_full}
+            self._user_buckets = {k: b for k, b in self._user_buckets.items() if not b.is_full}
+
+    def wrap(
+        self,
+        handler: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]],
+        command: str
+    ) -> Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]:
+        """Wrap a handler with admission control for ``command``."""
+        policy = self.policies[command]
+
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            user = update.effective_user
+            message = update.effective_message
+            if user is None or message is None:
+                return await handler(update, context)
+
+            wait = self._check_rate(user.id, command, policy)
+            if wait > 0:
+                self.rejected += 1
+                await message.reply_text(
+                    f"⏳ You're sending requests too quickly. Please try /{command} again in {wait:.0f}s."
+                )
+                return
+
+            if self._inflight.get(user.id, 0) >= MAX_INFLIGHT_PER_USER:
+                self.rejected += 1
+                await message.reply_text(
+                    "⏳ You already have several requests running. Please wait for them to finish."
+                )
+                return
+
+            # Count the request while it waits too, so one user can't fill the gate queue
+            self._inflight[user.id] = self._inflight.get(user.id, 0) + 1
+            gate = self.gate(policy.provider)
+            acquired = False
+            try:
+                queued_message = None
+                if not gate.try_acquire():
+                    if gate.queue_depth >= MAX_QUEUE_PER_PROVIDER:
+                        self.rejected += 1
+                        await message.reply_text("🚦 The bot is very busy right now. Please try again in a minute.")
+                        return
+                    entry = gate.enqueue(policy.priority)
+                    self.queued += 1
+                    try:
+                        queued_message = await message.reply_text(
+                            f"🕒 Queued, position {gate.position(entry)}. I'll start as soon as a slot frees up."
+                        )
+                        await entry[2]
+                    except BaseException:
+                        # Failed reply or cancellation: leave the queue without leaking a slot
+                        if entry[2].done() and not entry[2].cancelled():
+                            # The slot was handed to us just before the error
+                            gate.release()
+                        else:
+                            entry[2].cancel()
+                        raise
+
+                acquired = True
+                self.admitted += 1
+                if queued_message is not None:
+                    try:
+                        await queued_message.delete()
+                    except Exception:
+                        pass
+                return await handler(update, context)
+            finally:
+                if acquired:
+                    gate.release()
+                remaining = self._inflight.get(user.id, 1) - 1
+                if remaining:
+                    self._inflight[user.id] = remaining
+                else:
+                    self._inflight.pop(user.id, None)
+                self._prune_buckets()
+
+        return wrapper
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "providers": {
+                name: {"active": gate.active, "limit": gate.limit, "queued": gate.queue_depth}
+                for name, gate in self._gates.items()
+            },
+        }
+
+
+# Shared controller used by setup_bot
+admission = AdmissionController()
@@ -4,6 +4,7 @@ import tempfile
 from pathlib import Path
 from groq import Groq
 from dotenv import load_dotenv
+from outbox import outbox
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
 
@@ -153,12 +154,15 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             
             # Send transcription
             await processing_msg.edit_text("✅ Transcription completed!")
+            parts = []
             for i, msg in enumerate(messages, 1):
                 if len(messages) > 1:
                     header = f"*Part {i}/{len(messages)}:*\n\n"
                 else:
                     header = "*Transcription:*\n\n"
-                await update.message.reply_text(f"{header}{msg}", parse_mode='Markdown')
+                parts.append(f"{header}{msg}")
+            # Paced by the outbox so long transcripts don't hit the per-chat limit
+            await outbox.send_many(context.bot, update.effective_chat.id, parts, parse_mode='Markdown')
         else:
             await processing_msg.edit_text(
                 "❌ Sorry, I couldn't transcribe the audio. Please try again."
@@ -0,0 +1,589 @@
+"""Record and replay provider HTTP traffic.
+
+A cassette is a JSON-lines file of captured provider responses. While a
+cassette is active, the HTTP layers the SDKs sit on are patched:
+
+* ``httpx`` transports (Groq, sync and async)
+* ``requests.adapters.HTTPAdapter`` (Together, and Gemini over REST)
+
+so the bot's own code paths (``interactive_chat``, ``ToneEnhancer.enhance_text``,
+``AIImageGenerator.generate_image``, ``video_insights.get_insights``) run
+unchanged. In ``record`` mode every request goes to the real API and the raw
+response bytes are saved with their timings: the delay until the headers
+arrived and the offset of every body chunk, so streamed completions keep
+their cadence. The body is read in full before it is handed to the client
+(SDKs stop reading streams at ``[DONE]`` without closing them), so record
+runs are not themselves a latency measurement. In ``replay`` mode nothing leaves the process; the recorded
+bytes are returned (still compressed, exactly as received) after the same
+delays divided by ``speed`` (``0`` replays without delays).
+
+Requests are matched by fingerprint: a hash of the method, URL path (API
+keys in the query are dropped) and the body, with JSON bodies in canonical
+form and multipart boundaries normalised. Request headers are never stored.
+When no exact match exists, replay falls back to a response recorded for the
+same endpoint and model (then the same endpoint), unless ``strict`` is set,
+which is what lets load tests with varied prompts run against a cassette.
+
+Recording real responses (needs real keys in .env; Gemini is switched to its
+REST transport so it can be captured):
+
+    python benchmarks/cassettes.py record cassettes/providers.jsonl --video sample.mp4
+
+Replaying them as a benchmark of the client code paths:
+
+    python benchmarks/cassettes.py replay cassettes/providers.jsonl --speed 1 --repeat 5
+
+``benchmarks/load_test.py --cassette`` replays a cassette under load.
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import argparse
+import platform
+import statistics
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Never recorded or replayed
+PASSTHROUGH_HOSTS = ("api.telegram.org",)
+
+# Query parameters that carry credentials
+SECRET_PARAMS = ("key", "api_key")
+
+# Response headers not worth keeping in a cassette
+DROPPED_HEADERS = ("set-cookie",)
+
+# Size of the chunks read from a requests response while recording
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class CassetteMiss(Exception):
+    """No recorded response matches a request during replay."""
+
+
+def _redacted_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS]
+    return parts._replace(query=urlencode(query)).geturl()
+
+
+def _canonical_body(body: bytes, content_type: str) -> bytes:
+    if not body:
+        return b""
+    if "json" in content_type:
+        try:
+            return json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+        except ValueError:
+            return body
+    if "boundary=" in content_type:
+        # Multipart boundaries are random per request
+        boundary = content_type.split("boundary=", 1)[1].split(";")[0].strip('"')
+        return body.replace(boundary.encode(), b"BOUNDARY")
+    return body
+
+
+def _model(path: str, body: bytes, content_type: str) -> Optional[str]:
+    if "json" in content_type and body:
+        try:
+            model = json.loads(body).get("model")
+            if model:
+                return str(model)
+        except (ValueError, AttributeError):
+            pass
+    if "/models/" in path:
+        # Gemini: /v1beta/models/gemini-1.5-flash:generateContent
+        return path.split("/models/", 1)[1].split(":", 1)[0]
+    return None
+
+
+def describe_request(method: str, url: str, body: bytes, content_type: str) -> Dict[str, Any]:
+    """Fingerprint and loose match keys for a request."""
+    path = urlsplit(url).path
+    model = _model(path, body, content_type)
+    digest = hashlib.sha256()
+    for part in (method.upper().encode(), path.encode(), _canonical_body(body, content_type or "")):
+        digest.update(part)
+        digest.update(b"\0")
+    return {
+        "fingerprint": digest.hexdigest(),
+        "method": method.upper(),
+        "path": path,
+        "model": model,
+    }
+
+
+class Interaction:
+    """One recorded response and its timings."""
+
+    def __init__(
+        self,
+        request: Dict[str, Any],
+        url: str,
+        status: int,
+        headers: List[Tuple[str, str]],
+        headers_delay: float,
+        chunks: List[Tuple[float, bytes]]
+    ):
+        self.request = request
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.headers_delay = headers_delay
+        self.chunks = chunks
+
+    @property
+    def body_size(self) -> int:
+        return sum(len(chunk) for _, chunk in self.chunks)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **self.request,
+            "url": _redacted_url(self.url),
+            "status": self.status,
+            "headers": [[k, v] for k, v in self.headers if k.lower() not in DROPPED_HEADERS],
+            "headers_delay": round(self.headers_delay, 6),
+            "chunks": [[round(offset, 6), base64.b64encode(chunk).decode()] for offset, chunk in self.chunks],
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Interaction":
+        request = {key: data.get(key) for key in ("fingerprint", "method", "path", "model")}
+        return cls(
+            request,
+            data["url"],
+            data["status"],
+            [(k, v) for k, v in data["headers"]],
+            data["headers_delay"],
+            [(offset, base64.b64decode(chunk)) for offset, chunk in data["chunks"]]
+        )
+
+
+class Cassette:
+    """Recorded interactions, matched by fingerprint with loose fallbacks."""
+
+    def __init__(self, path: str, mode: str = "replay", speed: float = 1.0, strict: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.strict = strict
+        self.interactions: List[Interaction] = []
+        self.stats = {"recorded": 0, "exact": 0, "loose": 0, "misses": 0}
+        self._indexes: Dict[str, Dict[Any, List[Interaction]]] = {"exact": {}, "model": {}, "path": {}}
+        self._cursors: Dict[Tuple[str, Any], int] = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._index(Interaction.from_dict(json.loads(line)))
+
+    def _index(self, interaction: Interaction):
+        request = interaction.request
+        self.interactions.append(interaction)
+        keys = {
+            "exact": request["fingerprint"],
+            "model": (request["method"], request["path"], request["model"]),
+            "path": (request["method"], request["path"]),
+        }
+        for level, key in keys.items():
+            self._indexes[level].setdefault(key, []).append(interaction)
+
+    def save(self, interaction: Interaction):
+        """Append a recorded interaction to the cassette file."""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(interaction.to_dict()) + "\n")
+            self.stats["recorded"] += 1
+
+    def match(self, request: Dict[str, Any]) -> Interaction:
+        """Next recorded response for ``request``; repeated requests cycle through the recordings."""
+        levels = [("exact", request["fingerprint"])]
+        if not self.strict:
+            levels += [
+                ("model", (request["method"], request["path"], request["model"])),
+                ("path", (request["method"], request["path"])),
+            ]
+        with self._lock:
+            for level, key in levels:
+                candidates = self._indexes[level].get(key)
+                if candidates:
+                    cursor = self._cursors.get((level, key), 0)
+                    self._cursors[(level, key)] = cursor + 1
+                    self.stats["exact" if level == "exact" else "loose"] += 1
+                    return candidates[cursor % len(candidates)]
+            self.stats["misses"] += 1
+        raise CassetteMiss(f"No recorded response for {request['method']} {request['path']} (model={request['model']})")
+
+    def delay(self, seconds: float) -> float:
+        return seconds / self.speed if self.speed > 0 else 0.0
+
+
+class _Recorder:
+    """Collects a response body with the offset each chunk arrived at."""
+
+    def __init__(self, cassette: Cassette, request: Dict[str, Any], url: str, status: int,
+                 headers: List[Tuple[str, str]], started: float):
+        self.cassette = cassette
+        self.request = request
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.headers_delay = time.perf_counter() - started
+        self.received = time.perf_counter()
+        self.chunks: List[Tuple[float, bytes]] = []
+
+    def chunk(self, data: bytes):
+        if data:
+            self.chunks.append((time.perf_counter() - self.received, data))
+
+    def finish(self):
+        self.cassette.save(Interaction(
+            self.request, self.url, self.status, self.headers, self.headers_delay, self.chunks
+        ))
+
+
+def _paced(cassette: Cassette, chunks: List[Tuple[float, bytes]]) -> Iterator[bytes]:
+    started = time.perf_counter()
+    for offset, data in chunks:
+        wait = started + cassette.delay(offset) - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        yield data
+
+
+async def _apaced(cassette: Cassette, chunks: List[Tuple[float, bytes]]):
+    started = time.perf_counter()
+    for offset, data in chunks:
+        wait = started + cassette.delay(offset) - time.perf_counter()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        yield data
+
+
+class _IteratorReader(io.RawIOBase):
+    """File object over a chunk iterator, used as a urllib3 response body."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._buffer:
+            self._buffer = next(self._chunks, b"")
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+# --- httpx (Groq) ---------------------------------------------------------
+
+def _httpx_patches(cassette: Cassette):
+    import httpx
+
+    original_sync = httpx.HTTPTransport.handle_request
+    original_async = httpx.AsyncHTTPTransport.handle_async_request
+
+    class ReplayStream(httpx.SyncByteStream):
+        def __init__(self, interaction: Interaction):
+            self._interaction = interaction
+
+        def __iter__(self):
+            return _paced(cassette, self._interaction.chunks)
+
+    class AsyncReplayStream(httpx.AsyncByteStream):
+        def __init__(self, interaction: Interaction):
+            self._interaction = interaction
+
+        def __aiter__(self):
+            return _apaced(cassette, self._interaction.chunks)
+
+    def describe(request):
+        return describe_request(request.method, str(request.url), request.content,
+                                request.headers.get("content-type", ""))
+
+    def replayed(request, interaction: Interaction, stream):
+        return httpx.Response(interaction.status, headers=interaction.headers, stream=stream, request=request)
+
+    def recorded(request, recorder: _Recorder):
+        body = b"".join(data for _, data in recorder.chunks)
+        return httpx.Response(recorder.status, headers=recorder.headers, stream=httpx.ByteStream(body), request=request)
+
+    def handle_request(self, request):
+        if request.url.host in PASSTHROUGH_HOSTS:
+            return original_sync(self, request)
+        request.read()
+        described = describe(request)
+        if cassette.mode == "replay":
+            interaction = cassette.match(described)
+            time.sleep(cassette.delay(interaction.headers_delay))
+            return replayed(request, interaction, ReplayStream(interaction))
+        started = time.perf_counter()
+        response = original_sync(self, request)
+        recorder = _Recorder(cassette, described, str(request.url), response.status_code,
+                             list(response.headers.multi_items()), started)
+        try:
+            for data in response.stream:
+                recorder.chunk(data)
+        finally:
+            response.close()
+        recorder.finish()
+        return recorded(request, recorder)
+
+    async def handle_async_request(self, request):
+        if request.url.host in PASSTHROUGH_HOSTS:
+            return await original_async(self, request)
+        await request.aread()
+        described = describe(request)
+        if cassette.mode == "replay":
+            interaction = cassette.match(described)
+            await asyncio.sleep(cassette.delay(interaction.headers_delay))
+            return replayed(request, interaction, AsyncReplayStream(interaction))
+        started = time.perf_counter()
+        response = await original_async(self, request)
+        recorder = _Recorder(cassette, described, str(request.url), response.status_code,
+                             list(response.headers.multi_items()), started)
+        try:
+            async for data in response.stream:
+                recorder.chunk(data)
+        finally:
+            await response.aclose()
+        recorder.finish()
+        return recorded(request, recorder)
+
+    return [
+        (httpx.HTTPTransport, "handle_request", handle_request),
+        (httpx.AsyncHTTPTransport, "handle_async_request", handle_async_request),
+    ]
+
+
+# --- requests (Together, Gemini REST) -------------------------------------
+
+def _requests_patches(cassette: Cassette):
+    from requests.adapters import HTTPAdapter
+    from urllib3.response import HTTPResponse
+
+    original_send = HTTPAdapter.send
+
+    def raw_response(status: int, headers: List[Tuple[str, str]], chunks: Iterator[bytes]):
+        return HTTPResponse(
+            body=_IteratorReader(chunks),
+            headers=headers,
+            status=status,
+            preload_content=False,
+            decode_content=True
+        )
+
+    def send(self, request, *args, **kwargs):
+        if urlsplit(request.url).hostname in PASSTHROUGH_HOSTS:
+            return original_send(self, request, *args, **kwargs)
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        elif not isinstance(body, bytes):
+            body = b""
+        described = describe_request(request.method, request.url, body, request.headers.get("Content-Type", ""))
+        if cassette.mode == "replay":
+            interaction = cassette.match(described)
+            time.sleep(cassette.delay(interaction.headers_delay))
+            raw = raw_response(interaction.status, interaction.headers, _paced(cassette, interaction.chunks))
+            return self.build_response(request, raw)
+        started = time.perf_counter()
+        response = original_send(self, request, *args, **kwargs)
+        recorder = _Recorder(cassette, described, request.url, response.status_code,
+                             list(response.raw.headers.items()), started)
+        # Read the undecoded body now so its bytes and timings can be saved
+        for data in response.raw.stream(READ_CHUNK_SIZE, decode_content=False):
+            recorder.chunk(data)
+        response.raw.release_conn()
+        recorder.finish()
+        raw = raw_response(recorder.status, recorder.headers, iter([data for _, data in recorder.chunks]))
+        return self.build_response(request, raw)
+
+    return [(HTTPAdapter, "send", send)]
+
+
+@contextmanager
+def use_cassette(path: str, mode: str = "replay", speed: float = 1.0, strict: bool = False) -> Iterator[Cassette]:
+    """Patch the provider HTTP layers to record to, or replay from, ``path``."""
+    cassette = Cassette(path, mode, speed, strict)
+    patches = _httpx_patches(cassette) + _requests_patches(cassette)
+    originals = [(owner, name, getattr(owner, name)) for owner, name, _ in patches]
+    for owner, name, replacement in patches:
+        setattr(owner, name, replacement)
+    try:
+        yield cassette
+    finally:
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+
+
+# --- Scenarios --------------------------------------------------------------
+
+CHAT_MODEL = "llama3-70b-8192"
+CHAT_TEXT = "Explain in three sentences why connection pooling speeds up API clients."
+ENHANCE_TEXT = "Our bot now answers faster and handles more users at once."
+IMAGE_PROMPT = "a lighthouse on a cliff at sunset, oil painting"
+
+# Placeholders so the bot modules import; real keys from .env take precedence
+SCENARIO_ENV = {
+    "TELEGRAM_BOT_TOKEN": "123456:CASSETTE",
+    "ROOT_PASSWORD": "cassette",
+    "ADMIN_USER_ID": "1",
+    "API_KEY": "cassette",
+    "GEMINI_API_KEY": "cassette",
+    "GROQ_API_KEY": "cassette",
+    "TOGETHER_API_KEY": "cassette",
+    "SESSION_BACKEND": "memory",
+    "STARTUP_WARMUP": "false",
+    "STARTUP_PROFILE": "false",
+    "METRICS_ENABLED": "false",
+    "TRACING_ENABLED": "false",
+}
+
+
+def prepare_environment():
+    """Load .env, fill in placeholders and put the bot modules on the path."""
+    sys.path.insert(0, REPO_ROOT)
+    from dotenv import load_dotenv
+
+    load_dotenv(os.path.join(REPO_ROOT, ".env"))
+    workdir = tempfile.mkdtemp(prefix="cassettes-")
+    for name in ("SESSION_DB_PATH", "MEDIA_JOB_DB_PATH", "RESPONSE_CACHE_DB_PATH", "OUTBOX_DB_PATH"):
+        SCENARIO_ENV[name] = os.path.join(workdir, name.lower() + ".db")
+    for name, value in SCENARIO_ENV.items():
+        os.environ.setdefault(name, value)
+    # gRPC traffic cannot be captured; read by client_registry at import time
+    os.environ["GEMINI_TRANSPORT"] = "rest"
+
+
+async def _chat():
+    from telegram_bot import interactive_chat
+
+    reply, _ = await interactive_chat(CHAT_TEXT, CHAT_MODEL, os.environ["GROQ_API_KEY"])
+    return reply
+
+
+async def _enhance():
+    from tone_enhancer import ToneEnhancer
+
+    success, text, error = await ToneEnhancer().enhance_text(ENHANCE_TEXT)
+    if not success:
+        raise RuntimeError(error)
+    return text
+
+
+async def _imagine():
+    from image_generator import AIImageGenerator
+
+    success, image, error = await asyncio.to_thread(AIImageGenerator().generate_image, IMAGE_PROMPT)
+    if not success:
+        raise RuntimeError(error)
+    return image
+
+
+def _insights(video: str):
+    async def scenario():
+        import video_insights
+
+        video_insights.initialize()
+        return await asyncio.to_thread(video_insights.get_insights, video)
+
+    return scenario
+
+
+def scenarios(video: Optional[str]) -> Dict[str, Any]:
+    selected = {"chat": _chat, "enhance": _enhance, "imagine": _imagine}
+    if video:
+        selected["insights"] = _insights(video)
+    return selected
+
+
+async def run_scenarios(selected: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    results = {}
+    for name, scenario in selected.items():
+        samples, errors, output_size = [], [], 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            try:
+                output = await scenario()
+                output_size = len(output or "")
+                samples.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {str(e)}")
+        result = {"runs": len(samples), "output_chars": output_size}
+        if samples:
+            result.update({
+                "median_ms": round(statistics.median(samples) * 1000, 1),
+                "min_ms": round(min(samples) * 1000, 1),
+                "max_ms": round(max(samples) * 1000, 1),
+            })
+        if errors:
+            result["errors"] = errors[:3]
+        results[name] = result
+        print(f"{name:<10} {json.dumps(result)}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay provider responses.")
+    parser.add_argument("mode", choices=("record", "replay"))
+    parser.add_argument("cassette", help="Cassette file (JSON lines)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor; 0 replays without delays")
+    parser.add_argument("--strict", action="store_true", help="Only replay exact fingerprint matches")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario")
+    parser.add_argument("--video", help="MP4 file for the video_insights scenario")
+    parser.add_argument("--scenarios", nargs="*", help="Subset of scenarios to run")
+    parser.add_argument("--output", help="Write JSON results to this file (default: stdout)")
+    args = parser.parse_args()
+
+    prepare_environment()
+    selected = scenarios(args.video)
+    if args.scenarios:
+        selected = {name: selected[name] for name in args.scenarios}
+
+    with use_cassette(args.cassette, args.mode, args.speed, args.strict) as cassette:
+        results = asyncio.run(run_scenarios(selected, args.repeat))
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "mode": args.mode,
+        "cassette": args.cassette,
+        "speed": args.speed,
+        "cassette_stats": cassette.stats,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
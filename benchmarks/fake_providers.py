@@ -0,0 +1,377 @@
+"""Local stand-in server for the Groq, Together and Gemini APIs.
+
+Speaks the request/response shapes the bot uses, so the real SDK clients can
+be pointed at it and benchmarks run reproducibly without network access or
+API keys (any non-empty key is accepted):
+
+* Groq (OpenAI style): ``/openai/v1/chat/completions`` (incl. ``stream``),
+  ``/openai/v1/audio/translations`` and ``/openai/v1/audio/transcriptions``
+* Together: ``/v1/images/generations`` and ``/v1/chat/completions``
+* Gemini REST: ``/v1beta/models/<model>:generateContent`` and
+  ``:streamGenerateContent``
+
+Latency comes from a profile per provider: time to first token (log-normal
+jitter), token rate for the body, plus fixed times for images and audio.
+Profiles can also inject 500 errors and 429s with ``Retry-After``.
+
+Usage:
+    python benchmarks/fake_providers.py --port 8787 --profile realistic
+    python benchmarks/fake_providers.py --groq-profile brownout --error-rate 0.02
+
+Then start the bot (or benchmarks/load_test.py --provider-url) with:
+    GROQ_BASE_URL=http://127.0.0.1:8787
+    TOGETHER_BASE_URL=http://127.0.0.1:8787/v1
+    GEMINI_BASE_URL=http://127.0.0.1:8787
+
+``GET /_stats`` returns request counts; ``POST /_profile`` with
+``{"provider": "groq", "profile": "brownout"}`` switches a profile at runtime,
+e.g. to simulate a brownout in the middle of a load test.
+"""
+import json
+import math
+import time
+import zlib
+import base64
+import random
+import struct
+import asyncio
+import logging
+import argparse
+import itertools
+from collections import Counter
+from dataclasses import dataclass, replace, asdict
+from typing import Dict, Optional
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ("groq", "together", "gemini")
+
+FILLER = (
+    "The quick analysis shows several key points worth noting including context "
+    "structure tone and detail with a clear summary at the end of each section"
+).split()
+
+
+@dataclass
+class Profile:
+    ttft: float = 0.3  # Seconds to first token (median)
+    jitter: float = 0.3  # Sigma of the log-normal multiplier on ttft
+    token_rate: float = 200.0  # Completion tokens per second; 0 = all at once
+    completion_tokens: int = 120
+    image_latency: float = 2.0  # Seconds per generated image
+    audio_latency: float = 1.0  # Seconds per transcription/translation
+    error_rate: float = 0.0  # Fraction of requests answered with HTTP 500
+    rate_limit_rate: float = 0.0  # Fraction of requests answered with HTTP 429
+    retry_after: float = 2.0  # Retry-After seconds sent with 429s
+
+
+PROFILES: Dict[str, Profile] = {
+    "instant": Profile(ttft=0.0, jitter=0.0, token_rate=0.0, image_latency=0.0, audio_latency=0.0),
+    "fast": Profile(ttft=0.1, jitter=0.2, token_rate=800.0, image_latency=0.5, audio_latency=0.3),
+    "realistic": Profile(),
+    "slow": Profile(ttft=1.5, jitter=0.5, token_rate=60.0, image_latency=8.0, audio_latency=4.0),
+    "brownout": Profile(
+        ttft=4.0, jitter=0.9, token_rate=20.0, image_latency=20.0, audio_latency=10.0,
+        error_rate=0.05, rate_limit_rate=0.15, retry_after=5.0
+    ),
+}
+
+
+def noise_png(size: int, rng: random.Random) -> str:
+    """Base64 PNG of random RGB noise, so image payloads have a realistic size."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    rows = b"".join(b"\x00" + rng.randbytes(size * 3) for _ in range(size))
+    png = (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows, 1))
+        + chunk(b"IEND", b"")
+    )
+    return base64.b64encode(png).decode()
+
+
+class FakeProviderServer:
+    """aiohttp application emulating the provider APIs."""
+
+    def __init__(self, profiles: Dict[str, Profile], image_size: int = 256, seed: Optional[int] = None):
+        self.profiles = profiles
+        self.rng = random.Random(seed)
+        self.image_b64 = noise_png(image_size, self.rng)
+        self.requests: Counter = Counter()
+        self.responses: Counter = Counter()
+        self._ids = itertools.count(1)
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/openai/v1/chat/completions", self.groq_chat)
+        app.router.add_post("/openai/v1/audio/translations", self.groq_audio)
+        app.router.add_post("/openai/v1/audio/transcriptions", self.groq_audio)
+        app.router.add_post("/v1/chat/completions", self.together_chat)
+        app.router.add_post("/v1/images/generations", self.together_images)
+        app.router.add_post("/{version}/models/{method}", self.gemini)
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_profile", self.set_profile)
+        return app
+
+    # Helpers
+
+    def _ttft(self, profile: Profile) -> float:
+        if profile.ttft <= 0:
+            return 0.0
+        return profile.ttft * math.exp(self.rng.gauss(0, profile.jitter))
+
+    def _text(self, tokens: int) -> str:
+        return " ".join(FILLER[i % len(FILLER)] for i in range(tokens))
+
+    @staticmethod
+    def _prompt_tokens(body: bytes) -> int:
+        return max(1, len(body) // 4)
+
+    async def _inject_failure(self, provider: str, profile: Profile) -> Optional[web.Response]:
+        """Answer with a 429 or 500 according to the profile, or return None."""
+        roll = self.rng.random()
+        if roll < profile.rate_limit_rate:
+            status, message = 429, "Rate limit reached, please retry later"
+        elif roll < profile.rate_limit_rate + profile.error_rate:
+            await asyncio.sleep(self._ttft(profile))
+            status, message = 500, "Internal server error"
+        else:
+            return None
+        self.responses[(provider, status)] += 1
+        headers = {"Retry-After": f"{profile.retry_after:g}"} if status == 429 else {}
+        if provider == "gemini":
+            error = {"code": status, "message": message,
+                     "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"}
+        else:
+            error = {"message": message, "type": "rate_limit_exceeded" if status == 429 else "server_error"}
+        return web.json_response({"error": error}, status=status, headers=headers)
+
+    def _ok(self, provider: str):
+        self.responses[(provider, 200)] += 1
+
+    # OpenAI-style chat (Groq and Together)
+
+    async def _chat(self, request: web.Request, provider: str) -> web.StreamResponse:
+        self.requests[(provider, "chat")] += 1
+        profile = self.profiles[provider]
+        body = await request.read()
+        failure = await self._inject_failure(provider, profile)
+        if failure is not None:
+            return failure
+        payload = json.loads(body or b"{}")
+        model = payload.get("model", "fake-model")
+        tokens = min(profile.completion_tokens, payload.get("max_tokens") or profile.completion_tokens)
+        prompt_tokens = self._prompt_tokens(body)
+        completion_id = f"chatcmpl-fake-{next(self._ids)}"
+        created = int(time.time())
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens}
+
+        await asyncio.sleep(self._ttft(profile))
+        if not payload.get("stream"):
+            if profile.token_rate > 0:
+                await asyncio.sleep(tokens / profile.token_rate)
+            self._ok(provider)
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self._text(tokens)},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        def chunk(delta, finish_reason=None, **extra):
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}],
+                **extra,
+            }
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        await response.write(chunk({"role": "assistant", "content": ""}))
+        for i in range(tokens):
+            if profile.token_rate > 0:
+                await asyncio.sleep(1 / profile.token_rate)
+            await response.write(chunk({"content": FILLER[i % len(FILLER)] + " "}))
+        await response.write(chunk({}, "stop", x_groq={"usage": usage}))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        self._ok(provider)
+        return response
+
+    async def groq_chat(self, request: web.Request) -> web.StreamResponse:
+        return await self._chat(request, "groq")
+
+    async def together_chat(self, request: web.Request) -> web.StreamResponse:
+        return await self._chat(request, "together")
+
+    async def groq_audio(self, request: web.Request) -> web.Response:
+        self.requests[("groq", "audio")] += 1
+        profile = self.profiles["groq"]
+        await request.read()  # Consume the upload like the real endpoint
+        failure = await self._inject_failure("groq", profile)
+        if failure is not None:
+            return failure
+        await asyncio.sleep(profile.audio_latency)
+        self._ok("groq")
+        return web.json_response({"text": self._text(profile.completion_tokens)})
+
+    async def together_images(self, request: web.Request) -> web.Response:
+        self.requests[("together", "images")] += 1
+        profile = self.profiles["together"]
+        payload = json.loads(await request.read() or b"{}")
+        failure = await self._inject_failure("together", profile)
+        if failure is not None:
+            return failure
+        count = int(payload.get("n") or 1)
+        await asyncio.sleep(profile.image_latency * math.exp(self.rng.gauss(0, profile.jitter)))
+        self._ok("together")
+        return web.json_response({
+            "id": f"img-fake-{next(self._ids)}",
+            "model": payload.get("model", "fake-image-model"),
+            "object": "list",
+            "data": [{"index": i, "b64_json": self.image_b64} for i in range(count)],
+        })
+
+    # Gemini REST
+
+    async def gemini(self, request: web.Request) -> web.StreamResponse:
+        model, _, method = request.match_info["method"].partition(":")
+        if method not in ("generateContent", "streamGenerateContent"):
+            raise web.HTTPNotFound()
+        self.requests[("gemini", method)] += 1
+        profile = self.profiles["gemini"]
+        body = await request.read()
+        failure = await self._inject_failure("gemini", profile)
+        if failure is not None:
+            return failure
+        tokens = profile.completion_tokens
+        prompt_tokens = self._prompt_tokens(body)
+
+        def candidate(text, finish_reason=None):
+            data = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0, "safetyRatings": []}
+            if finish_reason:
+                data["finishReason"] = finish_reason
+            return data
+
+        usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": tokens,
+                 "totalTokenCount": prompt_tokens + tokens}
+
+        await asyncio.sleep(self._ttft(profile))
+        if method == "generateContent":
+            if profile.token_rate > 0:
+                await asyncio.sleep(tokens / profile.token_rate)
+            self._ok("gemini")
+            return web.json_response({"candidates": [candidate(self._text(tokens), "STOP")], "usageMetadata": usage})
+
+        # Streamed as SSE (alt=sse) or, by default, as one JSON array written incrementally
+        sse = request.query.get("alt") == "sse"
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream" if sse else "application/json"})
+        await response.prepare(request)
+        step = 8  # Gemini streams a few tokens per chunk
+        if not sse:
+            await response.write(b"[")
+        for start in range(0, tokens, step):
+            count = min(step, tokens - start)
+            if profile.token_rate > 0:
+                await asyncio.sleep(count / profile.token_rate)
+            last = start + count >= tokens
+            data = {"candidates": [candidate(self._text(count) + " ", "STOP" if last else None)]}
+            if last:
+                data["usageMetadata"] = usage
+            encoded = json.dumps(data)
+            if sse:
+                await response.write(f"data: {encoded}\r\n\r\n".encode())
+            else:
+                await response.write(((",\r\n" if start else "") + encoded).encode())
+        if not sse:
+            await response.write(b"]")
+        await response.write_eof()
+        self._ok("gemini")
+        return response
+
+    # Control
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "requests": {f"{provider}/{kind}": count for (provider, kind), count in sorted(self.requests.items())},
+            "responses": {f"{provider}/{status}": count for (provider, status), count in sorted(self.responses.items())},
+            "profiles": {provider: asdict(profile) for provider, profile in self.profiles.items()},
+        })
+
+    async def set_profile(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        provider = data.get("provider")
+        if provider not in PROVIDERS:
+            return web.json_response({"error": f"provider must be one of {PROVIDERS}"}, status=400)
+        profile = self.profiles[provider]
+        if "profile" in data:
+            if data["profile"] not in PROFILES:
+                return web.json_response({"error": f"unknown profile {data['profile']}"}, status=400)
+            profile = PROFILES[data["profile"]]
+        overrides = {key: value for key, value in data.items() if key in Profile.__dataclass_fields__}
+        self.profiles[provider] = replace(profile, **overrides)
+        logger.info(f"{provider} profile is now {self.profiles[provider]}")
+        return web.json_response(asdict(self.profiles[provider]))
+
+
+def build_profiles(args) -> Dict[str, Profile]:
+    overrides = {
+        key: getattr(args, key) for key in Profile.__dataclass_fields__
+        if getattr(args, key, None) is not None
+    }
+    profiles = {}
+    for provider in PROVIDERS:
+        name = getattr(args, f"{provider}_profile") or args.profile
+        profiles[provider] = replace(PROFILES[name], **overrides)
+    return profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Groq/Together/Gemini API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic", help="Profile for all providers")
+    for provider in PROVIDERS:
+        parser.add_argument(f"--{provider}-profile", choices=sorted(PROFILES), help=f"Profile for {provider}")
+    parser.add_argument("--ttft", type=float, help="Override: seconds to first token")
+    parser.add_argument("--jitter", type=float, help="Override: log-normal sigma of latency")
+    parser.add_argument("--token-rate", type=float, help="Override: tokens per second (0 = instant)")
+    parser.add_argument("--completion-tokens", type=int, help="Override: tokens per completion")
+    parser.add_argument("--image-latency", type=float, help="Override: seconds per image")
+    parser.add_argument("--audio-latency", type=float, help="Override: seconds per audio request")
+    parser.add_argument("--error-rate", type=float, help="Override: fraction of HTTP 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, help="Override: fraction of HTTP 429 responses")
+    parser.add_argument("--retry-after", type=float, help="Override: Retry-After seconds on 429")
+    parser.add_argument("--image-size", type=int, default=256, help="Generated image width/height in pixels")
+    parser.add_argument("--seed", type=int, help="Seed for latency and failure injection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = FakeProviderServer(build_profiles(args), image_size=args.image_size, seed=args.seed)
+    base = f"http://{args.host}:{args.port}"
+    print(
+        f"Fake providers on {base}\n"
+        f"  GROQ_BASE_URL={base}\n"
+        f"  TOGETHER_BASE_URL={base}/v1\n"
+        f"  GEMINI_BASE_URL={base}"
+    )
+    web.run_app(server.build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
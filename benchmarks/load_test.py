@@ -0,0 +1,550 @@
+"""Offline load test for the bot.
+
+Builds the real ``Application`` with ``telegram_bot.setup_bot()`` and feeds
+synthetic updates (text, /chat, /imagine, photos, videos, callback queries)
+into its update queue at a configurable rate. Nothing leaves the process:
+
+* Bot API calls go to :class:`FakeTelegramRequest`, an in-memory transport
+  that answers every method (and file downloads) after ``--telegram-latency``
+* Groq, Together and Gemini clients are replaced through
+  ``registry.override`` with fakes that sleep ``--provider-latency``, or,
+  with ``--provider-url``, the real SDK clients talk to a local
+  ``benchmarks/fake_providers.py`` server, or, with ``--cassette``, they
+  get responses replayed from a ``benchmarks/cassettes.py`` recording
+* the MySQL helper is replaced through ``db.override`` with a fake whose
+  calls block for ``--db-latency``, like the real synchronous driver
+* sessions use the memory backend; SQLite side stores go to a temp directory
+
+Reports throughput, end-to-end latency percentiles per update kind (queue
+time included), event-loop lag, RSS growth and call counts as JSON.
+
+Usage:
+    python benchmarks/load_test.py --rate 50 --duration 30 --users 500
+    python benchmarks/load_test.py --mix text=5,chat=2,photo=1,callback=1 --output load.json
+
+Background media jobs (videos) are counted as complete when the handler has
+queued them; their final states are reported under ``media_jobs``.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+import tempfile
+import platform
+from collections import Counter
+from contextlib import nullcontext
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="load-test-")
+
+# Must be in place before the bot modules are imported
+os.environ.update({
+    "TELEGRAM_BOT_TOKEN": "123456:LOADTEST",
+    "ROOT_PASSWORD": "load-test",
+    "ADMIN_USER_ID": "1",
+    "API_KEY": "load-test",
+    "GEMINI_API_KEY": "load-test",
+    "GROQ_API_KEY": "load-test",
+    "TOGETHER_API_KEY": "load-test",
+    "SESSION_BACKEND": "memory",
+    "STARTUP_WARMUP": "false",
+    "STARTUP_PROFILE": "false",
+    "METRICS_ENABLED": "false",
+    "TRACING_ENABLED": "false",
+    "SESSION_DB_PATH": os.path.join(WORKDIR, "sessions.db"),
+    "MEDIA_JOB_DB_PATH": os.path.join(WORKDIR, "jobs.db"),
+    "RESPONSE_CACHE_DB_PATH": os.path.join(WORKDIR, "cache.db"),
+    "OUTBOX_DB_PATH": os.path.join(WORKDIR, "outbox.db"),
+})
+sys.path.insert(0, REPO_ROOT)
+
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest
+
+DEFAULT_MIX = "text=4,chat=2,imagine=1,photo=2,callback=2,video=1"
+
+# Runs after every other handler group, marking the update as processed
+COMPLETION_GROUP = 1000
+
+# 1x1 transparent PNG
+PNG_B64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+
+PROMPTS = ["a cat", "sunset over mountains", "a futuristic city at night", "a bowl of fruit", "an astronaut riding a horse"]
+MESSAGES = ["Hello!", "What can you do?", "Tell me a joke", "Explain recursion briefly", "What's the capital of France?"]
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max in milliseconds (nearest rank)."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(rank(0.50) * 1000, 1),
+        "p95_ms": round(rank(0.95) * 1000, 1),
+        "p99_ms": round(rank(0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1),
+    }
+
+
+def rss_mb() -> float:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1048576
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError):
+        return 0.0
+
+
+class FakeTelegramRequest(BaseRequest):
+    """In-memory Bot API transport."""
+
+    def __init__(self, latency: float = 0.0, file_size: int = 256 * 1024):
+        self.latency = latency
+        self.file_size = file_size
+        self.calls: Counter = Counter()
+        self._ids = itertools.count(1_000_000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data=None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None
+    ):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "/file/bot" in url:
+            self.calls["download"] += 1
+            return 200, b"\0" * self.file_size
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        params = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _message(self, params: Dict[str, Any], **fields) -> Dict[str, Any]:
+        chat_id = params.get("chat_id") or 0
+        return {
+            "message_id": params.get("message_id") or next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **fields,
+        }
+
+    def _result(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        if endpoint == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "LoadTest", "username": "load_test_bot"}
+        if endpoint in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        if endpoint == "sendPhoto":
+            file_id = f"photo-{next(self._ids)}"
+            return self._message(params, photo=[
+                {"file_id": file_id, "file_unique_id": file_id, "width": 1024, "height": 768}
+            ])
+        if endpoint in ("sendDocument", "editMessageReplyMarkup"):
+            return self._message(params)
+        if endpoint == "getFile":
+            file_id = params.get("file_id", "file")
+            return {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": self.file_size,
+                "file_path": f"files/{file_id}",
+            }
+        if endpoint == "getUpdates":
+            return []
+        return True
+
+
+class FakeProviders:
+    """Stand-ins for the Groq, Together and Gemini clients."""
+
+    def __init__(self, latency: float, rng: random.Random):
+        self.latency = latency
+        self.rng = rng
+        self.calls: Counter = Counter()
+
+    def _delay(self) -> float:
+        return self.latency * self.rng.uniform(0.5, 1.5)
+
+    @staticmethod
+    def _completion(text: str):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+            usage=SimpleNamespace(prompt_tokens=64, completion_tokens=len(text.split()))
+        )
+
+    def groq(self):
+        def create(**kwargs):
+            self.calls["groq"] += 1
+            time.sleep(self._delay())
+            return self._completion("A detailed, vivid answer from the load test model.")
+
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    def async_groq(self):
+        async def stream(delay):
+            words = "This is a streamed reply from the load test model .".split()
+            for word in words:
+                await asyncio.sleep(delay / len(words))
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+
+        async def create(**kwargs):
+            self.calls["groq-async"] += 1
+            if kwargs.get("stream"):
+                return stream(self._delay())
+            await asyncio.sleep(self._delay())
+            return self._completion("Summary of the conversation so far.")
+
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    def together(self):
+        def generate(**kwargs):
+            self.calls["together"] += 1
+            time.sleep(self._delay() * 4)  # Image generation is the slowest call
+            return SimpleNamespace(data=[SimpleNamespace(b64_json=PNG_B64)])
+
+        return SimpleNamespace(images=SimpleNamespace(generate=generate))
+
+    def gemini(self):
+        def generate_content(*args, **kwargs):
+            self.calls["gemini"] += 1
+            time.sleep(self._delay() * 2)
+            return SimpleNamespace(
+                text="The video shows a load test.",
+                usage_metadata=SimpleNamespace(prompt_token_count=512, candidates_token_count=16)
+            )
+
+        return SimpleNamespace(generate_content=generate_content)
+
+
+class FakeDatabase:
+    """Accepts every DatabaseHelper call; blocks like the synchronous MySQL driver."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    def __getattr__(self, name: str):
+        def call(*args, **kwargs):
+            self.calls[name] += 1
+            if self.latency:
+                time.sleep(self.latency)
+            return None
+
+        return call
+
+
+class UpdateFactory:
+    """Builds synthetic updates as the Bot API would deliver them."""
+
+    def __init__(self, bot, rng: random.Random):
+        self.bot = bot
+        self.rng = rng
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self.photo_senders = set()
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, **fields) -> Dict[str, Any]:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **fields,
+        }
+
+    def _command(self, user_id: int, command: str, args: str) -> Dict[str, Any]:
+        entity = {"type": "bot_command", "offset": 0, "length": len(command) + 1}
+        return {"message": self._message(user_id, text=f"/{command} {args}", entities=[entity])}
+
+    def _file(self, prefix: str) -> Dict[str, str]:
+        file_id = f"{prefix}-{next(self._file_ids)}"
+        return {"file_id": file_id, "file_unique_id": file_id}
+
+    def build(self, kind: str, user_id: int):
+        """Returns ``(kind, update)``; the kind may change (callbacks need a photo first)."""
+        if kind == "callback" and user_id not in self.photo_senders:
+            kind = "photo"  # Buttons only make sense after a photo
+        if kind == "text":
+            payload = {"message": self._message(user_id, text=self.rng.choice(MESSAGES))}
+        elif kind == "chat":
+            payload = self._command(user_id, "chat", self.rng.choice(MESSAGES))
+        elif kind == "imagine":
+            payload = self._command(user_id, "imagine", self.rng.choice(PROMPTS))
+        elif kind == "photo":
+            self.photo_senders.add(user_id)
+            payload = {"message": self._message(user_id, photo=[
+                {**self._file("photo"), "width": 1280, "height": 960, "file_size": 200_000}
+            ])}
+        elif kind == "video":
+            payload = {"message": self._message(user_id, video={
+                **self._file("video"), "width": 640, "height": 360, "duration": 30
+            })}
+        elif kind == "callback":
+            action = self.rng.choice(["describe", "caption"])
+            payload = {"callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": "load-test",
+                "data": f"{action}_{next(self._message_ids)}",
+                "message": self._message(user_id, text="What would you like to do with this image?"),
+            }}
+        else:
+            raise ValueError(f"Unknown update kind: {kind}")
+        return kind, Update.de_json({"update_id": next(self._update_ids), **payload}, self.bot)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        weights[kind.strip()] = float(weight or 1)
+    return weights
+
+
+class LoadTest:
+    """Drives an Application with synthetic updates and collects measurements."""
+
+    def __init__(self, application, factory: UpdateFactory, rate: float, duration: float,
+                 users: int, mix: Dict[str, float], rng: random.Random):
+        self.application = application
+        self.factory = factory
+        self.rate = rate
+        self.duration = duration
+        self.users = users
+        self.mix = mix
+        self.rng = rng
+        self.pending: Dict[int, tuple] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.sent: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.lags: List[float] = []
+        self.memory: List[float] = []
+        self._drained = asyncio.Event()
+
+    async def _on_processed(self, update: Update, context):
+        entry = self.pending.pop(update.update_id, None)
+        if entry is not None:
+            kind, enqueued = entry
+            self.latencies.setdefault(kind, []).append(time.perf_counter() - enqueued)
+        if not self.pending:
+            self._drained.set()
+
+    async def _on_error(self, update, context):
+        self.errors[type(context.error).__name__] += 1
+
+    async def _monitor(self, interval: float = 0.05):
+        """Sample event-loop lag continuously and RSS once a second."""
+        loop = asyncio.get_running_loop()
+        last_memory = 0.0
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.lags.append(max(0.0, loop.time() - started - interval))
+            if started - last_memory >= 1.0:
+                self.memory.append(rss_mb())
+                last_memory = started
+
+    async def run(self, drain_timeout: float) -> Dict[str, Any]:
+        self.application.add_handler(TypeHandler(Update, self._on_processed), group=COMPLETION_GROUP)
+        self.application.add_error_handler(self._on_error)
+        kinds = list(self.mix)
+        weights = [self.mix[kind] for kind in kinds]
+        monitor = asyncio.create_task(self._monitor())
+        memory_start = rss_mb()
+
+        started = time.perf_counter()
+        next_at = started
+        while next_at - started < self.duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind, update = self.factory.build(
+                self.rng.choices(kinds, weights)[0], self.rng.randint(2, self.users + 1)
+            )
+            self.pending[update.update_id] = (kind, time.perf_counter())
+            self._drained.clear()
+            self.sent[kind] += 1
+            await self.application.update_queue.put(update)
+            # Poisson arrivals
+            next_at += self.rng.expovariate(self.rate)
+        send_time = time.perf_counter() - started
+
+        if self.pending:
+            try:
+                await asyncio.wait_for(self._drained.wait(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        elapsed = time.perf_counter() - started
+        monitor.cancel()
+        memory_end = rss_mb()
+
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        completed = len(all_latencies)
+        return {
+            "sent": sum(self.sent.values()),
+            "sent_by_kind": dict(self.sent),
+            "completed": completed,
+            "unfinished": len(self.pending),
+            "handler_errors": dict(self.errors),
+            "send_seconds": round(send_time, 2),
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput_per_s": round(completed / elapsed, 2) if elapsed else 0.0,
+            "latency": {"all": percentiles(all_latencies), **{
+                kind: percentiles(values) for kind, values in sorted(self.latencies.items())
+            }},
+            "event_loop_lag": percentiles(self.lags),
+            "memory_mb": {
+                "start": round(memory_start, 1),
+                "end": round(memory_end, 1),
+                "peak": round(max(self.memory + [memory_end]), 1),
+                "growth": round(memory_end - memory_start, 1),
+            },
+        }
+
+
+async def wait_for_jobs(media_jobs, timeout: float) -> Dict[str, int]:
+    """Give queued media jobs a chance to finish; returns job counts by state."""
+    deadline = time.monotonic() + timeout
+    while True:
+        stats = await media_jobs.stats()
+        states = stats["states"]
+        if (not states.get("queued") and not states.get("running")) or time.monotonic() > deadline:
+            return states
+        await asyncio.sleep(0.2)
+
+
+async def run(args) -> Dict[str, Any]:
+    if args.provider_url:
+        # Read by client_registry at import time
+        base = args.provider_url.rstrip("/")
+        os.environ.update({
+            "GROQ_BASE_URL": base,
+            "TOGETHER_BASE_URL": f"{base}/v1",
+            "GEMINI_BASE_URL": base,
+        })
+    if args.cassette:
+        # Recordings are made over Gemini's REST transport
+        os.environ["GEMINI_TRANSPORT"] = "rest"
+
+    import telegram_bot
+    from client_registry import registry
+
+    rng = random.Random(args.seed)
+    transport = FakeTelegramRequest(latency=args.telegram_latency)
+    providers = FakeProviders(args.provider_latency, rng)
+    database = FakeDatabase(args.db_latency)
+    fake_providers = not (args.provider_url or args.cassette)
+    if fake_providers:
+        registry.override("groq", providers.groq())
+        registry.override("groq-async", providers.async_groq())
+        registry.override("together", providers.together())
+        registry.override("gemini", providers.gemini())
+    telegram_bot.db.override(database)
+
+    application = telegram_bot.setup_bot(request=transport)
+    replay = nullcontext()
+    if args.cassette:
+        from cassettes import use_cassette
+
+        replay = use_cassette(args.cassette, "replay", args.replay_speed)
+    with replay as cassette:
+        report = await drive(application, args, rng)
+
+    report["telegram_calls"] = dict(transport.calls)
+    if fake_providers:
+        report["provider_calls"] = dict(providers.calls)
+    if cassette is not None:
+        report["cassette"] = cassette.stats
+    report["db_calls"] = sum(database.calls.values())
+    return report
+
+
+async def drive(application, args, rng) -> Dict[str, Any]:
+    """Start the application, send the updates and shut it down again."""
+    from media_jobs import media_jobs
+
+    async with application:
+        # Same lifecycle as webhook mode: post_init/post_shutdown are called by hand
+        await application.post_init(application)
+        await application.start()
+        factory = UpdateFactory(application.bot, rng)
+        test = LoadTest(application, factory, args.rate, args.duration, args.users, parse_mix(args.mix), rng)
+        report = await test.run(args.drain_timeout)
+        report["media_jobs"] = await wait_for_jobs(media_jobs, args.drain_timeout)
+        await application.stop()
+        await application.post_shutdown(application)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test with synthetic Telegram updates.")
+    parser.add_argument("--rate", type=float, default=20.0, help="Updates per second (Poisson arrivals)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to send updates for")
+    parser.add_argument("--users", type=int, default=200, help="Distinct synthetic users")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Update kinds and weights")
+    parser.add_argument("--provider-latency", type=float, default=0.5, help="Mean fake provider latency (s)")
+    parser.add_argument("--provider-url", help="Use the real SDKs against a fake_providers.py server at this URL")
+    parser.add_argument("--cassette", help="Use the real SDKs with responses replayed from this cassette")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Cassette replay speed; 0 for no delays")
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="Fake Bot API latency (s)")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Blocking time per DB call (s)")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Seconds to wait for in-flight work")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+        **asyncio.run(run(args)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Startup and import-time benchmark.
+
+Measures, each in a fresh Python process:
+
+* cold import time of every bot module
+* time to ``telegram_bot.setup_bot()`` (import + handler registration)
+* peak RSS of the process once it has started
+
+Provider SDKs (Groq, Together, Gemini) and the MySQL driver are replaced by
+stub modules in the child processes, so no network or database is needed and
+the numbers reflect our own code. Pass ``--no-stub`` to use the real packages.
+
+Usage:
+    python benchmarks/startup_benchmark.py --repeat 5 --output startup.json
+    python benchmarks/startup_benchmark.py --compare startup.json --max-regression 20
+
+With ``--compare``, the run exits with status 1 if any median is more than
+``--max-regression`` percent slower than in the baseline file.
+"""
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import importlib
+import importlib.abc
+import importlib.machinery
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "telegram_bot",
+    "video_insights",
+    "video_summary",
+    "audio_transcribe",
+    "image_generator",
+    "image_caption",
+    "tone_enhancer",
+    "monitoring",
+    "main",
+]
+
+# Packages replaced by stubs in the child process
+STUBBED_PACKAGES = ("groq", "together", "google.generativeai", "mysql")
+
+# Dummy configuration so modules that validate settings at import succeed
+BENCHMARK_ENV = {
+    "TELEGRAM_BOT_TOKEN": "123456:BENCHMARK",
+    "ROOT_PASSWORD": "benchmark",
+    "ADMIN_USER_ID": "1",
+    "API_KEY": "benchmark",
+    "GEMINI_API_KEY": "benchmark",
+    "GROQ_API_KEY": "benchmark",
+    "TOGETHER_API_KEY": "benchmark",
+    "SESSION_BACKEND": "memory",
+    "STARTUP_WARMUP": "false",
+    "STARTUP_PROFILE": "false",
+}
+
+
+class _StubModule(types.ModuleType):
+    """Module whose every attribute is a permissive stub class."""
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        stub = type(name, (_Stub,), {})
+        setattr(self, name, stub)
+        return stub
+
+
+class _Stub:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return _Stub()
+
+    def __getattr__(self, name):
+        return _Stub()
+
+
+class _StubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def find_spec(self, fullname, path=None, target=None):
+        if any(fullname == p or fullname.startswith(p + ".") or p.startswith(fullname + ".")
+               for p in STUBBED_PACKAGES):
+            return importlib.machinery.ModuleSpec(fullname, self, is_package=True)
+        return None
+
+    def create_module(self, spec):
+        module = _StubModule(spec.name)
+        module.__path__ = []
+        return module
+
+    def exec_module(self, module):
+        pass
+
+
+def _peak_rss_kb() -> int:
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_child(mode: str, target: str, stub: bool) -> dict:
+    """Executed inside the fresh child process."""
+    if stub:
+        sys.meta_path.insert(0, _StubFinder())
+    sys.path.insert(0, REPO_ROOT)
+    started = time.perf_counter()
+    if mode == "import":
+        importlib.import_module(target)
+    elif mode == "setup_bot":
+        bot_module = importlib.import_module("telegram_bot")
+        imported = time.perf_counter()
+        bot_module.setup_bot()
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+    elapsed = time.perf_counter() - started
+    result = {"seconds": elapsed, "peak_rss_kb": _peak_rss_kb()}
+    if mode == "setup_bot":
+        result["import_seconds"] = imported - started
+    return result
+
+
+def measure(mode: str, target: str, stub: bool, workdir: str) -> dict:
+    env = dict(os.environ)
+    env.update(BENCHMARK_ENV)
+    # Keep SQLite files and media folders out of the working tree
+    for name in ("SESSION_DB_PATH", "MEDIA_JOB_DB_PATH", "RESPONSE_CACHE_DB_PATH", "OUTBOX_DB_PATH"):
+        env[name] = os.path.join(workdir, name.lower() + ".db")
+    command = [sys.executable, os.path.abspath(__file__), "--child", mode, target]
+    if not stub:
+        command.append("--no-stub")
+    completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        return {"error": error[0]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples: list) -> dict:
+    ok = [s for s in samples if "error" not in s]
+    if not ok:
+        return {"error": samples[0]["error"]}
+    seconds = [s["seconds"] for s in ok]
+    summary = {
+        "median_ms": round(statistics.median(seconds) * 1000, 1),
+        "min_ms": round(min(seconds) * 1000, 1),
+        "max_ms": round(max(seconds) * 1000, 1),
+        "peak_rss_mb": round(max(s["peak_rss_kb"] for s in ok) / 1024, 1),
+        "runs": len(ok),
+    }
+    if "import_seconds" in ok[0]:
+        summary["import_median_ms"] = round(statistics.median(s["import_seconds"] for s in ok) * 1000, 1)
+    return summary
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_benchmarks(modules: list, repeat: int, stub: bool) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="startup-bench-") as workdir:
+        targets = [("import", module) for module in modules] + [("setup_bot", "telegram_bot")]
+        for mode, target in targets:
+            name = target if mode == "import" else "setup_bot"
+            samples = [measure(mode, target, stub, workdir) for _ in range(repeat)]
+            results[name] = summarize(samples)
+            print(f"{name:<20} {json.dumps(results[name])}", file=sys.stderr)
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stubbed_providers": stub,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, max_regression: float) -> list:
+    """Return descriptions of medians that regressed beyond the threshold."""
+    regressions = []
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name, {})
+        if "median_ms" not in result or not before.get("median_ms"):
+            continue
+        change = (result["median_ms"] - before["median_ms"]) / before["median_ms"] * 100
+        if change > max_regression:
+            regressions.append(f"{name}: {before['median_ms']} ms -> {result['median_ms']} ms (+{change:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bot import and startup time.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--modules", nargs="*", default=MODULES, help="Modules to import")
+    parser.add_argument("--output", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="Allowed slowdown in percent")
+    parser.add_argument("--no-stub", action="store_true", help="Import the real provider SDKs")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "TARGET"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child[0], args.child[1], stub=not args.no_stub)))
+        return
+
+    report = run_benchmarks(args.modules, args.repeat, stub=not args.no_stub)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""Circuit breakers and hedged requests for provider models.
+
+Each (provider, model) pair gets a :class:`CircuitBreaker` that watches the
+last ``BREAKER_WINDOW`` calls. Calls that fail with a transient error (429,
+5xx, timeout or connection error, see :func:`retry_policy.classify`), or
+take longer than ``BREAKER_SLOW_CALL_SECONDS``, count as failures; errors
+such as a rejected API key or a bad request say nothing about the endpoint
+and are not counted. Calls made with a user's own API key get breakers of
+their own (scoped by key fingerprint), so one user's bad or rate-limited key
+can't open the circuit for everyone. When the failure rate
+reaches ``BREAKER_FAILURE_RATE`` the circuit opens and calls fail at once
+with :class:`CircuitOpenError` instead of waiting on a degraded endpoint.
+After ``BREAKER_OPEN_SECONDS`` the circuit goes half-open and lets
+``BREAKER_HALF_OPEN_PROBES`` calls through: a success closes it, a failure
+opens it again.
+
+:func:`hedged` runs idempotent calls (chat, describe, caption, enhance) with
+a fallback model from ``HEDGE_FALLBACKS``. The fallback always takes over
+while the primary's circuit is open. With ``HEDGING_ENABLED``, a second
+request also goes to the fallback when the primary has failed or has not
+answered within its recent p95 latency; whichever succeeds first wins and
+the other is cancelled. Timer-triggered hedges are capped at ``HEDGE_BUDGET``
+of calls so a brownout doesn't double the load.
+"""
+import os
+import time
+import asyncio
+import inspect
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+from dotenv import load_dotenv
+from metrics import BREAKER_STATE, BREAKER_REJECTED, HEDGES
+from retry_policy import classify
+from client_registry import key_fingerprint
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BREAKER_ENABLED = os.getenv('BREAKER_ENABLED', 'true').lower() == 'true'
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))  # Recent calls considered
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))  # Calls needed before the circuit can open
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '20'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv('BREAKER_HALF_OPEN_PROBES', '1'))
+
+HEDGING_ENABLED = os.getenv('HEDGING_ENABLED', 'false').lower() == 'true'
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.5'))  # Seconds
+HEDGE_MAX_DELAY = float(os.getenv('HEDGE_MAX_DELAY', '10'))
+HEDGE_DEFAULT_DELAY = float(os.getenv('HEDGE_DEFAULT_DELAY', '3'))  # Until enough latencies are known
+HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', '0.1'))  # Max share of calls that may be hedged
+
+# provider:model=fallback_model, comma separated
+DEFAULT_HEDGE_FALLBACKS = (
+    "groq:llama3-70b-8192=llama3-8b-8192,"
+    "groq:mixtral-8x7b-32768=llama3-70b-8192,"
+    "groq:llama3-8b-8192=gemma-7b-it,"
+    "groq:llama-3.2-11b-vision-preview=llama-3.2-90b-vision-preview"
+)
+
+# The bot's own keys share one breaker per model; any other key is scoped by fingerprint
+SHARED_KEYS = {
+    key for key in (os.getenv('GROQ_API_KEY'), os.getenv('TOGETHER_API_KEY'), os.getenv('API_KEY'))
+    if key
+}
+
+# Successful call durations kept per model for the p95 estimate
+LATENCY_SAMPLES = 100
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """The circuit for a provider model is open; the call was not attempted."""
+
+    def __init__(self, provider: str, model: str, retry_after: float):
+        self.provider = provider
+        self.model = model
+        self.retry_after = retry_after
+        super().__init__(
+            f"{provider} {model} is temporarily unavailable, retry in {max(1, round(retry_after))}s"
+        )
+
+
+def parse_fallbacks(value: str) -> Dict[Tuple[str, str], str]:
+    fallbacks = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        try:
+            target, fallback = item.split("=", 1)
+            provider, model = target.split(":", 1)
+            fallbacks[(provider.strip(), model.strip())] = fallback.strip()
+        except ValueError:
+            logger.warning(f"Invalid HEDGE_FALLBACKS entry: {item}")
+    return fallbacks
+
+
+def key_scope(api_key: Optional[str]) -> Optional[str]:
+    """Breaker scope for calls made with ``api_key``: None for the bot's own keys."""
+    if not api_key or api_key in SHARED_KEYS:
+        return None
+    return key_fingerprint(api_key)
+
+
+class CallTimer:
+    """Start time of a guarded call; restart it once queueing is over."""
+
+    __slots__ = ("started",)
+
+    def __init__(self):
+        self.started = time.perf_counter()
+
+    def restart(self):
+        self.started = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+class CircuitBreaker:
+    """Closed / open / half-open state machine for one provider model."""
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        scope: Optional[str] = None,
+        window: int = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        half_open_probes: int = BREAKER_HALF_OPEN_PROBES
+    ):
+        self.provider = provider
+        self.model = model
+        self.scope = scope
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            scope = f" (key {self.scope})" if self.scope else ""
+            logger.warning(f"Circuit for {self.provider} {self.model}{scope}: {self.state} -> {state}")
+            self.state = state
+        if self.scope is None:
+            # Per-key breakers would make the label set unbounded
+            BREAKER_STATE.set(STATE_VALUES[state], provider=self.provider, model=self.model)
+
+    def acquire(self):
+        """Admit a call or raise :class:`CircuitOpenError`."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    self._reject(remaining)
+                self._set_state(HALF_OPEN)
+                self.probes = 0
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_probes:
+                    self._reject(self.open_seconds)
+                self.probes += 1
+
+    def _reject(self, retry_after: float):
+        self.rejected += 1
+        BREAKER_REJECTED.inc(provider=self.provider, model=self.model)
+        raise CircuitOpenError(self.provider, self.model, retry_after)
+
+    def release(self):
+        """Give back a call slot without an outcome (the call was cancelled)."""
+        with self._lock:
+            if self.state == HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def record(self, duration: float, ok: bool):
+        failed = not ok or duration >= self.slow_call_seconds
+        with self._lock:
+            if ok:
+                self._latencies.append(duration)
+            if self.state == HALF_OPEN:
+                self.probes = max(0, self.probes - 1)
+                if failed:
+                    self._open()
+                else:
+                    self._outcomes.clear()
+                    self._set_state(CLOSED)
+                return
+            self._outcomes.append(failed)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls:
+                if sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                    self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._set_state(OPEN)
+
+    def p95(self) -> Optional[float]:
+        """95th percentile of recent successful call durations."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < 20:
+            return None
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def hedge_delay(self) -> float:
+        p95 = self.p95()
+        if p95 is None:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, p95))
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            outcomes = list(self._outcomes)
+        p95 = self.p95()
+        return {
+            "state": self.state,
+            "calls": len(outcomes),
+            "failure_rate": round(sum(outcomes) / len(outcomes), 2) if outcomes else 0.0,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "rejected": self.rejected,
+        }
+
+
+class BreakerRegistry:
+    """One breaker per (provider, model, key scope), created on first use.
+
+    Observers are called with ``(provider, model, duration, ok)`` after
+    guarded calls, even with breakers disabled (e.g. to feed the model
+    router). Failures on a user's own key are not passed on: they say more
+    about that key than about the model.
+    """
+
+    def __init__(self, enabled: bool = BREAKER_ENABLED):
+        self.enabled = enabled
+        self._breakers: Dict[Tuple[str, str, Optional[str]], CircuitBreaker] = {}
+        self._observers: List[Callable[[str, str, float, bool], None]] = []
+        self._lock = threading.Lock()
+
+    def add_observer(self, observer: Callable[[str, str, float, bool], None]):
+        self._observers.append(observer)
+
+    def get(self, provider: str, model: str, scope: Optional[str] = None) -> CircuitBreaker:
+        key = (provider, model, scope)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker(provider, model, scope))
+        return breaker
+
+    @contextmanager
+    def guard(self, provider: str, model: str, scope: Optional[str] = None) -> Iterator[CallTimer]:
+        """Check the circuit before the wrapped call and record its outcome. Works around ``await``.
+
+        Yields a :class:`CallTimer`; call its ``restart()`` once the call
+        stops waiting for a local slot, so queueing doesn't count as slowness.
+        """
+        breaker = self.get(provider, model, scope) if self.enabled else None
+        if breaker is not None:
+            breaker.acquire()
+        timer = CallTimer()
+        try:
+            yield timer
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.release()
+            raise
+        except Exception as e:
+            if classify(e) is None:
+                # Not the endpoint's fault (bad key, bad request...): no outcome to record
+                if breaker is not None:
+                    breaker.release()
+            else:
+                self._record(breaker, provider, model, scope, timer.elapsed(), ok=False)
+            raise
+        self._record(breaker, provider, model, scope, timer.elapsed(), ok=True)
+
+    def _record(
+        self,
+        breaker: Optional[CircuitBreaker],
+        provider: str,
+        model: str,
+        scope: Optional[str],
+        duration: float,
+        ok: bool
+    ):
+        if breaker is not None:
+            breaker.record(duration, ok)
+        if scope is not None and not ok:
+            return
+        for observer in self._observers:
+            try:
+                observer(provider, model, duration, ok)
+            except Exception as e:
+                logger.error(f"Breaker observer failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {
+            f"{provider}/{model}" + (f"@{scope}" if scope else ""): breaker.stats()
+            for (provider, model, scope), breaker in list(self._breakers.items())
+        }
+
+    def summary(self) -> List[str]:
+        """One line per breaker for the admin latency report."""
+        lines = []
+        for name, stats in self.stats().items():
+            p95 = f"{stats['p95_ms']}ms" if stats["p95_ms"] is not None else "n/a"
+            lines.append(
+                f"{name}: {stats['state']} failures={stats['failure_rate']:.0%} "
+                f"p95={p95} rejected={stats['rejected']}"
+            )
+        return lines
+
+
+class Hedger:
+    """Runs idempotent calls against a primary model with a fallback."""
+
+    def __init__(
+        self,
+        breakers: BreakerRegistry,
+        fallbacks: Dict[Tuple[str, str], str],
+        enabled: bool = HEDGING_ENABLED,
+        budget: float = HEDGE_BUDGET
+    ):
+        self.breakers = breakers
+        self.fallbacks = fallbacks
+        self.enabled = enabled
+        self.budget = budget
+        self.calls = 0
+        self.hedges = 0
+
+    def _may_hedge(self) -> bool:
+        return self.hedges < self.budget * self.calls
+
+    async def run(self, provider: str, model: str, call: Callable[[str], Awaitable[T]]) -> Tuple[T, str]:
+        """Run ``call(model)``, falling back to (or hedging with) the configured fallback model.
+
+        ``call`` must be safe to run twice: the loser is cancelled, but its
+        provider request may already have been sent.
+
+        Returns:
+            tuple: (result, model that produced it)
+        """
+        fallback = self.fallbacks.get((provider, model))
+        if fallback is None:
+            return await call(model), model
+        self.calls += 1
+        if not self.enabled:
+            try:
+                return await call(model), model
+            except CircuitOpenError:
+                HEDGES.inc(provider=provider, model=model, outcome="failover")
+                return await call(fallback), fallback
+
+        primary = asyncio.ensure_future(call(model))
+        tasks = {primary: "primary"}
+        winner = primary  # Until a hedge is sent
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.breakers.get(provider, model).hedge_delay())
+            if done and primary.exception() is None:
+                return primary.result(), model
+            if not done:
+                if not self._may_hedge():
+                    return await primary, model
+                self.hedges += 1
+            tasks[asyncio.ensure_future(call(fallback))] = "fallback"
+            winner = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is not None:
+                    HEDGES.inc(provider=provider, model=model, outcome=tasks[winner])
+                    return winner.result(), (model if winner is primary else fallback)
+            HEDGES.inc(provider=provider, model=model, outcome="failed")
+            raise primary.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task is not winner and not task.cancelled() and task.exception() is None:
+                    # Both answered in the same round: the loser may hold an open stream
+                    await self._discard(task.result())
+
+    async def _discard(self, result: object):
+        """Close a losing result that holds a connection, such as a streaming response."""
+        close = getattr(result, "aclose", None) or getattr(result, "close", None)
+        if close is None:
+            return
+        try:
+            closed = close()
+            if inspect.isawaitable(closed):
+                await closed
+        except Exception as e:
+            logger.warning(f"Closing a discarded hedge result failed: {str(e)}")
+
+    def stats(self) -> Dict[str, object]:
+        return {"enabled": self.enabled, "calls": self.calls, "hedges": self.hedges}
+
+
+# Shared instances used across the bot
+breakers = BreakerRegistry()
+hedger = Hedger(breakers, parse_fallbacks(os.getenv('HEDGE_FALLBACKS', DEFAULT_HEDGE_FALLBACKS)))
+hedged = hedger.run
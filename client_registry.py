@@ -0,0 +1,252 @@
+"""Registry of long-lived provider clients.
+
+Building a Groq, Together or Gemini client on every request means a new
+HTTP connection pool (and TLS handshake) each time. Clients are cached here
+keyed by ``(provider, api_key, model)`` and share keep-alive connection
+pools, using HTTP/2 when the ``h2`` package is installed. Clients that have
+not been used for ``PROVIDER_CLIENT_IDLE_TTL`` seconds are closed and evicted,
+so callers look clients up on each use instead of holding on to them.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import importlib.util
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = int(os.getenv('PROVIDER_MAX_CONNECTIONS', '20'))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('PROVIDER_MAX_KEEPALIVE', '10'))
+KEEPALIVE_EXPIRY = float(os.getenv('PROVIDER_KEEPALIVE_EXPIRY', '60'))
+CLIENT_IDLE_TTL = float(os.getenv('PROVIDER_CLIENT_IDLE_TTL', '600'))
+HTTP_TIMEOUT = float(os.getenv('PROVIDER_HTTP_TIMEOUT', '60'))
+USE_HTTP2 = os.getenv('PROVIDER_HTTP2', 'true').lower() == 'true'
+
+# Alternative API endpoints, e.g. the local stand-in from benchmarks/fake_providers.py
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL')
+TOGETHER_BASE_URL = os.getenv('TOGETHER_BASE_URL')
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL')
+# "rest" sends Gemini calls over HTTP instead of gRPC (needed for cassette recording)
+GEMINI_TRANSPORT = os.getenv('GEMINI_TRANSPORT')
+
+# How often (at most) the idle sweep runs, in seconds
+SWEEP_INTERVAL = 30.0
+
+
+def _http2_available() -> bool:
+    return USE_HTTP2 and importlib.util.find_spec("h2") is not None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+
+def key_fingerprint(api_key: Optional[str]) -> str:
+    """Hash API keys so raw secrets are never kept in registry keys or stats."""
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+class _Entry:
+    __slots__ = ("client", "http_client", "last_used", "created")
+
+    def __init__(self, client: Any, http_client: Any = None):
+        self.client = client
+        self.http_client = http_client
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+
+class ClientRegistry:
+    """Thread-safe cache of provider clients with idle eviction."""
+
+    def __init__(self, idle_ttl: float = CLIENT_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._entries: Dict[Tuple[str, str, Optional[str]], _Entry] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.created_count = 0
+        self.hit_count = 0
+        self.evicted_count = 0
+        self._gemini_api_key = os.getenv('GEMINI_API_KEY')
+        self._gemini_configured_key: Optional[str] = None
+        self._overrides: Dict[str, Any] = {}
+
+    def set_gemini_api_key(self, api_key: Optional[str]):
+        """Set the key the Gemini SDK is configured with when a model is next built."""
+        self._gemini_api_key = api_key
+
+    def override(self, provider: str, client: Any):
+        """Return ``client`` for every key and model of ``provider`` (e.g. fakes for load tests).
+
+        Provider names: "groq", "groq-async", "together", "gemini".
+        """
+        with self._lock:
+            self._overrides[provider] = client
+
+    def clear_overrides(self):
+        with self._lock:
+            self._overrides.clear()
+
+    def _get_or_create(
+        self,
+        provider: str,
+        api_key: Optional[str],
+        model: Optional[str],
+        factory: Callable[[], Tuple[Any, Any]]
+    ) -> Any:
+        key = (provider, key_fingerprint(api_key), model)
+        self._maybe_sweep()
+        with self._lock:
+            if provider in self._overrides:
+                return self._overrides[provider]
+            entry = self._entries.get(key)
+            if entry is None:
+                client, http_client = factory()
+                entry = _Entry(client, http_client)
+                self._entries[key] = entry
+                self.created_count += 1
+                logger.info(f"Created {provider} client (model={model or 'any'})")
+            else:
+                self.hit_count += 1
+            entry.last_used = time.monotonic()
+            return entry.client
+
+    def groq(self, api_key: Optional[str]):
+        """Synchronous Groq client sharing a keep-alive connection pool."""
+        def factory():
+            from groq import Groq
+            http_client = httpx.Client(
+                http2=_http2_available(),
+                limits=_limits(),
+                timeout=HTTP_TIMEOUT
+            )
+            # Retries are handled by retry_policy, so the SDK's own are turned off
+            return Groq(
+                api_key=api_key, http_client=http_client, base_url=GROQ_BASE_URL, max_retries=0
+            ), http_client
+
+        return self._get_or_create("groq", api_key, None, factory)
+
+    def async_groq(self, api_key: Optional[str]):
+        """Async Groq client sharing a keep-alive connection pool."""
+        def factory():
+            from groq import AsyncGroq
+            http_client = httpx.AsyncClient(
+                http2=_http2_available(),
+                limits=_limits(),
+                timeout=HTTP_TIMEOUT
+            )
+            return AsyncGroq(
+                api_key=api_key, http_client=http_client, base_url=GROQ_BASE_URL, max_retries=0
+            ), http_client
+
+        return self._get_or_create("groq-async", api_key, None, factory)
+
+    def together(self, api_key: Optional[str]):
+        """Together client. The SDK manages its own requests session."""
+        def factory():
+            from together import Together
+            return Together(api_key=api_key, base_url=TOGETHER_BASE_URL, max_retries=0), None
+
+        return self._get_or_create("together", api_key, None, factory)
+
+    def gemini_model(self, model_name: str, api_key: Optional[str] = None):
+        """Gemini GenerativeModel for the given model name.
+
+        The SDK is imported and configured here, on first use, rather than at
+        import time, because importing it is slow.
+        """
+        def factory():
+            import google.generativeai as genai
+            key = api_key or self._gemini_api_key
+            if key and key != self._gemini_configured_key:
+                options = {}
+                if GEMINI_TRANSPORT:
+                    options["transport"] = GEMINI_TRANSPORT
+                if GEMINI_BASE_URL:
+                    # The REST transport accepts a plain http:// endpoint, gRPC does not
+                    options = {"transport": "rest", "client_options": {"api_endpoint": GEMINI_BASE_URL}}
+                genai.configure(api_key=key, **options)
+                self._gemini_configured_key = key
+            return genai.GenerativeModel(model_name), None
+
+        return self._get_or_create("gemini", api_key, model_name, factory)
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        self.evict_idle()
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Close and drop clients idle for longer than ``idle_ttl``."""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            expired = [
+                key for key, entry in self._entries.items()
+                if now - entry.last_used > self.idle_ttl
+            ]
+            entries = [self._entries.pop(key) for key in expired]
+        for key, entry in zip(expired, entries):
+            self._close_entry(entry)
+            logger.info(f"Evicted idle {key[0]} client (model={key[2] or 'any'})")
+        self.evicted_count += len(entries)
+        return len(entries)
+
+    def _close_entry(self, entry: _Entry):
+        http_client = entry.http_client
+        if http_client is None:
+            return
+        try:
+            if isinstance(http_client, httpx.AsyncClient):
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    return
+                loop.create_task(http_client.aclose())
+            else:
+                http_client.close()
+        except Exception as e:
+            logger.error(f"Error closing provider client: {str(e)}")
+
+    async def aclose(self):
+        """Close every cached client."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            if isinstance(entry.http_client, httpx.AsyncClient):
+                await entry.http_client.aclose()
+            elif entry.http_client is not None:
+                entry.http_client.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_provider: Dict[str, int] = {}
+            for provider, _, _ in self._entries:
+                by_provider[provider] = by_provider.get(provider, 0) + 1
+        return {
+            "clients": by_provider,
+            "created": self.created_count,
+            "hits": self.hit_count,
+            "evicted": self.evicted_count,
+            "http2": _http2_available(),
+        }
+
+
+# Shared registry used across the bot
+registry = ClientRegistry()
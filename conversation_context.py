@@ -0,0 +1,159 @@
+"""Token-budgeted conversation context for multi-turn chat.
+
+Each turn's prompt is built from a system prompt, a rolling summary of older
+turns and as many recent turns as fit in ``CHAT_CONTEXT_TOKENS``. Once the
+stored history grows past its share of the budget, the oldest turns are
+folded into the summary, so both the prompt and the per-user history stay
+bounded no matter how long the conversation runs.
+"""
+import os
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from client_registry import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHAT_CONTEXT_TOKENS = int(os.getenv('CHAT_CONTEXT_TOKENS', '3000'))
+CHAT_SUMMARY_TOKENS = int(os.getenv('CHAT_SUMMARY_TOKENS', '400'))
+SUMMARY_MODEL = os.getenv('CHAT_SUMMARY_MODEL', 'llama3-8b-8192')
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant."
+
+# Approximate per-message overhead added by the chat template
+MESSAGE_OVERHEAD_TOKENS = 4
+
+Message = Dict[str, str]
+Summarizer = Callable[[str, List[Message], str], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate (~4 characters per token for English text)."""
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message: Message) -> int:
+    return estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text so its estimate fits in ``max_tokens``, keeping the start."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars - 3] + "..."
+
+
+async def groq_summarizer(previous_summary: str, turns: List[Message], api_key: str) -> str:
+    """Fold turns into the running summary with a small, fast Groq model."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+    client = registry.async_groq(api_key)
+    response = await client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": "You maintain a running summary of a conversation between a user and an AI assistant. Update the summary with the new messages. Keep names, facts, preferences and open questions. Respond with the updated summary only."
+            },
+            {
+                "role": "user",
+                "content": f"Current summary:\n{previous_summary or '(empty)'}\n\nNew messages:\n{transcript}"
+            }
+        ],
+        temperature=0.2,
+        max_tokens=CHAT_SUMMARY_TOKENS
+    )
+    return response.choices[0].message.content.strip()
+
+
+def extractive_summary(previous_summary: str, turns: List[Message]) -> str:
+    """Fallback summary used when the summarizer call fails."""
+    lines = [previous_summary] if previous_summary else []
+    for m in turns:
+        lines.append(f"{m['role']}: {m['content'][:200]}")
+    return "\n".join(lines)
+
+
+class ConversationContext:
+    """Builds bounded prompts and folds old turns into a rolling summary."""
+
+    def __init__(
+        self,
+        token_budget: int = CHAT_CONTEXT_TOKENS,
+        summary_budget: int = CHAT_SUMMARY_TOKENS,
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+        summarizer: Summarizer = groq_summarizer
+    ):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.system_prompt = system_prompt
+        self.summarizer = summarizer
+
+    @property
+    def history_budget(self) -> int:
+        """Tokens left for stored turns after the system prompt and summary."""
+        return max(0, self.token_budget - self.summary_budget - estimate_tokens(self.system_prompt))
+
+    def build_messages(self, history: List[Message], summary: str, user_message: str) -> List[Message]:
+        """Build the message list for a turn within the token budget.
+
+        The newest turns are kept first; older turns that don't fit are left
+        out (they will be folded into the summary by :meth:`fold`).
+        """
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if summary:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary}"
+            })
+
+        user_turn = {"role": "user", "content": user_message}
+        used = sum(message_tokens(m) for m in messages) + message_tokens(user_turn)
+
+        recent: List[Message] = []
+        for turn in reversed(history):
+            cost = message_tokens(turn)
+            if used + cost > self.token_budget:
+                break
+            recent.append(turn)
+            used += cost
+
+        messages.extend(reversed(recent))
+        messages.append(user_turn)
+        return messages
+
+    async def fold(self, history: List[Message], summary: str, api_key: Optional[str]) -> str:
+        """Fold the oldest turns into the summary once history exceeds its budget.
+
+        Folding drains history down to half its budget so the summarizer runs
+        in batches rather than on every turn. ``history`` is trimmed in place
+        and the new summary is returned. Callers hold the session's
+        ``fold_lock`` so concurrent turns don't fold the same history twice.
+        """
+        total = sum(message_tokens(m) for m in history)
+        if total <= self.history_budget:
+            return summary
+
+        target = self.history_budget // 2
+        count = 0
+        while count < len(history) and total > target:
+            total -= message_tokens(history[count])
+            count += 1
+        folded = history[:count]
+
+        try:
+            new_summary = await self.summarizer(summary, folded, api_key)
+        except Exception as e:
+            logger.error(f"Error summarizing conversation: {str(e)}")
+            new_summary = extractive_summary(summary, folded)
+
+        # Drop only the turns we folded; new turns may have arrived meanwhile
+        del history[:count]
+        return truncate_to_tokens(new_summary, self.summary_budget)
+
+
+# Shared context manager used by the chat handlers
+conversation_context = ConversationContext()
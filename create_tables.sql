@@ -23,10 +23,24 @@ CREATE TABLE IF NOT EXISTS image_generations (
     prompt TEXT,
     enhanced_prompt TEXT,
     image_url TEXT,
+    file_id VARCHAR(255),
+    content_hash CHAR(64),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_image_generations_content_hash (content_hash),
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
+-- Photos are recorded by Telegram file_unique_id. Rows written before that
+-- held file URLs containing the bot token; DatabaseHelper.scrub_file_urls runs:
+-- UPDATE image_captions SET image_url = NULL WHERE image_url LIKE '%api.telegram.org/file/bot%';
+-- UPDATE image_descriptions SET image_url = NULL WHERE image_url LIKE '%api.telegram.org/file/bot%';
+
+-- Migration for databases created before file_id/content_hash existed:
+-- ALTER TABLE image_generations
+--     ADD COLUMN file_id VARCHAR(255),
+--     ADD COLUMN content_hash CHAR(64),
+--     ADD INDEX idx_image_generations_content_hash (content_hash);
+
 CREATE TABLE IF NOT EXISTS image_captions (
     id BIGINT AUTO_INCREMENT PRIMARY KEY,
     user_id BIGINT,
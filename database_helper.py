@@ -51,7 +51,10 @@ class DatabaseHelper:
                 prompt TEXT,
                 enhanced_prompt TEXT,
                 image_url TEXT,
+                file_id VARCHAR(255),
+                content_hash CHAR(64),
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_image_generations_content_hash (content_hash),
                 FOREIGN KEY (user_id) REFERENCES users(user_id)
             )
         """)
@@ -105,6 +108,36 @@ class DatabaseHelper:
         """)
 
         self.connection.commit()
+        self.migrate_image_generations()
+        self.scrub_file_urls()
+
+    def migrate_image_generations(self):
+        """Add the file_id/content_hash columns to tables created before they existed."""
+        self.cursor.execute("""
+            SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'image_generations'
+        """)
+        columns = {row[0] for row in self.cursor.fetchall()}
+        if 'file_id' not in columns:
+            self.cursor.execute("ALTER TABLE image_generations ADD COLUMN file_id VARCHAR(255)")
+        if 'content_hash' not in columns:
+            self.cursor.execute(
+                "ALTER TABLE image_generations ADD COLUMN content_hash CHAR(64), "
+                "ADD INDEX idx_image_generations_content_hash (content_hash)"
+            )
+        self.connection.commit()
+
+    def scrub_file_urls(self):
+        """Blank image URLs stored before photos were recorded by file_unique_id.
+
+        Telegram file URLs embed the bot token.
+        """
+        for table in ('image_captions', 'image_descriptions'):
+            self.cursor.execute(
+                f"UPDATE {table} SET image_url = NULL WHERE image_url LIKE %s",
+                ('%api.telegram.org/file/bot%',)
+            )
+        self.connection.commit()
 
     def add_or_update_user(self, user_id, username=None, first_name=None, last_name=None):
         """Add or update a user in the database."""
@@ -128,15 +161,25 @@ class DatabaseHelper:
         self.cursor.execute(sql, (user_id, message, response, model))
         self.connection.commit()
 
-    def store_image_generation(self, user_id, prompt, enhanced_prompt, image_url):
-        """Store an image generation."""
+    def store_image_generation(self, user_id, prompt, enhanced_prompt, image_url, file_id=None, content_hash=None):
+        """Store an image generation along with its Telegram file_id and SHA-256 content hash."""
         sql = """
-            INSERT INTO image_generations (user_id, prompt, enhanced_prompt, image_url)
-            VALUES (%s, %s, %s, %s)
+            INSERT INTO image_generations (user_id, prompt, enhanced_prompt, image_url, file_id, content_hash)
+            VALUES (%s, %s, %s, %s, %s, %s)
         """
-        self.cursor.execute(sql, (user_id, prompt, enhanced_prompt, image_url))
+        self.cursor.execute(sql, (user_id, prompt, enhanced_prompt, image_url, file_id, content_hash))
         self.connection.commit()
 
+    def get_image_file_id(self, content_hash):
+        """Get the Telegram file_id of a previously sent image with this content hash."""
+        self.cursor.execute(
+            "SELECT file_id FROM image_generations WHERE content_hash = %s AND file_id IS NOT NULL "
+            "ORDER BY created_at DESC LIMIT 1",
+            (content_hash,)
+        )
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
     def store_image_caption(self, user_id, image_url, caption):
         """Store an image caption."""
         sql = """
@@ -203,10 +246,10 @@ class DatabaseHelper:
 
         # Get image generations
         self.cursor.execute(
-            "SELECT prompt, enhanced_prompt, image_url, created_at FROM image_generations WHERE user_id = %s ORDER BY created_at DESC",
+            "SELECT prompt, enhanced_prompt, image_url, file_id, created_at FROM image_generations WHERE user_id = %s ORDER BY created_at DESC",
             (user_id,)
         )
-        result['image_generations'] = [dict(zip(['prompt', 'enhanced_prompt', 'image_url', 'created_at'], row)) for row in self.cursor.fetchall()]
+        result['image_generations'] = [dict(zip(['prompt', 'enhanced_prompt', 'image_url', 'file_id', 'created_at'], row)) for row in self.cursor.fetchall()]
 
         # Add similar queries for other tables...
 
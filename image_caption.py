@@ -1,32 +1,61 @@
 import base64
 import requests
-from groq import Groq
 import os
 from dotenv import load_dotenv
+from provider_executor import run_provider
+from circuit_breaker import hedged
+from client_registry import registry
+from single_flight import vision_flights
+from response_cache import vision_cache, MISSING
 
 class ImageCaptioner:
+    MODEL = "llama-3.2-11b-vision-preview"
+    DEFAULT_PROMPT = "Please give me a caption for this image in not more than 20 words. Focus on the main elements and mood."
+
     def __init__(self):
         load_dotenv()
         self.groq_api_key = os.getenv('GROQ_API_KEY')
         if not self.groq_api_key:
             raise ValueError("GROQ_API_KEY not found in environment variables")
-        self.groq_client = Groq(api_key=self.groq_api_key)
+
+    @property
+    def groq_client(self):
+        # Looked up per call: the registry closes clients that sit idle
+        return registry.groq(self.groq_api_key)
         
-    async def generate_caption(self, image_url, prompt=None):
+    async def generate_caption(self, image_url, prompt=None, image_key=None):
         """
         Generate a caption for an image using Groq
         
         Args:
             image_url (str): URL of the image or base64 encoded image data
             prompt (str, optional): Custom prompt for the caption. Defaults to a general description request.
+            image_key (str, optional): Stable identity of the image, e.g. a Telegram file_unique_id.
+                Concurrent calls with the same image, prompt and model share one API call,
+                and successful captions are cached under this key.
         
         Returns:
             tuple: (success, caption or error message)
         """
+        if not prompt:
+            prompt = self.DEFAULT_PROMPT
+
+        key = ("caption", image_key or image_url, prompt, self.MODEL)
+        if image_key:
+            cached = await vision_cache.get(key)
+            if cached is not MISSING:
+                return True, cached
+
+        async def compute():
+            success, caption = await self._generate_caption(image_url, prompt)
+            if success and image_key:
+                await vision_cache.set(key, caption)
+            return success, caption
+
+        return await vision_flights.do(key, compute)
+
+    async def _generate_caption(self, image_url, prompt):
         try:
-            if not prompt:
-                prompt = "Please give me a caption for this image in not more than 20 words. Focus on the main elements and mood."
-            
             # Create messages for the API call
             messages = [
                 {
@@ -46,13 +75,15 @@ class ImageCaptioner:
                 }
             ]
             
-            # Make the API call
-            chat_completion = self.groq_client.chat.completions.create(
+            # Make the API call on the Groq pool so the event loop stays free
+            chat_completion, _ = await hedged("groq", self.MODEL, lambda model: run_provider(
+                "groq",
+                self.groq_client.chat.completions.create,
                 messages=messages,
-                model="llama-3.2-11b-vision-preview",
+                model=model,
                 temperature=0.3,
                 max_tokens=100
-            )
+            ))
             
             caption = chat_completion.choices[0].message.content.strip()
             return True, caption
@@ -1,18 +1,19 @@
-import base64
-from groq import Groq
-from together import Together
-from PIL import Image
-import io
 import os
 import logging
 import requests
 from dotenv import load_dotenv
+from client_registry import registry
+from prompt_cache import PromptCache
+from retry_policy import retry_sync
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 class AIImageGenerator:
+    ENHANCE_MODEL = "mixtral-8x7b-32768"
+    IMAGE_MODEL = "black-forest-labs/FLUX.1-schnell-Free"
+
     def __init__(self):
         load_dotenv(override=True)  # Force reload environment variables
         together_api_key = os.getenv('TOGETHER_API_KEY')
@@ -23,95 +24,112 @@ class AIImageGenerator:
         if not groq_api_key:
             raise ValueError("Groq API key not found. Please set GROQ_API_KEY in your .env file")
 
-        # Set the API key for Together
-        Together().api_key = together_api_key
-        self.together_client = Together()
-        self.groq_client = Groq(api_key=groq_api_key)
+        self.together_api_key = together_api_key
+        self.groq_api_key = groq_api_key
         self.last_enhanced_prompt = None
+        self.prompt_cache = PromptCache()
 
-    def enhance_prompt(self, user_prompt):
-        """Enhance the user's prompt using Groq LLM."""
-        try:
-            chat_completion = self.groq_client.chat.completions.create(
-                messages=[{
-                    "role": "system",
-                    "content": "You are an advanced AI creative assistant (v2.0) specialized in enhancing image generation prompts. Transform user prompts into highly detailed, visually rich descriptions that leverage cutting-edge AI image generation capabilities. Focus on artistic elements including lighting, composition, style, mood, and technical aspects. Maintain conciseness while maximizing visual impact. IMPORTANT: Return only the enhanced prompt without any prefixes or explanatory text."
-                },
-                {
-                    "role": "user",
-                    "content": f"Enhance this image prompt: {user_prompt}"
-                }],
-                model="mixtral-8x7b-32768",  
-                temperature=0.7,
-                max_tokens=256
-            )
-
-            enhanced_prompt = chat_completion.choices[0].message.content.strip()
-            prefixes_to_remove = [
-                "Here's an enhanced version of the prompt:",
-                "Enhanced prompt:",
-                "Here's a more detailed version:",
-                "Here's the enhanced prompt:"
-            ]
-            for prefix in prefixes_to_remove:
-                if enhanced_prompt.startswith(prefix):
-                    enhanced_prompt = enhanced_prompt[len(prefix):].strip()
-
-            logger.info(f"Enhanced prompt: {enhanced_prompt}")
+    # Shared clients are looked up per call: the registry closes clients that sit idle
+    @property
+    def together_client(self):
+        return registry.together(self.together_api_key)
+
+    @property
+    def groq_client(self):
+        return registry.groq(self.groq_api_key)
+
+    def cached_enhancement(self, user_prompt):
+        """Return a cached enhancement for the prompt, or None."""
+        enhanced_prompt = self.prompt_cache.get(user_prompt)
+        if enhanced_prompt:
             self.last_enhanced_prompt = enhanced_prompt
-            return enhanced_prompt
+        return enhanced_prompt
+
+    def enhance_prompt(self, user_prompt, use_cache=True, model=None):
+        """Enhance the user's prompt using Groq LLM (``ENHANCE_MODEL`` unless ``model`` is given).
+
+        Returns None on failure; see :meth:`request_enhancement` for a call that raises.
+        """
+        if use_cache:
+            enhanced_prompt = self.cached_enhancement(user_prompt)
+            if enhanced_prompt:
+                logger.info(f"Using cached enhancement for: {user_prompt}")
+                return enhanced_prompt
+        try:
+            # Errors are turned into a None result below, so transient ones are retried here
+            return retry_sync("groq", lambda: self.request_enhancement(user_prompt, model=model))
         except Exception as e:
             logger.error(f"Error enhancing prompt: {str(e)}")
             return None
 
+    def request_enhancement(self, user_prompt, model=None):
+        """Ask Groq for an enhanced prompt once, raising provider errors.
+
+        Meant for ``run_provider``, whose breaker, retries and hedging need to see failures.
+        """
+        chat_completion = self.groq_client.chat.completions.create(
+            messages=[{
+                "role": "system",
+                "content": "You are an advanced AI creative assistant (v2.0) specialized in enhancing image generation prompts. Transform user prompts into highly detailed, visually rich descriptions that leverage cutting-edge AI image generation capabilities. Focus on artistic elements including lighting, composition, style, mood, and technical aspects. Maintain conciseness while maximizing visual impact. IMPORTANT: Return only the enhanced prompt without any prefixes or explanatory text."
+            },
+            {
+                "role": "user",
+                "content": f"Enhance this image prompt: {user_prompt}"
+            }],
+            model=model or self.ENHANCE_MODEL,
+            temperature=0.7,
+            max_tokens=256
+        )
+
+        enhanced_prompt = chat_completion.choices[0].message.content.strip()
+        prefixes_to_remove = [
+            "Here's an enhanced version of the prompt:",
+            "Enhanced prompt:",
+            "Here's a more detailed version:",
+            "Here's the enhanced prompt:"
+        ]
+        for prefix in prefixes_to_remove:
+            if enhanced_prompt.startswith(prefix):
+                enhanced_prompt = enhanced_prompt[len(prefix):].strip()
+        if not enhanced_prompt:
+            raise ValueError("Empty enhancement received from API")
+
+        logger.info(f"Enhanced prompt: {enhanced_prompt}")
+        self.last_enhanced_prompt = enhanced_prompt
+        self.prompt_cache.put(user_prompt, enhanced_prompt)
+        return enhanced_prompt
+
     def generate_image(self, prompt):
-        """Generate images using the Together AI API."""
-        try:
-            logger.info("Attempting to generate image with Together AI...")
-            logger.info(f"Using prompt: {prompt}")
-
-            response = self.together_client.images.generate(
-                prompt=prompt,
-                model="black-forest-labs/FLUX.1-schnell-Free",
-                width=1024,
-                height=768,
-                steps=1,
-                n=1,
-                response_format="b64_json"
-            )
-
-            if response and hasattr(response, 'data') and len(response.data) > 0:
-                image_data = response.data[0].b64_json
-                logger.info("Successfully generated image")
-                return True, image_data, ""
-            else:
-                error_msg = "No image data received from API"
-                logger.error(error_msg)
-                return False, None, error_msg
+        """Generate images using the Together AI API.
 
+        Returns (success, b64 image, error message); see :meth:`request_image` for a call that raises.
+        """
+        try:
+            # Errors are turned into a failed result below, so transient ones are retried here
+            image_data = retry_sync("together", lambda: self.request_image(prompt))
+            return True, image_data, ""
         except Exception as e:
             error_msg = f"Error generating image: {str(e)}"
             logger.error(error_msg, exc_info=True)
             return False, None, error_msg
 
-    def save_image(self, b64_json, filename):
-        """Save the base64 encoded image to a file."""
-        try:
-            if not b64_json:
-                logger.error("No image data to save")
-                return False, "No image data to save"
-
-            img_data = base64.b64decode(b64_json)
-            img = Image.open(io.BytesIO(img_data))
+    def request_image(self, prompt, model=None):
+        """Generate one image with Together AI (``IMAGE_MODEL`` unless ``model`` is given).
 
-            # Ensure the filename has a proper extension
-            if not filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                filename += '.png'  # default to .png if no extension provided
-
-            img.save(filename)
-            logger.info(f"Successfully saved image to: {filename}")
-            return True, "Image saved successfully"
-        except Exception as e:
-            error_msg = f"Error saving image: {str(e)}"
-            logger.error(error_msg)
-            return False, error_msg
+        Returns the base64 image and raises on provider errors, like :meth:`request_enhancement`.
+        """
+        logger.info("Attempting to generate image with Together AI...")
+        logger.info(f"Using prompt: {prompt}")
+        response = self.together_client.images.generate(
+            prompt=prompt,
+            model=model or self.IMAGE_MODEL,
+            width=1024,
+            height=768,
+            steps=1,
+            n=1,
+            response_format="b64_json"
+        )
+        if not (response and hasattr(response, 'data') and len(response.data) > 0):
+            raise ValueError("No image data received from API")
+        logger.info("Successfully generated image")
+        return response.data[0].b64_json
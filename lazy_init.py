@@ -0,0 +1,232 @@
+"""Lazy initialization and startup-time profiling.
+
+Heavy subsystems (the MySQL connection, provider clients, the Gemini SDK,
+yt-dlp) are wrapped in :class:`Lazy` and built on first use instead of when
+``telegram_bot`` is imported. Once the bot is up, :func:`warm_up` can build
+them in the background so the first user doesn't pay for it.
+
+``startup_profile`` records how long each initializer took. With
+``STARTUP_PROFILE=true`` it also times imports by hooking ``sys.meta_path``
+as soon as this module is imported (so import it first); the hook is removed
+in :meth:`StartupProfile.mark_ready` and never replaces a module's loader for
+good. For a full import breakdown, ``python -X importtime`` needs no hook.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import importlib
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PROFILE = os.getenv('STARTUP_PROFILE', 'false').lower() == 'true'
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', 'true').lower() == 'true'
+STARTUP_WARMUP_DELAY = float(os.getenv('STARTUP_WARMUP_DELAY', '2'))
+
+# Import nesting levels kept in the report (1 = imported by the entry point)
+IMPORT_REPORT_DEPTH = 2
+
+
+class _TimedLoader:
+    """Wraps a module loader to time ``exec_module``."""
+
+    def __init__(self, loader, profile: "StartupProfile"):
+        self._loader = loader
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        profile = self._profile
+        profile._depth += 1
+        depth = profile._depth
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            # Put the real loader back so the wrapper doesn't outlive the import
+            module.__loader__ = self._loader
+            if getattr(module, "__spec__", None) is not None:
+                module.__spec__.loader = self._loader
+            profile._depth -= 1
+            if depth <= IMPORT_REPORT_DEPTH:
+                profile._record_import(module.__name__, time.perf_counter() - started, depth)
+
+
+class _ImportTimer:
+    """``sys.meta_path`` finder that times imports on the main thread."""
+
+    def __init__(self, profile: "StartupProfile"):
+        self._profile = profile
+        self._finding = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        if threading.current_thread() is not threading.main_thread() or getattr(self._finding, "active", False):
+            return None
+        self._finding.active = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                        spec.loader = _TimedLoader(spec.loader, self._profile)
+                    return spec
+            return None
+        finally:
+            self._finding.active = False
+
+
+class StartupProfile:
+    """Collects import and initializer timings for a startup report."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports: List[Tuple[str, float, int]] = []
+        self.initializers: Dict[str, float] = {}
+        self._depth = 0
+        self._timer: Optional[_ImportTimer] = None
+        self.ready_at: Optional[float] = None
+
+    def install(self):
+        if self._timer is None:
+            self._timer = _ImportTimer(self)
+            sys.meta_path.insert(0, self._timer)
+
+    def uninstall(self):
+        if self._timer is not None:
+            try:
+                sys.meta_path.remove(self._timer)
+            except ValueError:
+                pass
+            self._timer = None
+
+    def _record_import(self, name: str, elapsed: float, depth: int):
+        self.imports.append((name, elapsed, depth))
+
+    def record(self, name: str, elapsed: float):
+        self.initializers[name] = self.initializers.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def measure(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def mark_ready(self):
+        """Record the moment the bot started serving; stops import timing."""
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter()
+        self.uninstall()
+
+    def report(self, limit: int = 15) -> str:
+        total = (self.ready_at or time.perf_counter()) - self.started
+        lines = [f"Startup took {total:.2f}s"]
+        top_level = sorted((i for i in self.imports if i[2] == 1), key=lambda i: -i[1])[:limit]
+        if top_level:
+            lines.append("Imports (inclusive):")
+            for name, elapsed, _ in top_level:
+                lines.append(f"  {elapsed * 1000:8.1f} ms  {name}")
+                nested = sorted(
+                    (i for i in self.imports if i[2] == 2 and i[0].split(".")[0] != name
+                     and self._parent_of(i) == name),
+                    key=lambda i: -i[1]
+                )[:3]
+                for child, child_elapsed, _ in nested:
+                    lines.append(f"  {child_elapsed * 1000:8.1f} ms    └ {child}")
+        if self.initializers:
+            lines.append("Initializers:")
+            for name, elapsed in sorted(self.initializers.items(), key=lambda i: -i[1]):
+                lines.append(f"  {elapsed * 1000:8.1f} ms  {name}")
+        return "\n".join(lines)
+
+    def _parent_of(self, entry: Tuple[str, float, int]) -> Optional[str]:
+        # Depth-2 imports are recorded before the depth-1 import that triggered them
+        index = self.imports.index(entry)
+        for name, _, depth in self.imports[index + 1:]:
+            if depth == 1:
+                return name
+        return None
+
+
+startup_profile = StartupProfile()
+if STARTUP_PROFILE:
+    startup_profile.install()
+
+
+class Lazy:
+    """Proxy that builds an object on first attribute access.
+
+    Creation is thread-safe and timed into ``startup_profile``. Use
+    :meth:`override` to substitute an instance (e.g. a fake for load tests).
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self._name = name
+        self._factory = factory
+        self._instance: Any = None
+        self._created = False
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if not self._created:
+            with self._lock:
+                if not self._created:
+                    started = time.perf_counter()
+                    self._instance = self._factory()
+                    elapsed = time.perf_counter() - started
+                    startup_profile.record(self._name, elapsed)
+                    logger.info(f"Initialized {self._name} in {elapsed * 1000:.0f} ms")
+                    self._created = True
+        return self._instance
+
+    @property
+    def initialized(self) -> bool:
+        return self._created
+
+    def override(self, instance: Any):
+        with self._lock:
+            self._instance = instance
+            self._created = True
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not found on the proxy itself
+        return getattr(self.get(), name)
+
+    def __repr__(self) -> str:
+        state = "initialized" if self._created else "pending"
+        return f"<Lazy {self._name} ({state})>"
+
+
+def lazy_import(module_name: str) -> Callable[[], Any]:
+    """Factory that imports a module, for warming heavy imports with :class:`Lazy`."""
+    return lambda: importlib.import_module(module_name)
+
+
+async def warm_up(resources: Iterable[Lazy], delay: float = STARTUP_WARMUP_DELAY):
+    """Initialize lazy resources in the background after startup.
+
+    Runs one at a time on a worker thread so the event loop stays responsive.
+    Failures are logged and left for the first real use to surface.
+    """
+    await asyncio.sleep(delay)
+    started = time.perf_counter()
+    for resource in resources:
+        if resource.initialized:
+            continue
+        try:
+            await asyncio.to_thread(resource.get)
+        except Exception as e:
+            logger.warning(f"Warm-up of {resource._name} failed: {str(e)}")
+    logger.info(f"Background warm-up finished in {time.perf_counter() - started:.2f}s")
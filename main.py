@@ -5,12 +5,12 @@ import time
 import os
 from dotenv import load_dotenv
 import logging
-from groq import Groq
 from fpdf import FPDF
 from typing import Optional
 import together
 import base64
 from image_generator import AIImageGenerator
+from client_registry import registry
 
 # Set up logging
 logging.basicConfig(
@@ -76,7 +76,7 @@ def interactive_chat(text: str, temperature: float = 0.7, max_tokens: int = 1024
         if not api_key:
             return "Please set your Groq API key in the .env file"
             
-        client = Groq(api_key=api_key)
+        client = registry.groq(api_key)
         
         # Create the chat completion
         chat_completion = client.chat.completions.create(
@@ -0,0 +1,425 @@
+"""Persistent background job queue for long-running media commands.
+
+Video analysis and YouTube summaries take minutes. Instead of running them
+inside the update handler, handlers enqueue a job and return. Jobs are stored
+in SQLite so they survive restarts, and a pool of worker tasks runs them.
+Progress is written to the job's Telegram status message, which carries a
+cancel button. Jobs that fail with a transient error are retried with
+exponential backoff.
+
+Several processes may share the database. A running job belongs to the
+process that claimed it and holds a lease that its owner renews; only jobs
+whose lease has expired (their owner died) are re-queued by other processes.
+State changes out of ``running`` are conditional, so a cancel written by any
+process is never overwritten by the job finishing or being retried.
+
+Job states: queued -> running -> done | failed | cancelled
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from dotenv import load_dotenv
+from tracing import start_trace, current_trace_id, TRACE_ID_KEY
+from lazy_init import Lazy
+from retry_policy import classify
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MEDIA_JOB_DB_PATH = os.getenv('MEDIA_JOB_DB_PATH', 'bot_jobs.db')
+MEDIA_JOB_WORKERS = int(os.getenv('MEDIA_JOB_WORKERS', '2'))
+MEDIA_JOB_MAX_ATTEMPTS = int(os.getenv('MEDIA_JOB_MAX_ATTEMPTS', '3'))
+MEDIA_JOB_LEASE_SECONDS = float(os.getenv('MEDIA_JOB_LEASE_SECONDS', '60'))  # Renewed every third of this
+RETRY_BASE_DELAY = 10.0  # Seconds, doubled on each attempt
+PROGRESS_MIN_INTERVAL = 2.0  # Seconds between status message edits
+POLL_INTERVAL = 5.0
+
+CANCEL_PREFIX = "canceljob_"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class TransientJobError(Exception):
+    """Raise from a job handler to request a retry."""
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failed job is worth another attempt; same rules as provider retries."""
+    return isinstance(error, TransientJobError) or classify(error) is not None
+
+
+def cancel_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✖️ Cancel", callback_data=f"{CANCEL_PREFIX}{job_id}")
+    ]])
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    chat_id: int
+    user_id: int
+    status_message_id: Optional[int]
+    attempts: int
+    max_attempts: int
+    state: str = QUEUED
+
+
+class JobContext:
+    """Handed to job handlers for progress reporting."""
+
+    def __init__(self, queue: "MediaJobQueue", job: Job):
+        self.queue = queue
+        self.job = job
+        self.bot = queue.bot
+        self._last_progress = 0.0
+
+    async def progress(self, text: str, force: bool = False):
+        """Show progress in the status message (rate limited)."""
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_MIN_INTERVAL:
+            return
+        self._last_progress = now
+        await self.queue.edit_status(self.job, text, keep_cancel=True)
+
+
+JobHandler = Callable[[Job, JobContext], Awaitable[Optional[str]]]
+
+
+class MediaJobQueue:
+    """SQLite-backed job queue with an asyncio worker pool."""
+
+    def __init__(
+        self,
+        path: str = MEDIA_JOB_DB_PATH,
+        workers: int = MEDIA_JOB_WORKERS,
+        max_attempts: int = MEDIA_JOB_MAX_ATTEMPTS,
+        lease_seconds: float = MEDIA_JOB_LEASE_SECONDS
+    ):
+        self.path = path
+        self.worker_count = workers
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        # Identifies this process's claims in a shared database
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.bot: Optional[Bot] = None
+        self._handlers: Dict[str, JobHandler] = {}
+        self._running: Dict[int, asyncio.Task] = {}
+        self._cancel_requested: set = set()
+        self._workers: list = []
+        self._lease_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.setup_database()
+
+    def setup_database(self):
+        """Create the jobs table if it doesn't exist."""
+        with self._lock:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    status_message_id INTEGER,
+                    state TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    error TEXT,
+                    run_after REAL DEFAULT 0,
+                    owner TEXT,
+                    lease_until REAL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                # Databases created before leases were added
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL DEFAULT 0")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, run_after)"
+            )
+            self.connection.commit()
+
+    def register(self, kind: str, handler: JobHandler):
+        """Register the coroutine that runs jobs of ``kind``."""
+        self._handlers[kind] = handler
+
+    # Database helpers (run in a thread via asyncio.to_thread)
+
+    def _insert(self, kind, payload, chat_id, user_id, status_message_id) -> int:
+        with self._lock:
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (kind, payload, chat_id, user_id, status_message_id, state, max_attempts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), chat_id, user_id, status_message_id, QUEUED, self.max_attempts)
+            )
+            self.connection.commit()
+            return cursor.lastrowid
+
+    def _claim_next(self) -> Optional[Job]:
+        with self._lock:
+            while True:
+                row = self.connection.execute(
+                    "SELECT id, kind, payload, chat_id, user_id, status_message_id, attempts, max_attempts "
+                    "FROM jobs WHERE state = ? AND run_after <= ? ORDER BY id LIMIT 1",
+                    (QUEUED, time.time())
+                ).fetchone()
+                if row is None:
+                    return None
+                # Conditional, in case another process claimed the row first
+                cursor = self.connection.execute(
+                    "UPDATE jobs SET state = ?, attempts = attempts + 1, owner = ?, lease_until = ?, "
+                    "updated_at = CURRENT_TIMESTAMP WHERE id = ? AND state = ?",
+                    (RUNNING, self.owner, time.time() + self.lease_seconds, row[0], QUEUED)
+                )
+                self.connection.commit()
+                if cursor.rowcount:
+                    break
+        return Job(
+            id=row[0], kind=row[1], payload=json.loads(row[2]), chat_id=row[3],
+            user_id=row[4], status_message_id=row[5], attempts=row[6] + 1,
+            max_attempts=row[7], state=RUNNING
+        )
+
+    def _finish_running(self, job_id: int, state: str, error: Optional[str] = None, run_after: float = 0) -> bool:
+        """Move a job this process is running to ``state``; False if it was cancelled or reclaimed."""
+        with self._lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET state = ?, error = ?, run_after = ?, owner = NULL, updated_at = CURRENT_TIMESTAMP "
+                "WHERE id = ? AND state = ? AND owner = ?",
+                (state, error, run_after, job_id, RUNNING, self.owner)
+            )
+            self.connection.commit()
+            return cursor.rowcount > 0
+
+    def _cancel_row(self, job_id: int, user_id: int) -> bool:
+        with self._lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET state = ?, updated_at = CURRENT_TIMESTAMP "
+                "WHERE id = ? AND user_id = ? AND state IN (?, ?)",
+                (CANCELLED, job_id, user_id, QUEUED, RUNNING)
+            )
+            self.connection.commit()
+            return cursor.rowcount > 0
+
+    def _renew_leases(self, job_ids) -> set:
+        """Extend the leases of our running jobs; returns the ids we no longer hold."""
+        lost = set()
+        with self._lock:
+            for job_id in job_ids:
+                cursor = self.connection.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE id = ? AND state = ? AND owner = ?",
+                    (time.time() + self.lease_seconds, job_id, RUNNING, self.owner)
+                )
+                if not cursor.rowcount:
+                    lost.add(job_id)
+            self.connection.commit()
+        return lost
+
+    def _requeue_interrupted(self, own_only: bool = False) -> int:
+        """Put running jobs back in the queue: ours (on shutdown) or those whose lease expired."""
+        with self._lock:
+            if own_only:
+                condition, params = "owner = ?", (self.owner,)
+            else:
+                # Owners renew leases while alive, so an expired lease means a dead process
+                condition, params = "(lease_until IS NULL OR lease_until < ?)", (time.time(),)
+            cursor = self.connection.execute(
+                "UPDATE jobs SET state = ?, attempts = MAX(attempts - 1, 0), owner = NULL "
+                f"WHERE state = ? AND {condition}",
+                (QUEUED, RUNNING) + params
+            )
+            self.connection.commit()
+            return cursor.rowcount
+
+    def _count_by_state(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return dict(rows)
+
+    # Public API
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        chat_id: int,
+        user_id: int,
+        status_message_id: Optional[int] = None
+    ) -> int:
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        trace_id = current_trace_id()
+        if trace_id:
+            # Lets the job's spans be joined with the update that enqueued it
+            payload = dict(payload, **{TRACE_ID_KEY: trace_id})
+        job_id = await asyncio.to_thread(self._insert, kind, payload, chat_id, user_id, status_message_id)
+        logger.info(f"Enqueued {kind} job {job_id} for user {user_id}")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def cancel(self, job_id: int, user_id: int) -> bool:
+        """Cancel a queued or running job owned by ``user_id``.
+
+        A job running in another process is stopped by that process when it
+        next renews its lease.
+        """
+        if not await asyncio.to_thread(self._cancel_row, job_id, user_id):
+            return False
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancel_requested.add(job_id)
+            task.cancel()
+        return True
+
+    async def edit_status(self, job: Job, text: str, keep_cancel: bool = False):
+        """Edit the job's status message, ignoring benign Telegram errors."""
+        if self.bot is None or job.status_message_id is None:
+            return
+        try:
+            await self.bot.edit_message_text(
+                chat_id=job.chat_id,
+                message_id=job.status_message_id,
+                text=text[:4096],
+                reply_markup=cancel_keyboard(job.id) if keep_cancel else None
+            )
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.warning(f"Could not update status for job {job.id}: {str(e)}")
+        except Exception as e:
+            logger.warning(f"Could not update status for job {job.id}: {str(e)}")
+
+    def start(self, bot: Bot):
+        """Recover interrupted jobs and start the worker pool."""
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        recovered = self._requeue_interrupted()
+        if recovered:
+            logger.info(f"Re-queued {recovered} interrupted media jobs")
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._worker(i)) for i in range(self.worker_count)]
+        self._lease_task = loop.create_task(self._lease_loop())
+        logger.info(f"Started {self.worker_count} media job workers")
+
+    async def stop(self):
+        """Stop workers. Running jobs are re-queued for the next start."""
+        for worker in self._workers:
+            worker.cancel()
+        for task in list(self._running.values()):
+            task.cancel()
+        if self._lease_task is not None:
+            self._lease_task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._lease_task = None
+        await asyncio.to_thread(self._requeue_interrupted, True)
+
+    async def _lease_loop(self):
+        """Renew our leases, stop jobs cancelled elsewhere and recover jobs of dead processes."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                lost = await asyncio.to_thread(self._renew_leases, list(self._running))
+                for job_id in lost:
+                    task = self._running.get(job_id)
+                    if task is not None:
+                        self._cancel_requested.add(job_id)
+                        task.cancel()
+                recovered = await asyncio.to_thread(self._requeue_interrupted)
+                if recovered:
+                    logger.info(f"Re-queued {recovered} media jobs with expired leases")
+                    self._wakeup.set()
+            except Exception as e:
+                logger.error(f"Error renewing media job leases: {str(e)}")
+
+    async def _worker(self, index: int):
+        while True:
+            job = await asyncio.to_thread(self._claim_next)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Job):
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            await asyncio.to_thread(self._finish_running, job.id, FAILED, f"Unknown job kind {job.kind}")
+            return
+
+        context = JobContext(self, job)
+        task = asyncio.create_task(self._traced(handler, job, context))
+        self._running[job.id] = task
+        try:
+            result = await task
+            if not await asyncio.to_thread(self._finish_running, job.id, DONE):
+                logger.info(f"Job {job.id} finished after it was cancelled; result discarded")
+            elif result:
+                await self.edit_status(job, result)
+        except asyncio.CancelledError:
+            if job.id not in self._cancel_requested:
+                # Shutdown: stop() re-queues the job
+                raise
+            self._cancel_requested.discard(job.id)
+            logger.info(f"Job {job.id} cancelled by user")
+            await self.edit_status(job, "✖️ Job cancelled.")
+        except Exception as e:
+            if is_transient(e) and job.attempts < job.max_attempts:
+                delay = RETRY_BASE_DELAY * (2 ** (job.attempts - 1))
+                logger.warning(f"Job {job.id} failed transiently (attempt {job.attempts}), retrying in {delay:.0f}s: {str(e)}")
+                if await asyncio.to_thread(self._finish_running, job.id, QUEUED, str(e), time.time() + delay):
+                    await self.edit_status(job, f"⚠️ Temporary problem, retrying in {delay:.0f}s...", keep_cancel=True)
+            else:
+                logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+                if await asyncio.to_thread(self._finish_running, job.id, FAILED, str(e)):
+                    await self.edit_status(job, f"❌ Error processing your request: {str(e)}")
+        finally:
+            self._running.pop(job.id, None)
+            self._cancel_requested.discard(job.id)
+
+    async def _traced(self, handler: JobHandler, job: Job, context: JobContext):
+        with start_trace(
+            f"job {job.kind}",
+            trace_id=job.payload.get(TRACE_ID_KEY),
+            job_id=job.id,
+            attempt=job.attempts,
+            user_id=job.user_id
+        ):
+            return await handler(job, context)
+
+    async def stats(self) -> Dict[str, Any]:
+        counts = await asyncio.to_thread(self._count_by_state)
+        return {"workers": self.worker_count, "running": len(self._running), "states": counts}
+
+
+# Shared queue used by the bot; the database is opened on first use, not at import
+media_jobs = Lazy("MediaJobQueue", MediaJobQueue)
@@ -0,0 +1,231 @@
+"""Process-pool worker service for CPU-bound media transforms.
+
+Decoding generated images, extracting audio from videos (moviepy) and
+converting audio to WAV (pydub) hold the GIL, so running them on the event
+loop or a thread pool stalls every other user. :class:`MediaWorker` runs
+them in a ``ProcessPoolExecutor`` instead.
+
+Large byte buffers are not pickled through the pool's pipe: the caller
+copies them once into a ``multiprocessing.shared_memory`` block and the
+worker decodes straight from a memoryview of it. The result is copied once
+into a new block, which the caller reads and unlinks, also when it stopped
+waiting. Submissions are bounded by ``MEDIA_WORKER_MAX_QUEUE``; once that
+many transforms are queued or running, new ones fail fast with
+:class:`MediaWorkerBusy`.
+"""
+import os
+import asyncio
+import logging
+import threading
+import functools
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MEDIA_WORKER_PROCESSES = int(os.getenv('MEDIA_WORKER_PROCESSES', str(min(4, os.cpu_count() or 1))))
+MEDIA_WORKER_MAX_QUEUE = int(os.getenv('MEDIA_WORKER_MAX_QUEUE', '64'))
+# Buffers smaller than this are cheaper to pickle than to map
+SHM_THRESHOLD = int(os.getenv('MEDIA_WORKER_SHM_THRESHOLD', str(64 * 1024)))
+
+# A buffer handed across the process boundary: raw bytes, or (shm name, size)
+BufferRef = Union[bytes, Tuple[str, int]]
+
+
+class MediaWorkerBusy(Exception):
+    """Raised when the media worker queue is full."""
+
+
+def _export_buffer(data: bytes) -> Tuple[BufferRef, Optional[shared_memory.SharedMemory]]:
+    """Place ``data`` where another process can read it."""
+    if len(data) < SHM_THRESHOLD:
+        return bytes(data), None
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    return (shm.name, len(data)), shm
+
+
+def _unlink_buffer(ref: BufferRef):
+    if isinstance(ref, bytes):
+        return
+    try:
+        shm = shared_memory.SharedMemory(name=ref[0])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _import_buffer(ref: BufferRef, unlink: bool = False) -> bytes:
+    """Read a buffer exported by another process."""
+    if isinstance(ref, bytes):
+        return ref
+    name, size = ref
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _with_input_view(ref: BufferRef, func: Callable[[memoryview], Any]) -> Any:
+    """Call ``func`` with a view of an exported buffer, without copying it."""
+    if isinstance(ref, bytes):
+        return func(memoryview(ref))
+    name, size = ref
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        view = shm.buf[:size]
+        try:
+            return func(view)
+        finally:
+            view.release()
+    finally:
+        shm.close()
+
+
+# --- Transforms. These run inside worker processes. ---
+
+def _decode_b64(ref: BufferRef) -> BufferRef:
+    import base64
+
+    ref, shm = _export_buffer(_with_input_view(ref, base64.b64decode))
+    if shm is not None:
+        # The parent unlinks it after reading
+        shm.close()
+    return ref
+
+
+def extract_audio_track(video_path: str, output_path: str) -> str:
+    from moviepy.editor import VideoFileClip
+
+    video = VideoFileClip(video_path)
+    try:
+        video.audio.write_audiofile(output_path, codec='pcm_s16le', logger=None)
+    finally:
+        video.close()
+    return output_path
+
+
+def convert_audio_to_wav(audio_path: str, wav_path: str) -> str:
+    from pydub import AudioSegment
+
+    AudioSegment.from_file(audio_path).export(wav_path, format='wav')
+    return wav_path
+
+
+def _discard_result(future: Future):
+    """Unlink the result buffer of a transform nobody is waiting for any more."""
+    if not future.cancelled() and future.exception() is None:
+        _unlink_buffer(future.result())
+
+
+class MediaWorker:
+    """Bounded process pool with an async API for media transforms."""
+
+    def __init__(self, processes: int = MEDIA_WORKER_PROCESSES, max_queue: int = MEDIA_WORKER_MAX_QUEUE):
+        self.processes = processes
+        self.max_queue = max_queue
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Created lazily so importing the bot doesn't fork
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+            logger.info(f"Started media worker pool with {self.processes} processes")
+        return self._pool
+
+    def _reserve(self):
+        with self._lock:
+            if self.pending >= self.max_queue:
+                self.rejected += 1
+                raise MediaWorkerBusy(f"Media worker queue is full ({self.max_queue} pending)")
+            self.pending += 1
+
+    def _finish(self, ok: bool):
+        with self._lock:
+            self.pending -= 1
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a picklable callable in the process pool and await the result."""
+        self._reserve()
+        ok = False
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self._get_pool(), functools.partial(func, *args, **kwargs)
+            )
+            ok = True
+            return result
+        finally:
+            self._finish(ok)
+
+    async def _run_buffer_transform(self, func: Callable[[BufferRef], BufferRef], data: bytes) -> bytes:
+        """Run a bytes -> bytes transform, passing both buffers through shared memory."""
+        self._reserve()
+        ref, shm = _export_buffer(data)
+        future = None
+        ok = False
+        try:
+            future = self._get_pool().submit(func, ref)
+            result = _import_buffer(await asyncio.wrap_future(future), unlink=True)
+            ok = True
+            return result
+        except asyncio.CancelledError:
+            if future is not None:
+                # The worker may still finish and leave a result block behind
+                future.add_done_callback(_discard_result)
+            raise
+        finally:
+            self._finish(ok)
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    async def decode_b64(self, b64_data: Union[str, bytes]) -> bytes:
+        """Decode base64 data, e.g. a generated image, off the event loop."""
+        if isinstance(b64_data, str):
+            b64_data = b64_data.encode('ascii')
+        return await self._run_buffer_transform(_decode_b64, b64_data)
+
+    async def extract_audio(self, video_path: str, output_path: str) -> str:
+        """Extract a video's audio track to a PCM WAV file."""
+        return await self.run(extract_audio_track, video_path, output_path)
+
+    async def convert_to_wav(self, audio_path: str, wav_path: str) -> str:
+        """Convert any ffmpeg-readable audio file to WAV."""
+        return await self.run(convert_audio_to_wav, audio_path, wav_path)
+
+    def shutdown(self, wait: bool = False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "processes": self.processes,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+# Shared worker service used by the bot
+media_worker = MediaWorker()
@@ -0,0 +1,449 @@
+"""Latency instrumentation and a Prometheus ``/metrics`` endpoint.
+
+Every handler registered in ``setup_bot`` is wrapped by
+:func:`instrument_handlers`, which records its duration, outcome and how many
+calls are in flight. Inside a handler, :func:`stage` times individual steps
+(prompt enhancement, provider call, Telegram upload, DB write...) so the
+latency can be broken down per stage. Both also open tracing spans, so each
+handler call is the root of a trace and each stage one of its spans.
+
+Metrics are kept in-process and served in the Prometheus text format by
+:class:`MetricsServer` on ``METRICS_LISTEN:METRICS_PORT``. Use
+``histogram_quantile()`` on the ``_bucket`` series for p50/p95/p99, or
+:func:`latency_summary` for a quick estimate without Prometheus.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from tracing import span, start_trace, update_attributes
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+
+# Seconds; covers quick commands up to multi-minute video analysis
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, description, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, description, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram of observed durations."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label set: [count per bucket (non-cumulative)..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._values.get(self._key(labels))
+        return int(series[-1]) if series else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Estimate a quantile by interpolating within buckets, like ``histogram_quantile``."""
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if not series or not series[-1]:
+                return None
+            counts = list(series[:len(self.buckets)])
+            total = series[-1]
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if cumulative + count >= rank and count:
+                if math.isinf(bound):
+                    # Open-ended bucket: the best estimate is the highest finite bound
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return lower
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        with self._lock:
+            keys = sorted(self._values)
+        return [dict(zip(self.labelnames, key)) for key in keys]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        lines = self._header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(series[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metrics and renders them for a scrape.
+
+    Collectors are called right before rendering, to refresh gauges that
+    mirror state owned elsewhere (e.g. provider pool usage).
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, description, labelnames))
+
+    def gauge(self, name: str, description: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, description, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, description, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HANDLER_LATENCY = registry.histogram(
+    "bot_handler_duration_seconds", "Time spent in an update handler.", ["handler"]
+)
+HANDLER_REQUESTS = registry.counter(
+    "bot_handler_requests_total", "Updates handled, by outcome (ok, error, cancelled).", ["handler", "outcome"]
+)
+HANDLER_IN_FLIGHT = registry.gauge(
+    "bot_handler_in_flight", "Handler calls currently running.", ["handler"]
+)
+STAGE_LATENCY = registry.histogram(
+    "bot_stage_duration_seconds", "Time spent in one stage of a command.", ["command", "stage"]
+)
+STAGE_ERRORS = registry.counter(
+    "bot_stage_errors_total", "Stages that raised an exception.", ["command", "stage"]
+)
+STAGE_IN_FLIGHT = registry.gauge(
+    "bot_stage_in_flight", "Stages currently running.", ["command", "stage"]
+)
+PROVIDER_LATENCY = registry.histogram(
+    "bot_provider_call_duration_seconds", "Provider SDK call time, including pool wait.", ["provider", "outcome"]
+)
+PROVIDER_IN_FLIGHT = registry.gauge(
+    "bot_provider_in_flight", "Provider calls currently running on the pool.", ["provider"]
+)
+PROVIDER_WAITING = registry.gauge(
+    "bot_provider_waiting", "Provider calls waiting for a pool slot.", ["provider"]
+)
+BREAKER_STATE = registry.gauge(
+    "bot_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open).", ["provider", "model"]
+)
+BREAKER_REJECTED = registry.counter(
+    "bot_circuit_rejected_total", "Calls rejected because the circuit was open.", ["provider", "model"]
+)
+HEDGES = registry.counter(
+    "bot_hedged_requests_total",
+    "Hedged or failed-over calls, by outcome (primary, fallback, failover, failed).",
+    ["provider", "model", "outcome"]
+)
+ROUTER_DECISIONS = registry.counter(
+    "bot_router_decisions_total", "Model routing decisions, by chosen model and reason.", ["task", "model", "reason"]
+)
+ROUTER_LATENCY_EWMA = registry.gauge(
+    "bot_router_latency_ewma_seconds", "Moving average latency of successful calls per model.", ["model"]
+)
+ROUTER_ERROR_EWMA = registry.gauge(
+    "bot_router_error_ewma", "Moving average error rate per model.", ["model"]
+)
+RETRY_CALLS = registry.counter(
+    "bot_retry_calls_total", "Logical calls made through the retry engine.", ["target"]
+)
+RETRY_ATTEMPTS = registry.counter(
+    "bot_retry_attempts_total", "Attempts made, first tries included (attempts / calls = amplification).", ["target"]
+)
+RETRIES = registry.counter(
+    "bot_retries_total", "Retries made, by reason (rate_limited, server_error, network, timeout).", ["target", "reason"]
+)
+RETRY_GIVEUPS = registry.counter(
+    "bot_retry_giveups_total", "Transient failures not retried, by limit hit (attempts, deadline, budget).", ["target", "reason"]
+)
+
+
+@contextmanager
+def stage(command: str, name: str):
+    """Time one stage of a command and trace it as a span. Works in both sync and async code.
+
+    Yields the span so callers can attach attributes (byte counts, model...).
+    """
+    STAGE_IN_FLIGHT.inc(command=command, stage=name)
+    started = time.perf_counter()
+    try:
+        with span(f"{command}.{name}") as current:
+            yield current
+    except BaseException:
+        STAGE_ERRORS.inc(command=command, stage=name)
+        raise
+    finally:
+        STAGE_IN_FLIGHT.dec(command=command, stage=name)
+        STAGE_LATENCY.observe(time.perf_counter() - started, command=command, stage=name)
+
+
+def instrument(handler: Callable[..., Any], name: str) -> Callable[..., Any]:
+    """Wrap an async update handler to record latency, outcome and concurrency."""
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        HANDLER_IN_FLIGHT.inc(handler=name)
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            with start_trace(f"handler {name}", **update_attributes(update)):
+                return await handler(update, context)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            HANDLER_IN_FLIGHT.dec(handler=name)
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+            HANDLER_REQUESTS.inc(handler=name, outcome=outcome)
+
+    return wrapper
+
+
+def handler_name(handler) -> str:
+    """Metric label for a PTB handler: the command for CommandHandlers, else the callback name."""
+    commands = getattr(handler, "commands", None)
+    if commands:
+        return sorted(commands)[0]
+    return getattr(handler.callback, "__name__", type(handler).__name__)
+
+
+def instrument_handlers(application):
+    """Wrap the callback of every handler registered on ``application``."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = instrument(handler.callback, handler_name(handler))
+
+
+def latency_summary(histogram: Histogram = STAGE_LATENCY, quantiles: Iterable[float] = (0.5, 0.95, 0.99)) -> List[str]:
+    """One line per label set with call count and estimated quantiles in ms."""
+    quantiles = tuple(quantiles)
+    lines = []
+    for labels in histogram.label_sets():
+        estimates = " ".join(
+            f"p{int(q * 100)}={histogram.quantile(q, **labels) * 1000:.0f}ms" for q in quantiles
+        )
+        name = "/".join(labels.values())
+        lines.append(f"{name}: n={histogram.count(**labels)} {estimates}")
+    return lines
+
+
+def _collect_provider_pools():
+    from provider_executor import get_stats
+    for provider, stats in get_stats().items():
+        PROVIDER_IN_FLIGHT.set(stats["in_flight"], provider=provider)
+        PROVIDER_WAITING.set(stats["waiting"], provider=provider)
+
+
+registry.add_collector(_collect_provider_pools)
+
+
+class MetricsServer:
+    """Small aiohttp server exposing ``GET /metrics``."""
+
+    def __init__(self, listen: str = METRICS_LISTEN, port: int = METRICS_PORT, metrics: MetricsRegistry = registry):
+        self.listen = listen
+        self.port = port
+        self.metrics = metrics
+        self._runner = None
+
+    async def handle_metrics(self, request):
+        from aiohttp import web
+        return web.Response(body=self.metrics.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.listen, self.port).start()
+        except OSError as e:
+            # Another worker on this host may already own the port
+            logger.warning(f"Metrics endpoint not started on {self.listen}:{self.port}: {str(e)}")
+            await runner.cleanup()
+            return
+        self._runner = runner
+        logger.info(f"Metrics available at http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics_server = MetricsServer()
@@ -0,0 +1,233 @@
+"""Latency-aware model selection for chat and text enhancement.
+
+Each task (``chat``, ``enhance_prompt`` for /imagine, ``tone`` for /enhance)
+has a candidate list of models. The router keeps an exponentially weighted
+moving average (EWMA) of latency and error rate per model, fed by every
+provider call that passes through a circuit breaker, and picks a candidate
+according to the task's policy:
+
+* ``fixed``: always the first candidate (the previous hard-coded behaviour)
+* ``fastest``: the lowest latency EWMA among healthy candidates
+* ``cheapest``: the lowest cost among healthy candidates whose latency EWMA
+  is within the task's SLO, else the fastest
+* ``sticky``: keep the model a user was last routed to while it stays
+  healthy, else pick the fastest
+
+A candidate is unhealthy when its error EWMA exceeds ``ROUTER_MAX_ERROR_RATE``
+or its circuit is open. Models without samples count as fast so they get
+tried, and ``ROUTER_EXPLORE_RATE`` of decisions pick a random candidate so
+estimates for unused models stay current. Every decision is counted in
+``bot_router_decisions_total``.
+"""
+import os
+import random
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Tuple
+from dotenv import load_dotenv
+from metrics import ROUTER_DECISIONS, ROUTER_LATENCY_EWMA, ROUTER_ERROR_EWMA
+from circuit_breaker import breakers, OPEN
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("fixed", "fastest", "cheapest", "sticky")
+
+ROUTER_POLICY = os.getenv('ROUTER_POLICY', 'fixed')  # Default for tasks without their own policy
+ROUTER_EWMA_ALPHA = float(os.getenv('ROUTER_EWMA_ALPHA', '0.2'))  # Weight of the newest sample
+ROUTER_MAX_ERROR_RATE = float(os.getenv('ROUTER_MAX_ERROR_RATE', '0.3'))
+ROUTER_EXPLORE_RATE = float(os.getenv('ROUTER_EXPLORE_RATE', '0.05'))
+ROUTER_STICKY_USERS = int(os.getenv('ROUTER_STICKY_USERS', '10000'))  # Remembered (task, user) choices
+
+# Relative cost per million output tokens, used by the "cheapest" policy
+DEFAULT_MODEL_COSTS = "llama3-8b-8192=0.08,gemma-7b-it=0.07,mixtral-8x7b-32768=0.24,llama3-70b-8192=0.79"
+
+
+@dataclass(frozen=True)
+class TaskConfig:
+    provider: str
+    candidates: Tuple[str, ...]
+    policy: str
+    slo: float  # Seconds; latency target for the "cheapest" policy
+
+
+# Task name: (provider, default candidates, default SLO in seconds)
+TASK_DEFAULTS = {
+    "chat": ("groq", "llama3-70b-8192,llama3-8b-8192,mixtral-8x7b-32768", 5.0),
+    "enhance_prompt": ("groq", "mixtral-8x7b-32768,llama3-70b-8192,llama3-8b-8192", 3.0),
+    "tone": ("groq", "llama3-8b-8192,gemma-7b-it,mixtral-8x7b-32768", 3.0),
+}
+
+
+def _split(value: str) -> Tuple[str, ...]:
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+def _parse_costs(value: str) -> Dict[str, float]:
+    costs = {}
+    for item in _split(value):
+        try:
+            model, cost = item.split("=", 1)
+            costs[model.strip()] = float(cost)
+        except ValueError:
+            logger.warning(f"Invalid ROUTER_MODEL_COSTS entry: {item}")
+    return costs
+
+
+def load_tasks() -> Dict[str, TaskConfig]:
+    """Task settings, overridable with ROUTER_<TASK>_MODELS, _POLICY and _SLO."""
+    tasks = {}
+    for task, (provider, candidates, slo) in TASK_DEFAULTS.items():
+        prefix = f"ROUTER_{task.upper()}"
+        policy = os.getenv(f"{prefix}_POLICY", ROUTER_POLICY)
+        if policy not in POLICIES:
+            logger.warning(f"Unknown routing policy {policy!r} for {task}, using fixed")
+            policy = "fixed"
+        tasks[task] = TaskConfig(
+            provider=provider,
+            candidates=_split(os.getenv(f"{prefix}_MODELS", candidates)),
+            policy=policy,
+            slo=float(os.getenv(f"{prefix}_SLO", str(slo)))
+        )
+    return tasks
+
+
+class ModelStats:
+    """Latency and error EWMAs for one model."""
+
+    __slots__ = ("latency", "error_rate", "samples")
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+
+    def update(self, duration: float, ok: bool, alpha: float):
+        self.samples += 1
+        self.error_rate += alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok:
+            self.latency = duration if self.latency is None else self.latency + alpha * (duration - self.latency)
+
+
+class ModelRouter:
+    """Chooses a model per task from observed latency, errors and cost."""
+
+    def __init__(
+        self,
+        tasks: Dict[str, TaskConfig],
+        costs: Dict[str, float],
+        alpha: float = ROUTER_EWMA_ALPHA,
+        max_error_rate: float = ROUTER_MAX_ERROR_RATE,
+        explore_rate: float = ROUTER_EXPLORE_RATE,
+        sticky_users: int = ROUTER_STICKY_USERS
+    ):
+        self.tasks = tasks
+        self.costs = costs
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.explore_rate = explore_rate
+        self.sticky_users = sticky_users
+        self._models = {(task.provider, model) for task in tasks.values() for model in task.candidates}
+        self._stats: Dict[Tuple[str, str], ModelStats] = {}
+        self._sticky: "OrderedDict[Tuple[str, Hashable], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, provider: str, model: str, duration: float, ok: bool):
+        """Record one finished call; ignores models no task routes to."""
+        if (provider, model) not in self._models:
+            return
+        with self._lock:
+            stats = self._stats.setdefault((provider, model), ModelStats())
+            stats.update(duration, ok, self.alpha)
+        if stats.latency is not None:
+            ROUTER_LATENCY_EWMA.set(stats.latency, model=model)
+        ROUTER_ERROR_EWMA.set(stats.error_rate, model=model)
+
+    def _stats_for(self, provider: str, model: str) -> ModelStats:
+        return self._stats.get((provider, model)) or ModelStats()
+
+    def _healthy(self, provider: str, model: str) -> bool:
+        if self._stats_for(provider, model).error_rate > self.max_error_rate:
+            return False
+        return breakers.get(provider, model).state != OPEN
+
+    def _fastest(self, provider: str, models: List[str]) -> str:
+        # Unmeasured models sort first so they get tried
+        return min(models, key=lambda model: self._stats_for(provider, model).latency or 0.0)
+
+    def choose(self, task: str, user_id: Optional[Hashable] = None) -> str:
+        """Model to use for ``task``; ``user_id`` keys the sticky policy."""
+        config = self.tasks[task]
+        candidates = list(config.candidates)
+        provider = config.provider
+        reason = config.policy
+        if config.policy == "fixed" or len(candidates) == 1:
+            model = candidates[0]
+        elif random.random() < self.explore_rate:
+            model = random.choice(candidates)
+            reason = "explore"
+        else:
+            healthy = [model for model in candidates if self._healthy(provider, model)]
+            if not healthy:
+                model = candidates[0]
+                reason = "all_unhealthy"
+            elif config.policy == "cheapest":
+                within_slo = [
+                    model for model in healthy
+                    if (self._stats_for(provider, model).latency or 0.0) <= config.slo
+                ]
+                if within_slo:
+                    model = min(within_slo, key=lambda model: self.costs.get(model, float("inf")))
+                else:
+                    model = self._fastest(provider, healthy)
+                    reason = "slo_missed"
+            elif config.policy == "sticky" and user_id is not None:
+                with self._lock:
+                    previous = self._sticky.get((task, user_id))
+                if previous in healthy:
+                    model = previous
+                else:
+                    model = self._fastest(provider, healthy)
+                    reason = "sticky_new"
+            else:
+                model = self._fastest(provider, healthy)
+        if config.policy == "sticky" and user_id is not None and reason != "explore":
+            # Exploring is a one-off; the user keeps their model for later turns
+            with self._lock:
+                self._sticky[(task, user_id)] = model
+                self._sticky.move_to_end((task, user_id))
+                while len(self._sticky) > self.sticky_users:
+                    self._sticky.popitem(last=False)
+        ROUTER_DECISIONS.inc(task=task, model=model, reason=reason)
+        return model
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        with self._lock:
+            items = list(self._stats.items())
+        return {
+            model: {
+                "latency_ms": round(stats.latency * 1000) if stats.latency is not None else None,
+                "error_rate": round(stats.error_rate, 3),
+                "samples": stats.samples,
+            }
+            for (_, model), stats in items
+        }
+
+    def summary(self) -> List[str]:
+        """One line per task and per observed model for the admin latency report."""
+        lines = [
+            f"{task}: {config.policy} [{', '.join(config.candidates)}]"
+            for task, config in self.tasks.items()
+        ]
+        for model, stats in self.stats().items():
+            latency = f"{stats['latency_ms']}ms" if stats["latency_ms"] is not None else "n/a"
+            lines.append(f"{model}: ewma={latency} errors={stats['error_rate']:.0%} n={stats['samples']}")
+        return lines
+
+
+# Shared router, fed by every breaker-guarded provider call
+router = ModelRouter(load_tasks(), _parse_costs(os.getenv('ROUTER_MODEL_COSTS', DEFAULT_MODEL_COSTS)))
+breakers.add_observer(router.observe)
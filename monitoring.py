@@ -8,6 +8,7 @@ from telegram import Bot
 import asyncio
 from typing import Optional, List, Dict
 import json
+from outbox import outbox
 
 class SystemStats:
     @staticmethod
@@ -132,16 +133,17 @@ class BotMonitor:
 
         self.last_alert_time[alert_type] = time.time()
         
-        for chat_id in self.admin_chat_ids:
-            try:
-                await self.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"🚨 ALERT: {message}\n\n"
-                         f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                )
-                self.logger.info(f"Alert sent to {chat_id}: {message}")
-            except Exception as e:
-                self.logger.error(f"Failed to send alert to {chat_id}: {str(e)}")
+        # Alerts are short-lived, so they aren't persisted for resumption
+        report = await outbox.broadcast(
+            self.bot,
+            self.admin_chat_ids,
+            f"🚨 ALERT: {message}\n\n"
+            f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            persist=False
+        )
+        self.logger.info(f"Alert sent to {report.sent}/{report.total} admins: {message}")
+        if report.failed:
+            self.logger.error(f"Failed to send alert: {report.summary()}")
 
     def format_system_stats(self, stats: Dict) -> str:
         """Format system statistics for messages"""
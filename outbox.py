@@ -0,0 +1,378 @@
+"""Rate-limit-aware outbound message scheduler.
+
+Telegram allows roughly 30 messages per second per bot, one message per
+second per private chat and 20 per minute per group. Sending a broadcast or
+a multi-part reply with a plain ``for`` loop is either slow (sequential) or
+trips those limits (concurrent). :class:`Outbox` sends through a global token
+bucket plus one bucket per chat, delivers to many chats concurrently, waits
+out ``RetryAfter`` and retries network errors under the shared "telegram"
+retry policy. Rate limits are waited out outside that policy's budget and
+deadline, up to ``OUTBOX_MAX_RATE_LIMIT_WAITS`` times per message: Telegram
+says when to come back, and giving up would fail the recipient for good.
+
+Broadcasts are recorded in SQLite: each recipient is marked sent or failed
+as delivery progresses, so a broadcast interrupted by a restart resumes
+where it stopped (see :meth:`Outbox.resume_pending`). Every broadcast ends
+with a throughput and error report.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Iterable, List, Optional
+from telegram import Bot, Message
+from telegram.error import RetryAfter
+from dotenv import load_dotenv
+from admission_control import TokenBucket
+from retry_policy import retry_call, retry_after, policy_for
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '30'))  # Messages per second, all chats
+OUTBOX_CHAT_RATE = float(os.getenv('OUTBOX_CHAT_RATE', '1'))  # Messages per second, one private chat
+OUTBOX_CHAT_BURST = int(os.getenv('OUTBOX_CHAT_BURST', '3'))
+OUTBOX_GROUP_RATE = float(os.getenv('OUTBOX_GROUP_RATE', str(20 / 60)))  # Messages per second, one group
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', '16'))
+OUTBOX_MAX_RETRIES = int(os.getenv('OUTBOX_MAX_RETRIES', '3'))
+OUTBOX_MAX_RATE_LIMIT_WAITS = int(os.getenv('OUTBOX_MAX_RATE_LIMIT_WAITS', '10'))  # RetryAfter waits per message
+OUTBOX_DB_PATH = os.getenv('OUTBOX_DB_PATH', 'bot_outbox.db')
+
+PROGRESS_BATCH = 50  # Recipients recorded per database write
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+@dataclass
+class BroadcastReport:
+    broadcast_id: str
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    already_sent: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+    errors: Counter = field(default_factory=Counter)
+
+    @property
+    def throughput(self) -> float:
+        """Messages delivered per second."""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        errors = ", ".join(f"{name}: {count}" for name, count in self.errors.most_common()) or "none"
+        return (
+            f"Broadcast {self.broadcast_id}: {self.sent}/{self.total} sent, {self.failed} failed, "
+            f"{self.already_sent} already sent, {self.retries} retries in {self.elapsed:.1f}s "
+            f"({self.throughput:.1f} msg/s). Errors: {errors}"
+        )
+
+
+class Outbox:
+    """Global and per-chat rate limited sender with resumable broadcasts."""
+
+    def __init__(
+        self,
+        global_rate: float = OUTBOX_GLOBAL_RATE,
+        chat_rate: float = OUTBOX_CHAT_RATE,
+        chat_burst: int = OUTBOX_CHAT_BURST,
+        group_rate: float = OUTBOX_GROUP_RATE,
+        concurrency: int = OUTBOX_CONCURRENCY,
+        max_retries: int = OUTBOX_MAX_RETRIES,
+        max_rate_limit_waits: int = OUTBOX_MAX_RATE_LIMIT_WAITS,
+        path: Optional[str] = OUTBOX_DB_PATH
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.max_rate_limit_waits = max_rate_limit_waits
+        self._policy = replace(policy_for("telegram"), max_attempts=max_retries + 1)
+        self.path = path
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0  # Set when Telegram returns a global flood wait
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    # --- Rate limiting ---
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Full buckets hold no state worth keeping
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.is_full}
+            if int(chat_id) < 0:
+                # Groups and channels have negative ids and a much lower limit
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id: int):
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await self._chat_bucket(chat_id).take()
+        await self.global_bucket.take()
+
+    # --- Sending ---
+
+    async def send(self, bot: Bot, chat_id: int, text: str, **kwargs) -> Optional[Message]:
+        """Send one message, honouring rate limits and retrying transient errors.
+
+        Blocked bots, deleted chats and bad markup are not retried. Raises the
+        last error if the message could not be delivered.
+        """
+        async def attempt():
+            await self._acquire(chat_id)
+            try:
+                return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                self.rate_limited += 1
+                delay = retry_after(e)
+                # A 429 means the bot as a whole is over the limit, so pause every sender
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning(f"Rate limited sending to {chat_id}, backing off {delay}s")
+                # Returned, not raised, so the wait doesn't use up retries, budget or deadline
+                return e
+
+        waits = 0
+        try:
+            while True:
+                message = await retry_call("telegram", attempt, policy=self._policy, on_retry=self._count_retry)
+                if not isinstance(message, RetryAfter):
+                    break
+                waits += 1
+                if waits > self.max_rate_limit_waits:
+                    raise message
+        except Exception:
+            self.failed += 1
+            raise
+        self.sent += 1
+        return message
+
+    def _count_retry(self, error: Exception, delay: float):
+        self.retries += 1
+
+    async def send_many(self, bot: Bot, chat_id: int, texts: Iterable[str], **kwargs) -> List[Message]:
+        """Send several messages to one chat in order, e.g. the parts of a long reply."""
+        return [await self.send(bot, chat_id, text, **kwargs) for text in texts]
+
+    # --- Broadcast persistence ---
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if self.path is None:
+            return None
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                );
+                CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                    broadcast_id TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    error TEXT,
+                    PRIMARY KEY (broadcast_id, chat_id)
+                );
+            """)
+            self._connection.commit()
+        return self._connection
+
+    def _create_broadcast(self, broadcast_id: str, chat_ids: List[int], text: str, options: Dict[str, Any]):
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return
+            db.execute(
+                "INSERT OR IGNORE INTO broadcasts (id, text, options) VALUES (?, ?, ?)",
+                (broadcast_id, text, json.dumps(options))
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, chat_id, state) VALUES (?, ?, ?)",
+                [(broadcast_id, chat_id, PENDING) for chat_id in chat_ids]
+            )
+            db.commit()
+
+    def _pending_recipients(self, broadcast_id: str) -> Optional[List[int]]:
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return None
+            rows = db.execute(
+                "SELECT chat_id FROM broadcast_recipients WHERE broadcast_id = ? AND state = ?",
+                (broadcast_id, PENDING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _record(self, broadcast_id: str, results: List[tuple]):
+        if not results:
+            return
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return
+            db.executemany(
+                "UPDATE broadcast_recipients SET state = ?, error = ? WHERE broadcast_id = ? AND chat_id = ?",
+                [(state, error, broadcast_id, chat_id) for chat_id, state, error in results]
+            )
+            db.commit()
+
+    def _finish_broadcast(self, broadcast_id: str):
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return
+            db.execute(
+                "UPDATE broadcasts SET finished_at = CURRENT_TIMESTAMP WHERE id = ?", (broadcast_id,)
+            )
+            db.commit()
+
+    def _unfinished_broadcasts(self) -> List[tuple]:
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return []
+            return db.execute(
+                "SELECT id, text, options FROM broadcasts WHERE finished_at IS NULL ORDER BY created_at"
+            ).fetchall()
+
+    # --- Broadcasting ---
+
+    async def broadcast(
+        self,
+        bot: Bot,
+        chat_ids: Iterable[int],
+        text: str,
+        broadcast_id: Optional[str] = None,
+        persist: bool = True,
+        **kwargs
+    ) -> BroadcastReport:
+        """Deliver ``text`` to every chat concurrently within Telegram's limits.
+
+        With ``persist``, progress is stored so :meth:`resume_pending` can
+        finish the broadcast after a restart. Passing an existing
+        ``broadcast_id`` skips recipients that were already handled.
+        """
+        chat_ids = list(dict.fromkeys(chat_ids))
+        broadcast_id = broadcast_id or uuid.uuid4().hex[:12]
+        report = BroadcastReport(broadcast_id, total=len(chat_ids))
+        if persist and self.path is not None:
+            await asyncio.to_thread(self._create_broadcast, broadcast_id, chat_ids, text, kwargs)
+            pending = await asyncio.to_thread(self._pending_recipients, broadcast_id)
+            report.already_sent = len(chat_ids) - len(pending)
+            chat_ids = pending
+        return await self._deliver(bot, broadcast_id, chat_ids, text, report, persist, kwargs)
+
+    async def _deliver(
+        self,
+        bot: Bot,
+        broadcast_id: str,
+        chat_ids: List[int],
+        text: str,
+        report: BroadcastReport,
+        persist: bool,
+        options: Dict[str, Any]
+    ) -> BroadcastReport:
+        started = time.monotonic()
+        retries_before = self.retries
+        queue: asyncio.Queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+        results: List[tuple] = []
+
+        async def flush_results():
+            batch = results[:]
+            results.clear()
+            if persist:
+                try:
+                    await asyncio.to_thread(self._record, broadcast_id, batch)
+                except Exception as e:
+                    logger.error(f"Error saving progress of broadcast {broadcast_id}: {str(e)}")
+
+        async def worker():
+            while True:
+                try:
+                    chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await self.send(bot, chat_id, text, **options)
+                    report.sent += 1
+                    results.append((chat_id, SENT, None))
+                except Exception as e:
+                    report.failed += 1
+                    report.errors[type(e).__name__] += 1
+                    results.append((chat_id, FAILED, str(e)[:255]))
+                    logger.error(f"Failed to deliver broadcast {broadcast_id} to {chat_id}: {str(e)}")
+                if len(results) >= PROGRESS_BATCH:
+                    await flush_results()
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(chat_ids)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await flush_results()
+
+        if persist:
+            await asyncio.to_thread(self._finish_broadcast, broadcast_id)
+        report.retries = self.retries - retries_before
+        report.elapsed = time.monotonic() - started
+        logger.info(report.summary())
+        return report
+
+    async def resume_pending(self, bot: Bot) -> List[BroadcastReport]:
+        """Finish broadcasts interrupted by a restart."""
+        reports = []
+        for broadcast_id, text, options in await asyncio.to_thread(self._unfinished_broadcasts):
+            pending = await asyncio.to_thread(self._pending_recipients, broadcast_id)
+            logger.info(f"Resuming broadcast {broadcast_id} with {len(pending)} recipients left")
+            report = BroadcastReport(broadcast_id, total=len(pending))
+            reports.append(await self._deliver(
+                bot, broadcast_id, pending, text, report, True, json.loads(options)
+            ))
+        return reports
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "tracked_chats": len(self._chat_buckets),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Shared outbox used for notifications, alerts and multi-part replies
+outbox = Outbox()
@@ -0,0 +1,120 @@
+"""Cache of enhanced image prompts.
+
+Many users send near-identical ``/imagine`` prompts ("a cat", "Sunset over
+mountains!"). Prompts are normalized (case, whitespace, punctuation) and the
+enhancement for the normalized key is reused until it expires.
+
+With ``PROMPT_CACHE_VARIETY`` above 1, up to that many different
+enhancements are collected per key (one per miss) and hits rotate through
+them, so repeated prompts don't always produce the same image.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'true').lower() == 'true'
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv('PROMPT_CACHE_MAX_ENTRIES', '1000'))
+PROMPT_CACHE_TTL = float(os.getenv('PROMPT_CACHE_TTL', str(24 * 3600)))  # 24 hours
+PROMPT_CACHE_VARIETY = int(os.getenv('PROMPT_CACHE_VARIETY', '1'))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    prompt = _PUNCTUATION.sub(" ", prompt.lower())
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+class _Entry:
+    __slots__ = ("variants", "created", "next_index")
+
+    def __init__(self, created: float):
+        self.variants: List[str] = []
+        self.created = created
+        self.next_index = 0
+
+
+class PromptCache:
+    """Thread-safe LRU + TTL cache of prompt enhancements."""
+
+    def __init__(
+        self,
+        max_entries: int = PROMPT_CACHE_MAX_ENTRIES,
+        ttl: float = PROMPT_CACHE_TTL,
+        variety: int = PROMPT_CACHE_VARIETY,
+        enabled: bool = PROMPT_CACHE_ENABLED
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variety = max(1, variety)
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prompt: str) -> Optional[str]:
+        """Return a cached enhancement, or None if a new one should be generated.
+
+        Until a key has ``variety`` enhancements, lookups miss so the caller
+        adds another one.
+        """
+        if not self.enabled:
+            return None
+        key = normalize_prompt(prompt)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.created > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None or len(entry.variants) < self.variety:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            variant = entry.variants[entry.next_index % len(entry.variants)]
+            entry.next_index += 1
+            self.hits += 1
+            return variant
+
+    def put(self, prompt: str, enhanced: str):
+        """Record an enhancement for ``prompt``."""
+        if not self.enabled or not enhanced:
+            return
+        key = normalize_prompt(prompt)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry.created > self.ttl:
+                entry = self._entries[key] = _Entry(now)
+            if enhanced not in entry.variants and len(entry.variants) < self.variety:
+                entry.variants.append(enhanced)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "variety": self.variety,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,161 @@
+"""Bounded execution layer for blocking provider SDK calls.
+
+The Groq, Together and Gemini SDKs used by the bot are synchronous. Calling
+them directly from an ``async def`` handler blocks the event loop, so every
+other user waits until the completion returns. Every provider call goes
+through :func:`run_provider`, which runs it on a per-provider thread pool and
+caps how many calls may be in flight for that provider at once. Calls also
+pass through the circuit breaker of their provider and model, and transient
+failures are retried under the provider's retry policy.
+"""
+import os
+import time
+import asyncio
+import logging
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+from metrics import PROVIDER_LATENCY
+from circuit_breaker import breakers
+from retry_policy import retry_call
+from tracing import span
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Default worker counts per provider, overridable with <PROVIDER>_MAX_WORKERS
+DEFAULT_MAX_WORKERS = {
+    "groq": 16,
+    "together": 8,
+    "gemini": 4,
+}
+FALLBACK_MAX_WORKERS = 4
+
+
+class ProviderExecutor:
+    """A bounded thread pool dedicated to one provider."""
+
+    def __init__(self, provider: str, max_workers: int):
+        self.provider = provider
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"{provider}-worker"
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        return self._semaphore
+
+    async def run(self, func: Callable[..., Any], *args, on_acquired: Optional[Callable[[], None]] = None, **kwargs) -> Any:
+        """Run a blocking callable on this provider's pool and await the result.
+
+        ``on_acquired`` is called once a pool slot has been obtained.
+        """
+        semaphore = self._get_semaphore()
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the caller's context so tracing spans follow the call
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            if on_acquired is not None:
+                on_acquired()
+            return await loop.run_in_executor(self._pool, call)
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+
+    def shutdown(self, wait: bool = False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+        }
+
+
+_executors: Dict[str, ProviderExecutor] = {}
+
+
+def _max_workers_for(provider: str) -> int:
+    env_value = os.getenv(f"{provider.upper()}_MAX_WORKERS")
+    if env_value:
+        try:
+            return max(1, int(env_value))
+        except ValueError:
+            logger.warning(f"Invalid {provider.upper()}_MAX_WORKERS value: {env_value}")
+    return DEFAULT_MAX_WORKERS.get(provider, FALLBACK_MAX_WORKERS)
+
+
+def get_executor(provider: str) -> ProviderExecutor:
+    """Get (or create) the executor for a provider."""
+    executor = _executors.get(provider)
+    if executor is None:
+        executor = ProviderExecutor(provider, _max_workers_for(provider))
+        _executors[provider] = executor
+        logger.info(f"Created {provider} executor with {executor.max_workers} workers")
+    return executor
+
+
+async def run_provider(provider: str, func: Callable[..., Any], *args, breaker_scope: Optional[str] = None, **kwargs) -> Any:
+    """Run a blocking provider SDK call without blocking the event loop.
+
+    Args:
+        provider (str): Provider name, e.g. "groq", "together" or "gemini"
+        func (callable): The blocking SDK call
+        *args, **kwargs: Arguments forwarded to ``func``
+        breaker_scope (str, optional): ``key_scope()`` of the API key the call
+            uses, so calls on a user's own key get their own circuit breaker
+
+    Returns:
+        Whatever ``func`` returns. Exceptions are re-raised unchanged.
+
+    Raises:
+        CircuitOpenError: The circuit for this provider and model (the
+            ``model`` keyword, else the function name) is open
+    """
+    name = getattr(func, "__name__", repr(func))
+
+    async def attempt():
+        with breakers.guard(provider, kwargs.get("model") or name, breaker_scope) as timer:
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                with span(f"provider {provider}", function=name):
+                    # The breaker times the call from when it gets a pool slot, not while it queues
+                    result = await get_executor(provider).run(func, *args, on_acquired=timer.restart, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                PROVIDER_LATENCY.observe(time.perf_counter() - started, provider=provider, outcome=outcome)
+
+    return await retry_call(provider, attempt)
+
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    """Current pool usage for every provider that has been used."""
+    return {name: executor.stats() for name, executor in _executors.items()}
+
+
+def shutdown_executors(wait: bool = False):
+    """Shut down all provider pools."""
+    for executor in _executors.values():
+        executor.shutdown(wait=wait)
+    _executors.clear()
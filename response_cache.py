@@ -0,0 +1,233 @@
+"""Two-tier cache for deterministic provider responses.
+
+Used for image descriptions and captions, keyed by
+``(file_unique_id, prompt, model)``: the same sticker, meme or forwarded
+photo is answered from the cache instead of calling the vision model again.
+
+Lookups go to an in-memory LRU first, then to a SQLite table on disk whose
+entries expire after ``RESPONSE_CACHE_TTL`` seconds. Disk hits are promoted
+back into memory. Values must be JSON serializable.
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '2000'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', str(7 * 24 * 3600)))  # 7 days
+RESPONSE_CACHE_DB_PATH = os.getenv('RESPONSE_CACHE_DB_PATH', 'bot_cache.db')
+
+# Marker for "not cached", since None can be a cached value
+MISSING = object()
+
+
+class ResponseCache:
+    """Memory LRU in front of a SQLite TTL store."""
+
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = RESPONSE_CACHE_TTL,
+        path: Optional[str] = RESPONSE_CACHE_DB_PATH,
+        enabled: bool = RESPONSE_CACHE_ENABLED
+    ):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.enabled = enabled
+        self._memory: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @staticmethod
+    def make_key(key: Hashable) -> str:
+        return json.dumps(key, sort_keys=True, default=str)
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        # Opened lazily so importing the module doesn't touch the disk
+        if self.path is None:
+            return None
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            # Older versions cached Telegram file URLs, which embed the bot token
+            self._connection.execute(
+                "DELETE FROM response_cache WHERE value LIKE '%api.telegram.org/file/bot%'"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _remember(self, key: str, value: Any, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Tuple[Any, float]:
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return MISSING, 0.0
+            row = db.execute(
+                "SELECT value, expires_at FROM response_cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return MISSING, 0.0
+        return json.loads(row[0]), row[1]
+
+    def _disk_set(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return
+            db.execute(
+                "INSERT INTO response_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (self.namespace, key, json.dumps(value), expires_at)
+            )
+            db.commit()
+
+    async def get(self, key: Hashable) -> Any:
+        """Return the cached value for ``key``, or ``MISSING``."""
+        if not self.enabled:
+            return MISSING
+        cache_key = self.make_key(key)
+        entry = self._memory.get(cache_key)
+        if entry is not None:
+            if entry[1] >= time.time():
+                self._memory.move_to_end(cache_key)
+                self.memory_hits += 1
+                return entry[0]
+            del self._memory[cache_key]
+
+        try:
+            value, expires_at = await asyncio.to_thread(self._disk_get, cache_key)
+        except Exception as e:
+            logger.error(f"Error reading {self.namespace} cache: {str(e)}")
+            value = MISSING
+        if value is MISSING:
+            self.misses += 1
+        else:
+            # Promote to memory
+            self._remember(cache_key, value, expires_at)
+            self.disk_hits += 1
+        return value
+
+    async def set(self, key: Hashable, value: Any):
+        """Store ``value`` in both tiers."""
+        if not self.enabled:
+            return
+        cache_key = self.make_key(key)
+        expires_at = time.time() + self.ttl
+        self._remember(cache_key, value, expires_at)
+        self.stores += 1
+        try:
+            await asyncio.to_thread(self._disk_set, cache_key, value, expires_at)
+        except Exception as e:
+            logger.error(f"Error writing {self.namespace} cache: {str(e)}")
+
+    def _disk_purge(self, expired_only: bool) -> int:
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return 0
+            if expired_only:
+                cursor = db.execute(
+                    "DELETE FROM response_cache WHERE namespace = ? AND expires_at < ?",
+                    (self.namespace, time.time())
+                )
+            else:
+                cursor = db.execute("DELETE FROM response_cache WHERE namespace = ?", (self.namespace,))
+            db.commit()
+            return cursor.rowcount
+
+    async def flush(self) -> int:
+        """Drop every entry from both tiers. Returns the number of disk rows removed."""
+        self._memory.clear()
+        return await asyncio.to_thread(self._disk_purge, False)
+
+    async def purge_expired(self) -> int:
+        """Remove expired rows from disk."""
+        now = time.time()
+        for key in [k for k, (_, expires_at) in self._memory.items() if expires_at < now]:
+            del self._memory[key]
+        return await asyncio.to_thread(self._disk_purge, True)
+
+    def _disk_inspect(self, limit: int) -> Tuple[int, List[Tuple[str, float]]]:
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return 0, []
+            count = db.execute(
+                "SELECT COUNT(*) FROM response_cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+            rows = db.execute(
+                "SELECT key, expires_at FROM response_cache WHERE namespace = ? "
+                "ORDER BY expires_at DESC LIMIT ?",
+                (self.namespace, limit)
+            ).fetchall()
+        return count, rows
+
+    async def inspect(self, limit: int = 10) -> Dict[str, Any]:
+        """Counters plus the most recently stored keys."""
+        disk_entries, recent = await asyncio.to_thread(self._disk_inspect, limit)
+        stats = self.stats()
+        stats["disk_entries"] = disk_entries
+        stats["recent"] = [
+            {"key": key, "expires_in": max(0, int(expires_at - time.time()))}
+            for key, expires_at in recent
+        ]
+        return stats
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "namespace": self.namespace,
+            "enabled": self.enabled,
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Shared cache for vision model answers (descriptions and captions)
+vision_cache = ResponseCache("vision")
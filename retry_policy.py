@@ -0,0 +1,330 @@
+"""Shared retry policy for provider, YouTube and Telegram calls.
+
+:func:`retry_call` retries an async call when it fails with a transient
+error: HTTP 429 or 5xx, a connection error or timeout, Telegram's
+``RetryAfter`` or a network error. Waits use exponential backoff with full
+jitter (a random delay between zero and ``base * 2**attempt``, capped at
+``max_delay``), stretched to the server's ``Retry-After`` when it asks for
+longer. Each call has an attempt limit and an overall deadline: a retry that
+would end past the deadline is not made.
+
+Retries also draw from a budget per target: every call deposits
+``RETRY_BUDGET_RATIO`` tokens (up to ``RETRY_BUDGET_MAX``) and every retry
+spends one. During an outage the retries can then add at most that share of
+extra load, instead of multiplying it.
+
+Calls, attempts, retries and give-ups are counted per target, so retry
+amplification (attempts per call) can be watched in the metrics.
+:func:`retry_sync` applies the same policy to blocking code that already
+runs on a worker thread.
+
+The provider SDKs' own retries are turned off in ``client_registry`` so the
+two layers don't multiply.
+"""
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from dotenv import load_dotenv
+from metrics import RETRY_CALLS, RETRY_ATTEMPTS, RETRIES, RETRY_GIVEUPS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RETRY_ENABLED = os.getenv('RETRY_ENABLED', 'true').lower() == 'true'
+RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', '0.2'))  # Retries earned per call
+RETRY_BUDGET_MAX = float(os.getenv('RETRY_BUDGET_MAX', '10'))  # Retries that may be banked
+
+# Exception class names (anywhere in the MRO) that mark a transient failure.
+# Matched by name so optional SDKs (groq, together, google, youtube_transcript_api,
+# speech_recognition) don't have to be imported here.
+TRANSIENT_ERRORS = {
+    "APIConnectionError",  # groq, together
+    "APITimeoutError",  # groq
+    "RateLimitError",  # groq, together (when no status code is attached)
+    "InternalServerError",
+    "ServiceUnavailableError",  # together
+    "Timeout",  # together, requests
+    "TransportError",  # httpx
+    "ConnectionError",  # requests, builtins
+    "TimeoutError",
+    "ServiceUnavailable",  # google.api_core
+    "DeadlineExceeded",
+    "ResourceExhausted",
+    "TooManyRequests",  # youtube_transcript_api
+    "RequestError",  # speech_recognition, httpx
+}
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# yt-dlp reports HTTP failures only in the message
+HTTP_ERROR_MESSAGE = re.compile(r"HTTP Error (408|429|5\d\d)")
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int  # Including the first
+    base_delay: float  # Seconds; backoff ceiling for the first retry
+    max_delay: float
+    deadline: float  # Seconds for the whole call, waits included
+
+
+DEFAULT_POLICIES = {
+    "groq": RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=8, deadline=30),
+    "together": RetryPolicy(max_attempts=3, base_delay=1, max_delay=10, deadline=60),
+    "gemini": RetryPolicy(max_attempts=3, base_delay=1, max_delay=10, deadline=60),
+    "youtube": RetryPolicy(max_attempts=3, base_delay=2, max_delay=20, deadline=120),
+    "telegram": RetryPolicy(max_attempts=4, base_delay=1, max_delay=30, deadline=120),
+    "speech": RetryPolicy(max_attempts=3, base_delay=1, max_delay=8, deadline=30),
+}
+FALLBACK_POLICY = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=10, deadline=30)
+
+
+def policy_for(target: str) -> RetryPolicy:
+    """Policy for a target, with RETRY_<TARGET>_ATTEMPTS and RETRY_<TARGET>_DEADLINE overrides."""
+    policy = DEFAULT_POLICIES.get(target, FALLBACK_POLICY)
+    prefix = f"RETRY_{target.upper()}"
+    try:
+        attempts = os.getenv(f"{prefix}_ATTEMPTS")
+        deadline = os.getenv(f"{prefix}_DEADLINE")
+        if attempts:
+            policy = replace(policy, max_attempts=max(1, int(attempts)))
+        if deadline:
+            policy = replace(policy, deadline=float(deadline))
+    except ValueError:
+        logger.warning(f"Invalid {prefix}_* setting, using defaults")
+    return policy
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status carried by an SDK exception, if any."""
+    for attr in ("status_code", "http_status", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    value = getattr(getattr(error, "response", None), "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _headers(error: BaseException):
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is None:
+        headers = getattr(error, "headers", None)
+    return headers if hasattr(headers, "get") else None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, from ``RetryAfter`` or Retry-After headers."""
+    if isinstance(error, RetryAfter):
+        value = error.retry_after
+        return value.total_seconds() if isinstance(value, timedelta) else float(value)
+    headers = _headers(error)
+    if headers is not None:
+        value = headers.get("retry-after-ms")
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(value)
+                    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+    # Google API errors carry a RetryInfo detail
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and hasattr(delay, "seconds"):
+            return delay.seconds + getattr(delay, "nanos", 0) / 1e9
+    return None
+
+
+def classify(error: BaseException) -> Optional[str]:
+    """Retry reason for a transient error, or None if retrying won't help."""
+    if isinstance(error, RetryAfter):
+        return "rate_limited"
+    if isinstance(error, (BadRequest, Forbidden)):
+        return None
+    if isinstance(error, TimedOut):
+        return "timeout"
+    if isinstance(error, NetworkError):
+        return "network"
+    status = status_code(error)
+    if status is not None:
+        if status == 429:
+            return "rate_limited"
+        if status in RETRYABLE_STATUS:
+            return "server_error"
+        return None
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & TRANSIENT_ERRORS:
+        return "rate_limited" if names & {"RateLimitError", "TooManyRequests", "ResourceExhausted"} else "network"
+    match = HTTP_ERROR_MESSAGE.search(str(error))
+    if match:
+        return "rate_limited" if match.group(1) == "429" else "server_error"
+    return None
+
+
+class RetryBudget:
+    """Caps retries at a share of calls for one target."""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, maximum: float = RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.maximum = maximum
+        self.tokens = maximum
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryEngine:
+    """Retries calls per target with backoff, deadlines and budgets."""
+
+    def __init__(self, enabled: bool = RETRY_ENABLED):
+        self.enabled = enabled
+        self._budgets: Dict[str, RetryBudget] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _budget(self, target: str) -> RetryBudget:
+        with self._lock:
+            budget = self._budgets.get(target)
+            if budget is None:
+                budget = self._budgets[target] = RetryBudget()
+            return budget
+
+    def _count(self, target: str, key: str):
+        with self._lock:
+            counts = self._counts.setdefault(target, {"calls": 0, "attempts": 0, "retries": 0, "giveups": 0})
+            counts[key] += 1
+
+    def _start(self, target: str, policy: Optional[RetryPolicy]) -> RetryPolicy:
+        self._budget(target).deposit()
+        self._count(target, "calls")
+        RETRY_CALLS.inc(target=target)
+        return policy or policy_for(target)
+
+    def _attempted(self, target: str):
+        self._count(target, "attempts")
+        RETRY_ATTEMPTS.inc(target=target)
+
+    def _next_delay(self, target: str, policy: RetryPolicy, error: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up and re-raise."""
+        reason = classify(error)
+        if reason is None or not self.enabled:
+            return None
+        giveup = None
+        backoff = random.uniform(0, min(policy.max_delay, policy.base_delay * 2 ** (attempt - 1)))
+        requested = retry_after(error)
+        delay = max(backoff, requested) if requested is not None else backoff
+        if attempt >= policy.max_attempts:
+            giveup = "attempts"
+        elif time.monotonic() + delay >= deadline:
+            giveup = "deadline"
+        elif not self._budget(target).withdraw():
+            giveup = "budget"
+        if giveup:
+            self._count(target, "giveups")
+            RETRY_GIVEUPS.inc(target=target, reason=giveup)
+            logger.warning(f"Giving up on {target} after {attempt} attempt(s) ({giveup}): {str(error)}")
+            return None
+        self._count(target, "retries")
+        RETRIES.inc(target=target, reason=reason)
+        logger.warning(f"Retrying {target} in {delay:.1f}s (attempt {attempt}, {reason}): {str(error)}")
+        return delay
+
+    async def call(
+        self,
+        target: str,
+        func: Callable[[], Awaitable[T]],
+        policy: Optional[RetryPolicy] = None,
+        on_retry: Optional[Callable[[Exception, float], None]] = None
+    ) -> T:
+        """Await ``func()`` and retry transient failures.
+
+        Args:
+            target (str): Policy and counter name, e.g. "groq" or "telegram"
+            func (callable): Starts one attempt; called again for every retry
+            policy (RetryPolicy, optional): Overrides the target's policy
+            on_retry (callable, optional): Called with the error and delay before each wait
+
+        Returns:
+            The first successful result. The last error is re-raised when
+            the error is not transient or the attempts, deadline or budget run out.
+        """
+        policy = self._start(target, policy)
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            self._attempted(target)
+            try:
+                return await func()
+            except Exception as e:
+                delay = self._next_delay(target, policy, e, attempt, deadline)
+                if delay is None:
+                    raise
+                if on_retry:
+                    on_retry(e, delay)
+            await asyncio.sleep(delay)
+
+    def call_sync(self, target: str, func: Callable[[], T], policy: Optional[RetryPolicy] = None) -> T:
+        """Blocking variant of :meth:`call` for code that runs on a worker thread."""
+        policy = self._start(target, policy)
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            self._attempted(target)
+            try:
+                return func()
+            except Exception as e:
+                delay = self._next_delay(target, policy, e, attempt, deadline)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            counts = {target: dict(values) for target, values in self._counts.items()}
+        for values in counts.values():
+            values["amplification"] = round(values["attempts"] / values["calls"], 2) if values["calls"] else 0.0
+        return counts
+
+    def summary(self) -> List[str]:
+        """One line per target for the admin latency report."""
+        return [
+            f"{target}: calls={values['calls']} retries={values['retries']} "
+            f"giveups={values['giveups']} amplification={values['amplification']:.2f}x"
+            for target, values in self.stats().items()
+        ]
+
+
+# Shared engine used across the bot
+retry_engine = RetryEngine()
+retry_call = retry_engine.call
+retry_sync = retry_engine.call_sync
@@ -0,0 +1,163 @@
+"""Persistent storage for sessions, subscriptions and bot status.
+
+``SessionBackend`` is the interface the session store and bot talk to.
+``SQLiteSessionBackend`` keeps everything in a local SQLite database in WAL
+mode so a restart resumes with warm state; ``MemorySessionBackend`` keeps
+the old in-process behaviour. Pick one with ``SESSION_BACKEND``.
+"""
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional, Set
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite').lower()
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'bot_sessions.db')
+
+
+class SessionBackend:
+    """Interface for session persistence. The base class stores nothing."""
+
+    def load_session(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return None
+
+    def save_sessions(self, sessions: Dict[int, Dict[str, Any]]):
+        pass
+
+    def delete_session(self, user_id: int):
+        pass
+
+    def load_subscribers(self) -> Set[int]:
+        return set()
+
+    def set_subscribed(self, user_id: int, is_subscribed: bool):
+        pass
+
+    def load_status(self) -> Dict[str, Any]:
+        return {}
+
+    def save_status(self, status: Dict[str, Any]):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemorySessionBackend(SessionBackend):
+    """No persistence: state lives only as long as the process."""
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """SQLite (WAL) backed persistence, safe to use from worker threads."""
+
+    def __init__(self, path: str = SESSION_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.setup_database()
+
+    def setup_database(self):
+        """Create necessary tables if they don't exist."""
+        with self._lock:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    user_id INTEGER PRIMARY KEY
+                );
+                CREATE TABLE IF NOT EXISTS bot_status (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+            # Older versions persisted users' own API keys; scrub them
+            self.connection.execute(
+                "UPDATE sessions SET data = json_remove(data, '$._groq_api_key', '$._together_api_key') "
+                "WHERE data LIKE '%_api_key%'"
+            )
+            self.connection.commit()
+
+    def load_session(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT data FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except json.JSONDecodeError as e:
+            logger.error(f"Corrupt session for user {user_id}: {str(e)}")
+            return None
+
+    def save_sessions(self, sessions: Dict[int, Dict[str, Any]]):
+        if not sessions:
+            return
+        rows = [(user_id, json.dumps(data)) for user_id, data in sessions.items()]
+        with self._lock:
+            self.connection.executemany(
+                "INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                rows
+            )
+            self.connection.commit()
+
+    def delete_session(self, user_id: int):
+        with self._lock:
+            self.connection.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            self.connection.commit()
+
+    def load_subscribers(self) -> Set[int]:
+        with self._lock:
+            rows = self.connection.execute("SELECT user_id FROM subscribers").fetchall()
+        return {row[0] for row in rows}
+
+    def set_subscribed(self, user_id: int, is_subscribed: bool):
+        with self._lock:
+            if is_subscribed:
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO subscribers (user_id) VALUES (?)", (user_id,)
+                )
+            else:
+                self.connection.execute("DELETE FROM subscribers WHERE user_id = ?", (user_id,))
+            self.connection.commit()
+
+    def load_status(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self.connection.execute("SELECT key, value FROM bot_status").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_status(self, status: Dict[str, Any]):
+        rows = [(key, json.dumps(value)) for key, value in status.items()]
+        with self._lock:
+            self.connection.executemany(
+                "INSERT INTO bot_status (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                rows
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def create_backend(kind: str = SESSION_BACKEND) -> SessionBackend:
+    """Create the backend selected by ``SESSION_BACKEND``."""
+    if kind == "sqlite":
+        logger.info(f"Using SQLite session backend at {SESSION_DB_PATH}")
+        return SQLiteSessionBackend(SESSION_DB_PATH)
+    if kind != "memory":
+        logger.warning(f"Unknown SESSION_BACKEND '{kind}', falling back to memory")
+    return MemorySessionBackend()
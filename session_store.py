@@ -0,0 +1,408 @@
+"""Bounded in-memory store for per-user bot sessions.
+
+Sessions are kept in LRU order and evicted when the store exceeds
+``SESSION_MAX_USERS`` or when a session has been idle for longer than
+``SESSION_IDLE_TTL`` seconds. ``UserSession`` uses ``__slots__`` and only
+stores API keys a user set explicitly; everyone else shares the defaults
+read once from the environment.
+
+With a persistent backend, sessions are hydrated lazily the first time a
+user is seen after a restart and written back in batches (write-behind)
+every ``SESSION_FLUSH_INTERVAL`` seconds. Only sessions whose persisted
+fields actually changed are written. A session dropped from memory, by LRU
+or by idle TTL, is hydrated again from the backend on its next access.
+
+Users' own API keys are never persisted: they stay in memory, also for a
+while after their session is evicted, under the same bounds as sessions.
+Keys of a user idle for longer than ``SESSION_IDLE_TTL`` are forgotten, as
+are the oldest ones once more than ``SESSION_MAX_USERS`` users' keys are
+held for evicted sessions.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict, namedtuple
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+from session_backend import SessionBackend, MemorySessionBackend
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SESSION_MAX_USERS = int(os.getenv('SESSION_MAX_USERS', '10000'))
+SESSION_IDLE_TTL = float(os.getenv('SESSION_IDLE_TTL', '86400'))  # 24 hours
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', '5'))
+
+# Read once and shared by every session that has no key of its own
+DEFAULT_API_KEYS = {
+    "groq": os.getenv('GROQ_API_KEY'),
+    "together": os.getenv('TOGETHER_API_KEY'),
+}
+
+# Just the identifiers we need from a Telegram PhotoSize
+PhotoRef = namedtuple("PhotoRef", ["file_id", "file_unique_id"])
+
+
+class UserSession:
+    __slots__ = (
+        "conversation_history",
+        "conversation_summary",
+        "last_response",
+        "last_image_prompt",
+        "last_image_url",
+        "last_photo",
+        "selected_model",
+        "last_enhanced_prompt",
+        "subscribed_to_status",
+        "temperature",
+        "last_access",
+        "_fold_lock",
+        "_saved_hash",
+        "_groq_api_key",
+        "_together_api_key",
+    )
+
+    def __init__(self):
+        self.conversation_history = []
+        self.conversation_summary = ""  # Rolling summary of folded turns
+        self.last_response = None
+        self.last_image_prompt = None
+        self.last_image_url = None
+        self.last_photo = None  # PhotoRef of the last photo for inline keyboard actions
+        self.selected_model = "llama3-70b-8192"  # Default Groq model
+        self.last_enhanced_prompt = None
+        self.subscribed_to_status = False
+        self.temperature = 0.7
+        self.last_access = time.monotonic()
+        self._fold_lock = None  # Created on first fold
+        self._saved_hash = None  # Hash of the persisted fields as last loaded or written
+        self._groq_api_key = None  # None means "use the shared default"
+        self._together_api_key = None
+
+    # Fields written to the persistent backend (API keys deliberately excluded)
+    PERSISTED_FIELDS = (
+        "conversation_history",
+        "conversation_summary",
+        "last_response",
+        "last_image_prompt",
+        "last_image_url",  # Telegram file_id of the last generated image
+        "last_enhanced_prompt",
+        "selected_model",
+        "subscribed_to_status",
+        "temperature",
+    )
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in self.PERSISTED_FIELDS}
+        data["last_photo"] = list(self.last_photo) if self.last_photo else None
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "UserSession":
+        session = cls()
+        for name in cls.PERSISTED_FIELDS:
+            if name in data:
+                setattr(session, name, data[name])
+        if data.get("last_photo"):
+            session.last_photo = PhotoRef(*data["last_photo"])
+        session._saved_hash = session.state_hash(data)
+        return session
+
+    def state_hash(self, data: Optional[Dict[str, Any]] = None) -> int:
+        """Hash of the persisted fields, used to skip writing unchanged sessions."""
+        return hash(json.dumps(data if data is not None else self.to_dict(), sort_keys=True, default=str))
+
+    @property
+    def fold_lock(self) -> asyncio.Lock:
+        """Serializes folding the conversation history into the summary."""
+        if self._fold_lock is None:
+            self._fold_lock = asyncio.Lock()
+        return self._fold_lock
+
+    @property
+    def groq_api_key(self) -> Optional[str]:
+        return self._groq_api_key or DEFAULT_API_KEYS["groq"]
+
+    @groq_api_key.setter
+    def groq_api_key(self, value: Optional[str]):
+        self._groq_api_key = value
+
+    @property
+    def together_api_key(self) -> Optional[str]:
+        return self._together_api_key or DEFAULT_API_KEYS["together"]
+
+    @together_api_key.setter
+    def together_api_key(self, value: Optional[str]):
+        self._together_api_key = value
+
+    def approx_size(self) -> int:
+        """Approximate memory held by this session in bytes."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.conversation_history)
+        for message in self.conversation_history:
+            size += sys.getsizeof(message)
+            size += sum(sys.getsizeof(v) for v in message.values())
+        for name in ("conversation_summary", "last_response", "last_image_prompt",
+                     "last_image_url", "last_enhanced_prompt", "last_photo"):
+            value = getattr(self, name)
+            if value is not None:
+                size += sys.getsizeof(value)
+        return size
+
+
+class SessionStore:
+    """LRU + idle-TTL bounded mapping of user_id -> UserSession."""
+
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX_USERS,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        factory: Callable[[], UserSession] = UserSession,
+        backend: Optional[SessionBackend] = None
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.factory = factory
+        self.backend = backend or MemorySessionBackend()
+        self.on_evict: Optional[Callable[[int, UserSession], None]] = None
+        self._sessions: "OrderedDict[int, UserSession]" = OrderedDict()
+        self._dirty: set = set()  # Handed out since the last flush; written only if changed
+        # Own keys of sessions dropped from memory: user_id -> (groq, together, last_access)
+        self._api_keys: "OrderedDict[int, tuple]" = OrderedDict()
+        self._pending: Dict[int, Dict[str, Any]] = {}  # Snapshots of evicted dirty sessions
+        self._flush_task: Optional[asyncio.Task] = None
+        self.created_count = 0
+        self.hydrated_count = 0
+        self.evicted_count = 0
+        self.expired_count = 0
+        self.flushed_count = 0
+
+    def _is_expired(self, session: UserSession, now: float) -> bool:
+        return now - session.last_access > self.idle_ttl
+
+    def get(self, user_id: int) -> Optional[UserSession]:
+        """Return the live session for a user, refreshing its LRU position.
+
+        Sessions not in memory (never loaded, evicted or idle past the TTL)
+        are hydrated from the backend. Sessions handed out are checked for
+        changes at the next flush.
+        """
+        session = self._sessions.get(user_id)
+        if session is not None and self._is_expired(session, time.monotonic()):
+            self._remove(user_id, expired=True)
+            session = None
+        if session is None:
+            session = self._hydrate(user_id)
+            if session is None:
+                return None
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(user_id)
+        self._dirty.add(user_id)
+        return session
+
+    def _hydrate(self, user_id: int) -> Optional[UserSession]:
+        data = self._pending.pop(user_id, None)
+        unsaved = data is not None
+        if data is None:
+            try:
+                data = self.backend.load_session(user_id)
+            except Exception as e:
+                logger.error(f"Error loading session for {user_id}: {str(e)}")
+                return None
+        if data is None:
+            return None
+        session = UserSession.from_dict(data)
+        keys = self._api_keys.pop(user_id, None)
+        if keys and time.monotonic() - keys[2] <= self.idle_ttl:
+            session._groq_api_key, session._together_api_key = keys[:2]
+        self._insert(user_id, session)
+        if unsaved:
+            # The snapshot never reached the backend, so it still needs writing
+            session._saved_hash = None
+            self._dirty.add(user_id)
+        self.hydrated_count += 1
+        return session
+
+    def get_or_create(self, user_id: int) -> UserSession:
+        session = self.get(user_id)
+        if session is None:
+            # Cheap: stops at the first live session in LRU order
+            self.evict_expired()
+            session = self.factory()
+            self[user_id] = session
+            self.created_count += 1
+        return session
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id: int) -> UserSession:
+        session = self.get(user_id)
+        if session is None:
+            raise KeyError(user_id)
+        return session
+
+    def __setitem__(self, user_id: int, session: UserSession):
+        self._insert(user_id, session)
+        self._dirty.add(user_id)
+
+    def _insert(self, user_id: int, session: UserSession):
+        session.last_access = time.monotonic()
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        while len(self._sessions) > self.max_sessions:
+            oldest = next(iter(self._sessions))
+            self._remove(oldest, expired=False)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def pop(self, user_id: int, default: Any = None) -> Any:
+        self._dirty.discard(user_id)
+        self._pending.pop(user_id, None)
+        self._api_keys.pop(user_id, None)
+        return self._sessions.pop(user_id, default)
+
+    def items(self):
+        return list(self._sessions.items())
+
+    def _remove(self, user_id: int, expired: bool):
+        session = self._sessions.pop(user_id, None)
+        if session is None:
+            return
+        if expired:
+            self.expired_count += 1
+        else:
+            self.evicted_count += 1
+        if not expired and (session._groq_api_key or session._together_api_key):
+            # Kept until the session would have expired anyway
+            self._api_keys[user_id] = (session._groq_api_key, session._together_api_key, session.last_access)
+            self._api_keys.move_to_end(user_id)
+            self._prune_api_keys()
+        if user_id in self._dirty:
+            # Keep a snapshot so the write still happens on the next flush
+            self._dirty.discard(user_id)
+            data = session.to_dict()
+            if session.state_hash(data) != session._saved_hash:
+                self._pending[user_id] = data
+        if self.on_evict:
+            try:
+                self.on_evict(user_id, session)
+            except Exception as e:
+                logger.error(f"Error in session eviction hook for {user_id}: {str(e)}")
+
+    def _prune_api_keys(self):
+        """Forget kept keys of users idle past the TTL, and the oldest beyond ``max_sessions``."""
+        now = time.monotonic()
+        # Added in eviction (LRU) order, so the oldest accesses come first
+        while self._api_keys:
+            user_id, keys = next(iter(self._api_keys.items()))
+            if now - keys[2] <= self.idle_ttl and len(self._api_keys) <= self.max_sessions:
+                break
+            del self._api_keys[user_id]
+
+    def evict_expired(self) -> int:
+        """Drop every session idle for longer than the TTL."""
+        now = time.monotonic()
+        # Sessions are in LRU order, so stop at the first live one
+        expired = []
+        for user_id, session in self._sessions.items():
+            if not self._is_expired(session, now):
+                break
+            expired.append(user_id)
+        for user_id in expired:
+            self._remove(user_id, expired=True)
+        self._prune_api_keys()
+        return len(expired)
+
+    def _collect_dirty(self) -> Dict[int, Dict[str, Any]]:
+        batch = self._pending
+        self._pending = {}
+        for user_id in self._dirty:
+            session = self._sessions.get(user_id)
+            if session is None:
+                continue
+            data = session.to_dict()
+            digest = session.state_hash(data)
+            if digest != session._saved_hash:
+                batch[user_id] = data
+                # Optimistic: a failed flush re-queues the snapshot itself
+                session._saved_hash = digest
+        self._dirty = set()
+        return batch
+
+    async def flush(self) -> int:
+        """Write modified sessions to the backend off the event loop."""
+        batch = self._collect_dirty()
+        if not batch:
+            return 0
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.backend.save_sessions, batch)
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} sessions: {str(e)}")
+            # Put them back so the next flush retries
+            for user_id, data in batch.items():
+                self._pending.setdefault(user_id, data)
+            return 0
+        self.flushed_count += len(batch)
+        return len(batch)
+
+    def flush_sync(self) -> int:
+        """Blocking flush, used at shutdown when no event loop is running."""
+        batch = self._collect_dirty()
+        self.backend.save_sessions(batch)
+        self.flushed_count += len(batch)
+        return len(batch)
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def start_flusher(self, interval: float = SESSION_FLUSH_INTERVAL):
+        """Start periodic write-behind flushing on the running event loop."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop(interval))
+
+    async def stop_flusher(self):
+        """Stop the flusher and write out anything still pending."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """Session counts and approximate memory usage."""
+        total_bytes = 0
+        total_turns = 0
+        custom_keys = 0
+        for session in self._sessions.values():
+            total_bytes += session.approx_size()
+            total_turns += len(session.conversation_history)
+            if session._groq_api_key or session._together_api_key:
+                custom_keys += 1
+        count = len(self._sessions)
+        return {
+            "sessions": count,
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "created": self.created_count,
+            "hydrated": self.hydrated_count,
+            "flushed": self.flushed_count,
+            "pending_writes": len(self._dirty) + len(self._pending),
+            "evicted": self.evicted_count,
+            "expired": self.expired_count,
+            "kept_api_keys": len(self._api_keys),
+            "history_messages": total_turns,
+            "sessions_with_own_keys": custom_keys,
+            "approx_bytes": total_bytes,
+            "avg_bytes_per_session": total_bytes // count if count else 0,
+        }
@@ -0,0 +1,73 @@
+"""Single-flight coalescing of identical in-flight requests.
+
+When many users send the same YouTube link or forward the same photo at
+once, only the first request (the leader) runs the pipeline; concurrent
+requests with the same key await the leader's result instead of repeating
+the downloads and provider calls. Keys are normalized input identities such
+as a YouTube video ID, a Telegram ``file_unique_id`` or ``(prompt, model)``.
+
+Nothing is cached: once the shared computation finishes, the next request
+for the key starts a fresh one.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Deduplicates concurrent async calls that share a key."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Run ``func()`` unless a call for ``key`` is already in flight.
+
+        Every caller gets the same result or exception. The shared task is
+        shielded, so one caller being cancelled doesn't cancel it for the rest.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.info(f"[{self.name}] Joining in-flight call for {key!r}")
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: "asyncio.Task[Any]"):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieved here so an abandoned failure isn't logged as "never retrieved"
+            logger.debug(f"[{self.name}] Shared call for {key!r} failed: {task.exception()}")
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+# Shared groups, one per kind of pipeline
+youtube_flights = SingleFlight("youtube")
+vision_flights = SingleFlight("vision")
+text_flights = SingleFlight("text")
+
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    """Coalescing counters for every shared group."""
+    return {group.name: group.stats() for group in (youtube_flights, vision_flights, text_flights)}
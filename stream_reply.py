@@ -0,0 +1,107 @@
+"""Progressive Telegram replies for streamed model output.
+
+A placeholder message is sent first and then edited as tokens arrive.
+Edits are coalesced: the message is only edited once at least
+``min_interval`` seconds have passed since the last edit and at least
+``min_chars`` new characters have accumulated, which keeps us well under
+Telegram's per-chat edit limits. Text longer than one Telegram message
+spills over into follow-up messages.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import List, Optional
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MAX_LENGTH = 4096
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+STREAM_EDIT_MIN_CHARS = int(os.getenv('STREAM_EDIT_MIN_CHARS', '40'))
+CURSOR = " ▌"
+
+
+class StreamingReply:
+    """Reply to a message and keep editing it with accumulated text."""
+
+    def __init__(
+        self,
+        message: Message,
+        placeholder: str = "💭 Thinking...",
+        min_interval: float = STREAM_EDIT_INTERVAL,
+        min_chars: int = STREAM_EDIT_MIN_CHARS
+    ):
+        self.message = message
+        self.placeholder = placeholder
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.text = ""
+        self.edit_count = 0
+        self._sent: List[Message] = []
+        self._offset = 0  # Start of the text shown in the current message
+        self._shown_length = 0
+        self._last_edit = 0.0
+        self._blocked_until = 0.0
+
+    @property
+    def current(self) -> Optional[Message]:
+        return self._sent[-1] if self._sent else None
+
+    async def start(self):
+        """Send the placeholder message."""
+        self._sent.append(await self.message.reply_text(self.placeholder))
+        self._last_edit = time.monotonic()
+
+    async def append(self, chunk: str):
+        """Add streamed text, editing the message if the schedule allows."""
+        if not chunk:
+            return
+        self.text += chunk
+
+        # Finalize full messages and continue in a new one
+        while len(self.text) - self._offset > TELEGRAM_MAX_LENGTH:
+            end = self._offset + TELEGRAM_MAX_LENGTH
+            await self._edit(self.text[self._offset:end], force=True)
+            self._offset = end
+            self._sent.append(await self.message.reply_text(CURSOR.strip()))
+            self._shown_length = 0
+
+        pending = len(self.text) - self._offset - self._shown_length
+        now = time.monotonic()
+        if (
+            pending >= self.min_chars
+            and now - self._last_edit >= self.min_interval
+            and now >= self._blocked_until
+        ):
+            await self._edit(self.text[self._offset:] + CURSOR)
+
+    async def finish(self) -> str:
+        """Write the final text (without cursor) and return the full reply."""
+        final = self.text[self._offset:] or "(no response)"
+        await self._edit(final, force=True)
+        return self.text
+
+    async def _edit(self, text: str, force: bool = False):
+        message = self.current
+        if message is None:
+            return
+        try:
+            await message.edit_text(text)
+            self.edit_count += 1
+            self._shown_length = len(text.replace(CURSOR, ""))
+        except RetryAfter as e:
+            # Skip intermediate edits until Telegram allows them again
+            self._blocked_until = time.monotonic() + float(e.retry_after)
+            logger.warning(f"Edit rate limited, backing off {e.retry_after}s")
+            if force:
+                # Final text must land, so wait it out and retry once
+                await asyncio.sleep(float(e.retry_after))
+                await message.edit_text(text)
+                self.edit_count += 1
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        finally:
+            self._last_edit = time.monotonic()
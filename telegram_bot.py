@@ -1,4 +1,8 @@
+# Imported first so the startup report can time every import below
+from lazy_init import Lazy, startup_profile, warm_up, lazy_import, STARTUP_WARMUP
 from telegram import Update, Bot, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.request import BaseRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -14,30 +18,47 @@ import time
 import logging
 import tempfile
 from pathlib import Path
-import base64
-from groq import Groq
 import asyncio
 import html
-from PIL import Image
+import hashlib
 import io
-import google.generativeai as genai
+from typing import Optional, Tuple
 from dotenv import load_dotenv
 import video_insights
 from constants import HELP_MESSAGE, SUMMARY_PROMPT, MEDIA_FOLDER
 from image_generator import AIImageGenerator
 from image_caption import ImageCaptioner
 from video_insights import get_insights
-from database_helper import DatabaseHelper
-
-# Initialize image generator and captioner
-image_generator = AIImageGenerator()
-image_captioner = ImageCaptioner()
+from provider_executor import run_provider, shutdown_executors
+from circuit_breaker import breakers, hedged, key_scope
+from model_router import router
+from retry_policy import retry_call, retry_engine
+from client_registry import registry
+from stream_reply import StreamingReply
+from conversation_context import conversation_context
+from session_store import SessionStore, UserSession, PhotoRef
+from session_backend import create_backend
+from admission_control import admission
+from media_jobs import media_jobs, cancel_keyboard, CANCEL_PREFIX, Job, JobContext
+from media_worker import media_worker
+from single_flight import vision_flights, text_flights
+from response_cache import ResponseCache, vision_cache, MISSING
+from prompt_cache import normalize_prompt
+from outbox import outbox
+from metrics import stage, instrument_handlers, latency_summary, metrics_server, METRICS_ENABLED, HANDLER_LATENCY
+from tracing import tracer, record_token_usage
+
+# Built on first use (or by the background warm-up) to keep startup fast
+image_generator = Lazy("AIImageGenerator", AIImageGenerator)
+image_captioner = Lazy("ImageCaptioner", ImageCaptioner)
 
 # Load environment variables
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ROOT_PASSWORD = os.getenv('ROOT_PASSWORD')
 ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID', '0'))  # Default to 0 if not set
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()  # polling or webhook
+STREAM_CHAT_REPLIES = os.getenv('STREAM_CHAT_REPLIES', 'true').lower() == 'true'
 
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables")
@@ -58,11 +79,27 @@ logger = logging.getLogger(__name__)
 TEMP_DIR = Path(tempfile.gettempdir()) / "aifusionbot_temp"
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
 
-# Global variable for user sessions
-user_sessions = {}
+# Persistent backend for sessions, subscriptions and bot status
+session_backend = create_backend()
+
+# Bounded store of user sessions (LRU + idle TTL), hydrated lazily from the backend
+user_sessions = SessionStore(backend=session_backend)
+
+def create_database():
+    from database_helper import DatabaseHelper
+    return DatabaseHelper()
+
+# Database connection, opened on first use
+db = Lazy("DatabaseHelper", create_database)
 
-# Initialize database
-db = DatabaseHelper()
+# Heavy SDK imports that are only needed by some commands
+LAZY_IMPORTS = [
+    Lazy("import google.generativeai", lazy_import("google.generativeai")),
+    Lazy("import yt_dlp", lazy_import("yt_dlp")),
+]
+
+# Telegram file_ids of images we've already uploaded, keyed by SHA-256 of the bytes
+sent_image_ids = ResponseCache("telegram_file_ids")
 
 # Dictionary of available commands and their descriptions
 COMMANDS = {
@@ -77,36 +114,27 @@ COMMANDS = {
     "/clear_chat": "Clear chat history",
     "/export": "Export chat history",
     "/analyze_video": "Analyze a video file",
+    "/youtube_summary": "Summarize a YouTube video",
     "/status": "Check bot status",
     "/subscribe": "Subscribe to bot updates",
     "/unsubscribe": "Unsubscribe from updates",
     "/maintenance": "Toggle maintenance mode (Admin only)",
+    "/sessions": "Show session memory stats (Admin only)",
+    "/cache": "Inspect or flush the response cache (Admin only)",
+    "/latency": "Show per-stage latency percentiles (Admin only)",
     "/setgroqapi": "Set your Groq API key"
 }
 
 # Group commands by category for help menu
 COMMAND_CATEGORIES = {
     "🤖 Chat": ['chat', 'clear_chat', 'export'],
-    "🎨 Media": ['imagine', 'caption', 'enhance', 'describe', 'analyze_video'],
+    "🎨 Media": ['imagine', 'caption', 'enhance', 'describe', 'analyze_video', 'youtube_summary'],
     "🔊 Settings": ['settings', 'setgroqapi'],
     "📊 Status": ['status', 'subscribe', 'unsubscribe'],
     "ℹ️ General": ['start', 'help'],
-    "🔐 Admin": ['maintenance']
+    "🔐 Admin": ['maintenance', 'sessions', 'cache', 'latency']
 }
 
-class UserSession:
-    def __init__(self):
-        self.conversation_history = []
-        self.last_response = None
-        self.last_image_prompt = None
-        self.last_image_url = None
-        self.last_photo = None  # Store last photo for inline keyboard actions
-        self.selected_model = "llama3-70b-8192"  # Default Groq model
-        self.groq_api_key = os.getenv('GROQ_API_KEY')
-        self.together_api_key = os.getenv('TOGETHER_API_KEY')
-        self.last_enhanced_prompt = None
-        self.subscribed_to_status = False  # New field for status subscription
-
 BOT_STATUS = {
     "is_maintenance": False,
     "maintenance_message": "",
@@ -119,9 +147,37 @@ BOT_STATUS = {
     "last_offline_time": None
 }
 
-# Dictionary to store subscribed users
+# Dictionary to store subscribed users (restored from the backend on startup)
 subscribed_users = set()
 
+# BOT_STATUS keys that survive a restart
+PERSISTED_STATUS_KEYS = ("is_maintenance", "maintenance_message", "maintenance_start", "maintenance_end")
+
+def persist_bot_status():
+    """Save the restart-safe part of BOT_STATUS to the session backend."""
+    status = {}
+    for key in PERSISTED_STATUS_KEYS:
+        value = BOT_STATUS[key]
+        status[key] = value.isoformat() if isinstance(value, datetime) else value
+    try:
+        session_backend.save_status(status)
+    except Exception as e:
+        logger.error(f"Error saving bot status: {str(e)}")
+
+def restore_state():
+    """Restore subscriptions and bot status saved before the last restart."""
+    start = time.perf_counter()
+    subscribed_users.update(session_backend.load_subscribers())
+    for key, value in session_backend.load_status().items():
+        if key in ("maintenance_start", "maintenance_end") and value:
+            value = datetime.fromisoformat(value)
+        if key in PERSISTED_STATUS_KEYS:
+            BOT_STATUS[key] = value
+    logger.info(
+        f"Restored {len(subscribed_users)} subscribers and bot status "
+        f"in {(time.perf_counter() - start) * 1000:.1f}ms"
+    )
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
     if not update.message:
@@ -193,11 +249,10 @@ async def setgroqapi_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     user_id = update.effective_user.id
-    if user_id not in user_sessions:
-        user_sessions[user_id] = UserSession()
+    session = user_sessions.get_or_create(user_id)
     
     api_key = context.args[0]
-    user_sessions[user_id].groq_api_key = api_key
+    session.groq_api_key = api_key
     
     # Delete the message containing the API key for security
     await update.message.delete()
@@ -205,7 +260,8 @@ async def setgroqapi_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Send confirmation
     await update.message.reply_text(
         "✅ Your Groq API key has been set successfully!\n"
-        "You can now use the chat features."
+        "You can now use the chat features.\n"
+        "The key is kept in memory only, so set it again after the bot restarts."
     )
 
 async def setreplicateapi_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -215,32 +271,85 @@ async def setreplicateapi_command(update: Update, context: ContextTypes.DEFAULT_
         "Please set your Together API key in the .env file."
     )
 
-async def interactive_chat(text: str, model_type: str, api_key: str) -> str:
-    """Handle chat interaction with Groq API."""
+async def interactive_chat(text: str, model_type: str, api_key: str, messages: list = None) -> Tuple[str, str]:
+    """Handle chat interaction with Groq API.
+
+    ``messages`` is the full prompt built by the conversation context; when
+    omitted only ``text`` is sent. Returns the reply and the model that
+    wrote it, which is the fallback if the hedge answered.
+    """
     try:
-        # Initialize Groq client
-        client = Groq(api_key=api_key)
+        # Reuse the pooled Groq client for this key
+        client = registry.groq(api_key)
         
-        # Create chat completion (not async)
-        chat_completion = client.chat.completions.create(
-            messages=[
+        # Run the blocking SDK call on the Groq pool, hedged with the fallback model
+        chat_completion, model = await hedged("groq", model_type, lambda model: run_provider(
+            "groq",
+            client.chat.completions.create,
+            breaker_scope=key_scope(api_key),
+            messages=messages or [
                 {
                     "role": "user",
                     "content": text
                 }
             ],
-            model=model_type,
+            model=model,
             temperature=0.7,
             max_tokens=1000,
-        )
+        ))
         
         # Return the response text
-        return chat_completion.choices[0].message.content
+        return chat_completion.choices[0].message.content, model
         
     except Exception as e:
         logger.error(f"Error in interactive_chat: {e}")
         raise Exception(f"Failed to get response from Groq API: {str(e)}")
 
+async def stream_chat(update: Update, text: str, model_type: str, api_key: str, messages: list = None) -> Tuple[str, str]:
+    """Stream a Groq chat reply into Telegram, editing a placeholder as tokens arrive.
+
+    Returns the reply and the model that wrote it.
+    """
+    reply = StreamingReply(update.message)
+    await reply.start()
+
+    client = registry.async_groq(api_key)
+
+    async def open_stream(model: str):
+        # Breaker, retries and hedge cover the time to the first response headers
+        with breakers.guard("groq", model, key_scope(api_key)):
+            return await client.chat.completions.create(
+                messages=messages or [
+                    {
+                        "role": "user",
+                        "content": text
+                    }
+                ],
+                model=model,
+                temperature=0.7,
+                max_tokens=1000,
+                stream=True
+            )
+
+    stream, model = await hedged("groq", model_type, lambda model: retry_call("groq", lambda: open_stream(model)))
+
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            await reply.append(chunk.choices[0].delta.content)
+
+    return await reply.finish(), model
+
+async def record_chat_turn(session: UserSession, message: str, response: str):
+    """Append a user/assistant turn and keep the history within its token budget."""
+    session.conversation_history.append({'role': 'user', 'content': message})
+    session.conversation_history.append({'role': 'assistant', 'content': response})
+    async with session.fold_lock:
+        session.conversation_summary = await conversation_context.fold(
+            session.conversation_history,
+            session.conversation_summary,
+            session.groq_api_key
+        )
+
 async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /chat command."""
     try:
@@ -253,10 +362,7 @@ async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
             
         user_id = update.effective_user.id
-        if user_id not in user_sessions:
-            user_sessions[user_id] = UserSession()
-            
-        session = user_sessions[user_id]
+        session = user_sessions.get_or_create(user_id)
         
         if not session.groq_api_key:
             await update.message.reply_text(
@@ -267,21 +373,35 @@ async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Get the message from arguments
         message = ' '.join(context.args)
         
-        # Add user message to conversation history
-        session.conversation_history.append({
-            'role': 'user',
-            'content': message
-        })
+        # Build a token-budgeted prompt from the summary and recent turns
+        messages = conversation_context.build_messages(
+            session.conversation_history,
+            session.conversation_summary,
+            message
+        )
         
         # Show typing indicator
         await context.bot.send_chat_action(chat_id=update.message.chat_id, action="typing")
         
-        # Get AI response with proper API key
-        response = await interactive_chat(
-            text=message,
-            model_type="llama3-70b-8192",
-            api_key=session.groq_api_key
-        )
+        # Pick the chat model for this user according to the routing policy
+        session.selected_model = router.choose("chat", user_id)
+        
+        # Get AI response with proper API key, streaming it if enabled
+        if STREAM_CHAT_REPLIES:
+            response, answered_by = await stream_chat(
+                update,
+                text=message,
+                model_type=session.selected_model,
+                api_key=session.groq_api_key,
+                messages=messages
+            )
+        else:
+            response, answered_by = await interactive_chat(
+                text=message,
+                model_type=session.selected_model,
+                api_key=session.groq_api_key,
+                messages=messages
+            )
         
         # Store in database
         db.add_or_update_user(
@@ -290,16 +410,14 @@ async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             first_name=update.effective_user.first_name,
             last_name=update.effective_user.last_name
         )
-        db.store_chat(user_id, message, response, "llama3-70b-8192")
+        db.store_chat(user_id, message, response, answered_by)
         
-        # Send text response
-        await update.message.reply_text(response)
+        # Send text response (already delivered when streaming)
+        if not STREAM_CHAT_REPLIES:
+            await update.message.reply_text(response)
         
-        # Add AI response to conversation history
-        session.conversation_history.append({
-            'role': 'assistant',
-            'content': response
-        })
+        # Record the turn and fold old turns into the summary if needed
+        await record_chat_turn(session, message, response)
         
         # Store the last response
         session.last_response = response
@@ -335,7 +453,24 @@ async def imagine_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # Enhance the prompt
-        enhanced_prompt = image_generator.enhance_prompt(prompt)
+        # Recently seen prompts are answered from the cache without a pool hop;
+        # identical prompts submitted at the same time share one enhancement call
+        with stage("imagine", "enhance_prompt") as span:
+            enhanced_prompt = image_generator.cached_enhancement(prompt)
+            if not enhanced_prompt:
+                enhance_model = router.choose("enhance_prompt", user_id)
+                # Provider errors reach the breaker, router and hedge; only here do they become a failed step
+                try:
+                    enhanced_prompt, answered_by = await text_flights.do(
+                        ("enhance", normalize_prompt(prompt), enhance_model),
+                        lambda: hedged("groq", enhance_model, lambda model: run_provider(
+                            "groq", image_generator.request_enhancement, prompt, model=model
+                        ))
+                    )
+                    span.set_attribute("model", answered_by)
+                except Exception as e:
+                    logger.error(f"Error enhancing prompt: {str(e)}")
+                    enhanced_prompt = None
         if not enhanced_prompt:
             await status_message.edit_text("❌ Failed to enhance the prompt. Please try again.")
             return
@@ -343,34 +478,44 @@ async def imagine_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Update status message
         await status_message.edit_text("🎨 Step 2/2: Generating image from enhanced prompt...")
 
-        # Generate the image
+        # Generate the image; every /imagine is a fresh generation, so no single-flight here
         start_time = time.time()
-        success, image_data, error_message = image_generator.generate_image(enhanced_prompt)
+        with stage("imagine", "generate_image"):
+            try:
+                image_data = await run_provider(
+                    "together", image_generator.request_image, enhanced_prompt, model=image_generator.IMAGE_MODEL
+                )
+                success, error_message = True, ""
+            except Exception as e:
+                success, image_data, error_message = False, None, str(e)
         total_time = time.time() - start_time
 
         if success and image_data:
-            # Convert base64 to bytes
-            image_bytes = base64.b64decode(image_data)
-            
-            # Create BytesIO object
-            image_io = io.BytesIO(image_bytes)
-            image_io.name = 'generated_image.png'
-
-            # Store in database
-            db.add_or_update_user(
-                user_id=user_id,
-                username=update.effective_user.username,
-                first_name=update.effective_user.first_name,
-                last_name=update.effective_user.last_name
-            )
-            db.store_image_generation(user_id, prompt, enhanced_prompt, "generated_image.png")
+            # Convert base64 to bytes in the media worker pool
+            with stage("imagine", "decode_image"):
+                image_bytes = await media_worker.decode_b64(image_data)
 
             # Send the image first
-            await update.message.reply_photo(
-                photo=image_io,
-                caption=f"⏱️ Generated in {total_time:.1f}s",
-                parse_mode='Markdown'
-            )
+            with stage("imagine", "telegram_upload"):
+                file_id, content_hash = await send_generated_image(
+                    update.message, image_bytes, f"⏱️ Generated in {total_time:.1f}s"
+                )
+            session = user_sessions.get_or_create(user_id)
+            session.last_image_prompt = prompt
+            session.last_image_url = file_id
+
+            # Store in database
+            with stage("imagine", "db_write"):
+                db.add_or_update_user(
+                    user_id=user_id,
+                    username=update.effective_user.username,
+                    first_name=update.effective_user.first_name,
+                    last_name=update.effective_user.last_name
+                )
+                db.store_image_generation(
+                    user_id, prompt, enhanced_prompt, "generated_image.png",
+                    file_id=file_id, content_hash=content_hash
+                )
 
             # Send prompts as a separate message
             prompts_message = (
@@ -389,6 +534,36 @@ async def imagine_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(error_msg)
         await status_message.edit_text(f"❌ {error_msg}")
 
+async def send_generated_image(message, image_bytes: bytes, caption: str):
+    """Send a generated image, re-using a Telegram file_id when we've sent the same bytes before.
+
+    Returns:
+        tuple: (file_id, content_hash)
+    """
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    file_id = await sent_image_ids.get(content_hash)
+    if file_id is MISSING:
+        try:
+            file_id = db.get_image_file_id(content_hash)
+        except Exception as e:
+            logger.error(f"Error looking up image file_id: {str(e)}")
+            file_id = None
+
+    if file_id:
+        try:
+            # No upload: Telegram already has this file
+            await message.reply_photo(photo=file_id, caption=caption, parse_mode='Markdown')
+            return file_id, content_hash
+        except BadRequest as e:
+            logger.warning(f"Stored file_id rejected, uploading instead: {str(e)}")
+
+    image_io = io.BytesIO(image_bytes)
+    image_io.name = 'generated_image.png'
+    sent = await message.reply_photo(photo=image_io, caption=caption, parse_mode='Markdown')
+    file_id = sent.photo[-1].file_id
+    await sent_image_ids.set(content_hash, file_id)
+    return file_id, content_hash
+
 async def enhance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /enhance command for text enhancement."""
     if not update.message:
@@ -403,10 +578,7 @@ async def enhance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user_id = update.effective_user.id
-    if user_id not in user_sessions:
-        user_sessions[user_id] = UserSession()
-
-    session = user_sessions[user_id]
+    session = user_sessions.get_or_create(user_id)
     if not session.together_api_key:
         await update.message.reply_text(
             " Please set your Together API key first using:\n"
@@ -430,7 +602,7 @@ async def enhance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         enhancer.together_api_key = session.together_api_key
         
         start_time = time.time()
-        success, enhanced_text, error = await enhancer.enhance_text(text)
+        success, enhanced_text, error = await enhancer.enhance_text(text, user_id=user_id)
         total_time = time.time() - start_time
         
         if success and enhanced_text:
@@ -466,10 +638,7 @@ async def enhance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /settings command."""
     user_id = update.effective_user.id
-    if user_id not in user_sessions:
-        user_sessions[user_id] = UserSession()
-    
-    session = user_sessions[user_id]
+    session = user_sessions.get_or_create(user_id)
     
     await update.message.reply_text(
         " Current Settings:\n\n"
@@ -514,47 +683,39 @@ async def temperature_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             raise ValueError("Temperature must be between 0 and 1")
 
         user_id = update.effective_user.id
-        if user_id not in user_sessions:
-            user_sessions[user_id] = UserSession()
-
-        session = user_sessions[user_id]
+        session = user_sessions.get_or_create(user_id)
         session.temperature = temp
         await update.message.reply_text(f"Temperature set to: {temp}")
     except ValueError as e:
         await update.message.reply_text(str(e))
 
-async def describe_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle the /describe command and direct photo messages for image analysis"""
-    try:
-        # Get the photo file
-        if update.message.photo:
-            photo = update.message.photo[-1]  # Get the largest size
-        else:
-            await update.message.reply_text("Please send a photo to describe or use this command as a reply to a photo.")
-            return
+DESCRIBE_MODEL = "llama-3.2-11b-vision-preview"
+DESCRIBE_PROMPT = "Please describe this image in detail. Focus on the main elements, colors, composition, and any notable features."
 
-        # Get user session
-        user_id = update.effective_user.id
-        if user_id not in user_sessions:
-            user_sessions[user_id] = UserSession()
-        session = user_sessions[user_id]
+async def describe_photo(bot: Bot, photo, api_key: str):
+    """Describe a photo with the Groq vision model.
 
-        # Check if Groq API key is set
-        if not session.groq_api_key:
-            await update.message.reply_text(
-                "Please set your Groq API key first using /setgroqkey command."
-            )
-            return
+    Answers are cached by ``file_unique_id``, prompt and model, and
+    concurrent requests for the same photo and API key share a single Groq
+    call. Only the description is cached: Telegram file URLs contain the bot
+    token and expire after about an hour.
 
-        await update.message.reply_text("Analyzing the image... 🔍")
+    Returns:
+        str: the description
+    """
+    key = ("describe", photo.file_unique_id, DESCRIBE_PROMPT, DESCRIBE_MODEL)
+    cached = await vision_cache.get(key)
+    if cached is not MISSING:
+        return cached
 
+    async def compute():
         # Get the file URL
-        photo_file = await context.bot.get_file(photo.file_id)
+        with stage("describe", "file_download"):
+            photo_file = await bot.get_file(photo.file_id)
         file_url = photo_file.file_path
 
-        # Create Groq client
-        client = Groq(api_key=session.groq_api_key)
-        logging.info("Groq client created successfully")
+        # Get the pooled Groq client
+        client = registry.groq(api_key)
 
         # Prepare the message for image analysis
         messages = [
@@ -563,7 +724,7 @@ async def describe_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "content": [
                     {
                         "type": "text",
-                        "text": "Please describe this image in detail. Focus on the main elements, colors, composition, and any notable features."
+                        "text": DESCRIBE_PROMPT
                     },
                     {
                         "type": "image_url",
@@ -576,34 +737,71 @@ async def describe_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
 
         logging.info("Making API request to Groq...")
-        
+
         # Make the API request
-        response = client.chat.completions.create(
-            model="llama-3.2-11b-vision-preview",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1024,
-            top_p=1,
-            stream=False
-        )
+        with stage("describe", "provider_call") as span:
+            response, answered_by = await hedged("groq", DESCRIBE_MODEL, lambda model: run_provider(
+                "groq",
+                client.chat.completions.create,
+                breaker_scope=key_scope(api_key),
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=1024,
+                top_p=1,
+                stream=False
+            ))
+            span.set_attribute("model", answered_by)
+            record_token_usage(response)
 
         logging.info("Received response from Groq")
-
-        # Extract the description
         description = response.choices[0].message.content
+        await vision_cache.set(key, description)
+        return description
+
+    # A call made with someone else's key could hand us their auth or quota error
+    return await vision_flights.do(key + (key_scope(api_key),), compute)
+
+async def describe_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /describe command and direct photo messages for image analysis"""
+    try:
+        # Get the photo file
+        if update.message.photo:
+            photo = update.message.photo[-1]  # Get the largest size
+        else:
+            await update.message.reply_text("Please send a photo to describe or use this command as a reply to a photo.")
+            return
+
+        # Get user session
+        user_id = update.effective_user.id
+        session = user_sessions.get_or_create(user_id)
+
+        # Check if Groq API key is set
+        if not session.groq_api_key:
+            await update.message.reply_text(
+                "Please set your Groq API key first using /setgroqkey command."
+            )
+            return
+
+        await update.message.reply_text("Analyzing the image... 🔍")
+
+        description = await describe_photo(context.bot, photo, session.groq_api_key)
         logging.info("Description extracted from response")
 
         # Store in database
-        db.add_or_update_user(
-            user_id=user_id,
-            username=update.effective_user.username,
-            first_name=update.effective_user.first_name,
-            last_name=update.effective_user.last_name
-        )
-        db.store_image_description(user_id, file_url, description)
+        with stage("describe", "db_write"):
+            db.add_or_update_user(
+                user_id=user_id,
+                username=update.effective_user.username,
+                first_name=update.effective_user.first_name,
+                last_name=update.effective_user.last_name
+            )
+            # The stable file_unique_id, not the token-bearing, expiring file URL
+            db.store_image_description(user_id, photo.file_unique_id, description)
 
         # Send the text description
-        await update.message.reply_text(description)
+        with stage("describe", "reply"):
+            await update.message.reply_text(description)
         logging.info("Text description sent to user")
 
     except Exception as e:
@@ -632,11 +830,9 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Store the photo information in user session
     user_id = update.effective_user.id
-    if user_id not in user_sessions:
-        user_sessions[user_id] = UserSession()
-    
-    session = user_sessions[user_id]
-    session.last_photo = update.message.photo[-1]  # Store the largest photo
+    session = user_sessions.get_or_create(user_id)
+    photo = update.message.photo[-1]  # Store the largest photo
+    session.last_photo = PhotoRef(photo.file_id, photo.file_unique_id)
 
     await update.message.reply_text(
         "What would you like to do with this image?",
@@ -659,7 +855,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     session = user_sessions[user_id]
-    if not hasattr(session, 'last_photo'):
+    if session.last_photo is None:
         await query.edit_message_text("Image not found. Please send the image again.")
         return
 
@@ -687,7 +883,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("🤔 Generating creative caption...")
             success, caption = await image_captioner.generate_caption(
                 photo_url, 
-                "Generate a creative and engaging caption for this image."
+                "Generate a creative and engaging caption for this image.",
+                image_key=session.last_photo.file_unique_id
             )
             
             if success:
@@ -698,7 +895,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     first_name=query.from_user.first_name,
                     last_name=query.from_user.last_name
                 )
-                db.store_image_caption(user_id, photo_url, caption)
+                # The file URL carries the bot token, so record the photo by its unique id
+                db.store_image_caption(user_id, session.last_photo.file_unique_id, caption)
                 
                 await query.edit_message_text(f"🎨 Creative Caption:\n\n{caption}")
             else:
@@ -715,20 +913,34 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     # Get or create user session
     user_id = update.effective_user.id
-    if user_id not in user_sessions:
-        user_sessions[user_id] = UserSession()
-    
-    session = user_sessions[user_id]
+    session = user_sessions.get_or_create(user_id)
     
     # Get the message text
     message_text = update.message.text
     
     try:
-        # Generate response using chat function
-        response = await interactive_chat(message_text, session.selected_model, session.groq_api_key)
+        # Build a token-budgeted prompt from the summary and recent turns
+        messages = conversation_context.build_messages(
+            session.conversation_history,
+            session.conversation_summary,
+            message_text
+        )
+        
+        # Generate response using chat function, with the model picked by the router
+        session.selected_model = router.choose("chat", user_id)
+        if STREAM_CHAT_REPLIES:
+            response, _ = await stream_chat(
+                update, message_text, session.selected_model, session.groq_api_key, messages=messages
+            )
+        else:
+            response, _ = await interactive_chat(
+                message_text, session.selected_model, session.groq_api_key, messages=messages
+            )
+            
+            # Send the text response
+            await update.message.reply_text(response)
         
-        # Send the text response
-        await update.message.reply_text(response)
+        await record_chat_turn(session, message_text, response)
         
     except Exception as e:
         error_message = f"Error processing message: {str(e)}"
@@ -786,6 +998,8 @@ async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             await notify_subscribers(context.bot, end_maintenance_notification)
         
+        persist_bot_status()
+        
         await update.message.reply_text(
             f"✅ Maintenance mode {status}\n"
             f"Status updated by admin {user_id}"
@@ -800,6 +1014,89 @@ async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             "Please try again or check the logs."
         )
 
+async def sessions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show session store size and approximate memory usage. Admin only."""
+    if not update.message or not update.effective_user:
+        return
+
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("🚫 Access Denied: This command is restricted to admin use only.")
+        return
+
+    expired = user_sessions.evict_expired()
+    stats = user_sessions.stats()
+    await update.message.reply_text(
+        "🧠 Session Store\n\n"
+        f"Sessions: {stats['sessions']}/{stats['max_sessions']}\n"
+        f"Created: {stats['created']}\n"
+        f"Evicted (LRU): {stats['evicted']}\n"
+        f"Expired (idle): {stats['expired']} (+{expired} just now)\n"
+        f"History messages: {stats['history_messages']}\n"
+        f"Sessions with own keys: {stats['sessions_with_own_keys']}\n"
+        f"Approx. memory: {stats['approx_bytes'] / 1024:.1f} KB "
+        f"({stats['avg_bytes_per_session']} B/session)"
+    )
+
+async def cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inspect or flush the vision response cache. Admin only.
+
+    Usage: /cache, /cache flush or /cache purge (expired entries only)
+    """
+    if not update.message or not update.effective_user:
+        return
+
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("🚫 Access Denied: This command is restricted to admin use only.")
+        return
+
+    action = context.args[0].lower() if context.args else "inspect"
+    if action == "flush":
+        removed = await vision_cache.flush()
+        await update.message.reply_text(f"🧹 Vision cache flushed ({removed} stored entries removed).")
+        return
+    if action == "purge":
+        removed = await vision_cache.purge_expired()
+        await update.message.reply_text(f"🧹 Removed {removed} expired cache entries.")
+        return
+
+    info = await vision_cache.inspect(limit=5)
+    recent = "\n".join(
+        f"• {entry['key'][:80]} (expires in {entry['expires_in'] // 3600}h)"
+        for entry in info["recent"]
+    ) or "• (empty)"
+    await update.message.reply_text(
+        "🗃 Vision Response Cache\n\n"
+        f"Enabled: {info['enabled']}\n"
+        f"Memory entries: {info['memory_entries']}/{info['max_entries']}\n"
+        f"Disk entries: {info['disk_entries']}\n"
+        f"Hits: {info['memory_hits']} memory, {info['disk_hits']} disk\n"
+        f"Misses: {info['misses']}\n"
+        f"Hit rate: {info['hit_rate']:.0%}\n\n"
+        f"Recent keys:\n{recent}\n\n"
+        "Use /cache flush to clear it."
+    )
+
+async def latency_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show estimated p50/p95/p99 latency per handler and stage. Admin only."""
+    if not update.message or not update.effective_user:
+        return
+
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("🚫 Access Denied: This command is restricted to admin use only.")
+        return
+
+    handlers = latency_summary(HANDLER_LATENCY) or ["No requests yet"]
+    stages = latency_summary() or ["No stages recorded yet"]
+    circuits = breakers.summary() or ["No provider calls yet"]
+    await update.message.reply_text(
+        "⏱️ Latency (estimated from histogram buckets)\n\n"
+        "Handlers:\n" + "\n".join(handlers) + "\n\n"
+        "Stages:\n" + "\n".join(stages) + "\n\n"
+        "Circuits:\n" + "\n".join(circuits) + "\n\n"
+        "Routing:\n" + "\n".join(router.summary()) + "\n\n"
+        "Retries:\n" + "\n".join(retry_engine.summary() or ["No calls yet"])
+    )
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check if the bot is online."""
     try:
@@ -841,18 +1138,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Continue with normal message handling
     await handle_text_message(update, context)
 
-async def notify_subscribers(application: Application, message: str):
-    """Send notification to all subscribed users."""
-    for chat_id in subscribed_users:
-        try:
-            await application.bot.send_message(
-                chat_id=chat_id,
-                text=message,
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            logger.error(f"Failed to send notification to {chat_id}: {str(e)}")
-
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors and notify subscribers."""
     logger.error("Exception while handling an update:", exc_info=context.error)
@@ -864,7 +1149,7 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
         f"Error: `{str(context.error)}`"
     )
     
-    await notify_subscribers(context.application, error_message)
+    await notify_subscribers(context.bot, error_message)
 
 async def on_startup(application: Application):
     """Notify subscribers when bot starts up."""
@@ -873,7 +1158,7 @@ async def on_startup(application: Application):
         "The bot is now online and ready to use!\n"
         "All systems are operational."
     )
-    await notify_subscribers(application, startup_message)
+    await notify_subscribers(application.bot, startup_message)
 
 async def clear_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Clear the chat history for the current user."""
@@ -881,6 +1166,7 @@ async def clear_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         if user_id in user_sessions:
             user_sessions[user_id].conversation_history = []
+            user_sessions[user_id].conversation_summary = ""
             await update.message.reply_text(
                 " Chat history cleared successfully!",
                 parse_mode='Markdown'
@@ -1024,40 +1310,20 @@ async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             " Sorry, an error occurred while exporting your chat history."
         )
 
-async def resize_image(image_path, max_size=(800, 800)):
-    """Resize image to reduce file size while maintaining aspect ratio"""
-    try:
-        with Image.open(image_path) as img:
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            # Calculate new size maintaining aspect ratio
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # Save to bytes
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='JPEG', quality=85, optimize=True)
-            img_byte_arr.seek(0)
-            
-            return img_byte_arr.getvalue()
-    except Exception as e:
-        logging.error(f"Error resizing image: {str(e)}")
-        return None
-
 def initialize_genai():
     api_key = os.getenv("API_KEY")
     if not api_key:
         raise ValueError("API_KEY not found in .env file")
-    genai.configure(api_key=api_key)
+    # The SDK itself is imported and configured when the first Gemini model is built
+    registry.set_gemini_api_key(api_key)
 
 def get_video_insights(video_path):
     """Get insights from a video using Gemini Vision."""
     try:
         logging.info(f"🎥 Processing video: {video_path}")
         
-        # Initialize Gemini model
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        # Get the cached Gemini model
+        model = registry.gemini_model('gemini-1.5-flash')
         
         # Read video file
         with open(video_path, 'rb') as f:
@@ -1120,37 +1386,142 @@ async def analyze_video_command(update: Update, context: ContextTypes.DEFAULT_TY
             await update.message.reply_text("Please send a valid video file.")
             return
 
-        # Send initial status
-        await update.message.reply_text("Starting video analysis...")
+        # Hand the download and analysis to the background job queue
+        await enqueue_media_job(update, "analyze_video", {"file_id": file_id}, "🕒 Video analysis queued...")
 
-        # Download video
-        file = await context.bot.get_file(file_id)
-        file_path = os.path.join(MEDIA_FOLDER, f"video_{update.message.from_user.id}_{int(time.time())}.mp4")
-        await file.download_to_drive(file_path)
+    except Exception as e:
+        await update.message.reply_text(f"Error processing video: {str(e)}")
 
-        # Analyze video
-        insights = get_insights(file_path)
+async def enqueue_media_job(update: Update, kind: str, payload: dict, status_text: str) -> int:
+    """Send a status message with a cancel button and enqueue a background job."""
+    user = update.effective_user
+    payload = dict(
+        payload,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name
+    )
+    status_message = await update.message.reply_text(status_text)
+    job_id = await media_jobs.enqueue(
+        kind,
+        payload,
+        chat_id=update.effective_chat.id,
+        user_id=user.id,
+        status_message_id=status_message.message_id
+    )
+    await status_message.edit_reply_markup(reply_markup=cancel_keyboard(job_id))
+    return job_id
+
+async def send_job_result(job: Job, text: str):
+    """Send a job's result to its chat, split into Telegram-sized parts."""
+    parts = [text[i:i + 4000] for i in range(0, len(text), 4000)]
+    with stage(job.kind, "reply") as span:
+        span.set_attributes(parts=len(parts), chars=len(text))
+        await outbox.send_many(media_jobs.bot, job.chat_id, parts)
+
+async def run_video_analysis_job(job: Job, ctx: JobContext) -> str:
+    """Background job: download a Telegram video and analyze it with Gemini."""
+    file_path = os.path.join(MEDIA_FOLDER, f"video_{job.user_id}_{job.id}.mp4")
+    try:
+        await ctx.progress("📥 Downloading video...", force=True)
+        with stage("analyze_video", "get_file") as span:
+            file = await ctx.bot.get_file(job.payload["file_id"])
+            span.set_attribute("file_size", file.file_size)
+        with stage("analyze_video", "download_to_drive") as span:
+            await file.download_to_drive(file_path)
+            span.set_attribute("bytes", os.path.getsize(file_path))
+
+        await ctx.progress("🔍 Analyzing video with Gemini...", force=True)
+        with stage("analyze_video", "analyze"):
+            insights = await run_provider("gemini", get_insights, file_path)
 
         # Store in database
-        user_id = update.effective_user.id
+        with stage("analyze_video", "db_write"):
+            db.add_or_update_user(
+                user_id=job.user_id,
+                username=job.payload.get("username"),
+                first_name=job.payload.get("first_name"),
+                last_name=job.payload.get("last_name")
+            )
+            db.store_video_analysis(job.user_id, file_path, insights)
+
+        await send_job_result(job, f"Analysis Results:\n\n{insights}")
+        return "✅ Video analysis complete."
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+async def run_youtube_summary_job(job: Job, ctx: JobContext) -> str:
+    """Background job: download a YouTube video's audio and summarize it."""
+    url = job.payload["url"]
+    video_id = job.payload["video_id"]
+
+    async def on_downloaded(title, duration):
+        await ctx.progress(
+            f"Downloaded: {title}\n"
+            f"Duration: {duration//60}:{duration%60:02d}\n"
+            "Generating summary...",
+            force=True
+        )
+
+    await ctx.progress("📥 Downloading YouTube audio...", force=True)
+    with stage("youtube_summary", "summarize") as span:
+        span.set_attribute("video_id", video_id)
+        title, duration, summary = await video_insights.summarize_youtube(url, video_id, on_downloaded)
+
+    with stage("youtube_summary", "db_write"):
         db.add_or_update_user(
-            user_id=user_id,
-            username=update.effective_user.username,
-            first_name=update.effective_user.first_name,
-            last_name=update.effective_user.last_name
+            user_id=job.user_id,
+            username=job.payload.get("username"),
+            first_name=job.payload.get("first_name"),
+            last_name=job.payload.get("last_name")
+        )
+        db.store_video_analysis(job.user_id, url, summary)
+
+    await send_job_result(job, f"Summary of '{title}'\n\n{summary}\n\nVideo: {url}")
+    return "✅ YouTube summary complete."
+
+async def youtube_summary_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /youtube_summary command by queueing a background summary job."""
+    if not update.message:
+        return
+
+    if not context.args:
+        await update.message.reply_text(
+            "Please provide a YouTube URL.\n"
+            "Example: `/youtube_summary https://youtu.be/VIDEO_ID`",
+            parse_mode='Markdown'
         )
-        db.store_video_analysis(user_id, file_path, insights)
+        return
 
-        # Send results
-        await update.message.reply_text(f"Analysis Results:\n\n{insights}")
+    url = context.args[0]
+    video_id = video_insights.extract_video_id(url)
+    if not video_id:
+        await update.message.reply_text("Invalid YouTube URL. Please provide a valid YouTube video URL.")
+        return
 
+    try:
+        await enqueue_media_job(
+            update, "youtube_summary", {"url": url, "video_id": video_id}, "🕒 YouTube summary queued..."
+        )
     except Exception as e:
+        logger.error(f"Error queueing YouTube summary: {str(e)}")
         await update.message.reply_text(f"Error processing video: {str(e)}")
-        
-    finally:
-        # Cleanup
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
+
+async def cancel_job_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the cancel button on a background job's status message."""
+    query = update.callback_query
+    try:
+        job_id = int(query.data[len(CANCEL_PREFIX):])
+    except ValueError:
+        await query.answer()
+        return
+
+    if await media_jobs.cancel(job_id, query.from_user.id):
+        await query.answer("Cancelling...")
+        await query.edit_message_text("✖️ Job cancelled.")
+    else:
+        await query.answer("This job can no longer be cancelled.")
 
 async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle videos sent directly to the bot."""
@@ -1173,10 +1544,7 @@ async def caption_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user_id = update.effective_user.id
-    if user_id not in user_sessions:
-        user_sessions[user_id] = UserSession()
-
-    session = user_sessions[user_id]
+    session = user_sessions.get_or_create(user_id)
     if not session.together_api_key:
         await update.message.reply_text(
             "Please set your Together API key in the .env file first.",
@@ -1199,7 +1567,9 @@ async def caption_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         processing_message = await update.message.reply_text("🤔 Analyzing the image...")
 
         # Generate caption
-        success, caption = await image_captioner.generate_caption(photo_url, custom_prompt)
+        success, caption = await image_captioner.generate_caption(
+            photo_url, custom_prompt, image_key=photo.file_unique_id
+        )
         
         if success:
             # Store in database
@@ -1209,7 +1579,8 @@ async def caption_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 first_name=update.effective_user.first_name,
                 last_name=update.effective_user.last_name
             )
-            db.store_image_caption(user_id, photo_url, caption)
+            # The file URL carries the bot token, so record the photo by its unique id
+            db.store_image_caption(user_id, photo.file_unique_id, caption)
             
             await processing_message.edit_text(f"🖼️ Image Analysis:\n\n{caption}")
         else:
@@ -1229,6 +1600,7 @@ async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
         
     subscribed_users.add(user_id)
+    session_backend.set_subscribed(user_id, True)
     
     # Store in database
     db.add_or_update_user(
@@ -1259,6 +1631,7 @@ async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
         
     subscribed_users.remove(user_id)
+    session_backend.set_subscribed(user_id, False)
     
     # Update database
     db.update_subscription(user_id, False)
@@ -1270,16 +1643,17 @@ async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
 async def notify_subscribers(bot: Bot, message: str):
-    """Send a notification to all subscribed users."""
-    for user_id in subscribed_users:
-        try:
-            await bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            logging.error(f"Failed to notify user {user_id}: {str(e)}")
+    """Send a notification to all subscribed users.
+
+    Delivery goes through the outbox, which stays within Telegram's rate
+    limits and records progress so an interrupted broadcast resumes on restart.
+    """
+    if not subscribed_users:
+        return None
+    report = await outbox.broadcast(bot, list(subscribed_users), message, parse_mode='Markdown')
+    if report.failed:
+        logger.warning(report.summary())
+    return report
 
 async def print_bot_info(bot):
     """Print basic information about the bot"""
@@ -1287,47 +1661,103 @@ async def print_bot_info(bot):
     logger.info(f"Bot ID: {bot.id}")
     logger.info("Bot started successfully!")
 
-def setup_bot():
-    """Set up and configure the bot with all handlers."""
+async def post_init(application: Application):
+    """Restore persisted state and start write-behind session flushing."""
+    restore_state()
+    user_sessions.start_flusher()
+    media_jobs.register("analyze_video", run_video_analysis_job)
+    media_jobs.register("youtube_summary", run_youtube_summary_job)
+    media_jobs.start(application.bot)
+    if METRICS_ENABLED:
+        await metrics_server.start()
+    startup_profile.mark_ready()
+    logger.info(startup_profile.report())
+    if STARTUP_WARMUP:
+        application.create_task(warm_up([db, image_generator, image_captioner, *LAZY_IMPORTS]))
+    # Finish any broadcast a previous run didn't complete, without delaying startup
+    application.create_task(outbox.resume_pending(application.bot))
+
+async def post_shutdown(application: Application):
+    """Stop background jobs, flush pending session writes and close the backend."""
+    await media_jobs.stop()
+    await metrics_server.stop()
+    await user_sessions.stop_flusher()
+    session_backend.close()
+    vision_cache.close()
+    sent_image_ids.close()
+    outbox.close()
+    tracer.close()
+
+def setup_bot(request: Optional[BaseRequest] = None):
+    """Set up and configure the bot with all handlers.
+
+    ``request`` replaces the HTTP transport used for Bot API calls, e.g. the
+    fake transport of ``benchmarks/load_test.py``.
+    """
     # Configure the application with custom settings
+    builder = Application.builder().token(TELEGRAM_BOT_TOKEN)
+    if request is None:
+        builder = (
+            builder
+            .connection_pool_size(8)
+            .pool_timeout(30.0)
+            .connect_timeout(30.0)
+            .read_timeout(30.0)
+            .write_timeout(30.0)
+            .get_updates_connection_pool_size(8)
+        )
+    else:
+        builder = builder.request(request)
+    if BOT_MODE == "webhook":
+        # Counts unfinished updates for the webhook's 503 backpressure
+        from webhook_server import InFlightUpdateProcessor
+        concurrency = InFlightUpdateProcessor()
+    else:
+        concurrency = True
     application = (
-        Application.builder()
-        .token(TELEGRAM_BOT_TOKEN)
-        .connection_pool_size(8)
-        .pool_timeout(30.0)
-        .connect_timeout(30.0)
-        .read_timeout(30.0)
-        .write_timeout(30.0)
-        .get_updates_connection_pool_size(8)
-        .concurrent_updates(True)
+        builder
+        .concurrent_updates(concurrency)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("chat", chat_command))
+    # Expensive handlers go through admission control (rate limits + priority queues)
+    application.add_handler(CommandHandler("chat", admission.wrap(chat_command, "chat")))
     application.add_handler(CommandHandler("settings", settings_command))
-    application.add_handler(CommandHandler("imagine", imagine_command))
-    application.add_handler(CommandHandler("caption", caption_command))
-    application.add_handler(CommandHandler("enhance", enhance_command))
-    application.add_handler(CommandHandler("describe", describe_image))
+    application.add_handler(CommandHandler("imagine", admission.wrap(imagine_command, "imagine")))
+    application.add_handler(CommandHandler("caption", admission.wrap(caption_command, "caption")))
+    application.add_handler(CommandHandler("enhance", admission.wrap(enhance_command, "enhance")))
+    application.add_handler(CommandHandler("describe", admission.wrap(describe_image, "describe")))
     application.add_handler(CommandHandler("clear_chat", clear_chat))
     application.add_handler(CommandHandler("export", export_command))
-    application.add_handler(CommandHandler("analyze_video", analyze_video_command))
+    application.add_handler(CommandHandler("analyze_video", admission.wrap(analyze_video_command, "analyze_video")))
+    application.add_handler(CommandHandler("youtube_summary", admission.wrap(youtube_summary_command, "analyze_video")))
     application.add_handler(CommandHandler("status", status_command))
     application.add_handler(CommandHandler("subscribe", subscribe_command))
     application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
     application.add_handler(CommandHandler("maintenance", maintenance_command))
+    application.add_handler(CommandHandler("sessions", sessions_command))
+    application.add_handler(CommandHandler("cache", cache_command))
+    application.add_handler(CommandHandler("latency", latency_command))
     application.add_handler(CommandHandler("setgroqapi", setgroqapi_command))
 
     # Add message handlers
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, admission.wrap(handle_text_message, "text")))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-    application.add_handler(MessageHandler(filters.VIDEO, handle_video))
+    application.add_handler(MessageHandler(filters.VIDEO, admission.wrap(handle_video, "analyze_video")))
+
+    # Cancel buttons on background job status messages
+    application.add_handler(CallbackQueryHandler(cancel_job_callback, pattern=f"^{CANCEL_PREFIX}"))
 
-    # Add callback query handler
-    application.add_handler(CallbackQueryHandler(button_callback))
+    # Add callback query handler (describe/caption buttons)
+    application.add_handler(CallbackQueryHandler(admission.wrap(button_callback, "describe")))
+
+    # Record latency, outcome and concurrency of every handler above
+    instrument_handlers(application)
 
     return application
 
@@ -1335,19 +1765,29 @@ def main():
     """Main function to run the bot."""
     try:
         # Initialize Gemini AI
-        initialize_genai()
+        with startup_profile.measure("initialize_genai"):
+            initialize_genai()
         
         # Set up and run the bot
-        application = setup_bot()
+        with startup_profile.measure("setup_bot"):
+            application = setup_bot()
         
         # Run the bot
-        print("Starting bot...")
-        application.run_polling(drop_pending_updates=True)
+        if BOT_MODE == "webhook":
+            from webhook_server import run_webhook
+            print("Starting bot in webhook mode...")
+            asyncio.run(run_webhook(application, drop_pending_updates=True))
+        else:
+            print("Starting bot...")
+            application.run_polling(drop_pending_updates=True)
         
     except KeyboardInterrupt:
         print("Bot stopped by user request")
     except Exception as e:
         print(f"Error running bot: {str(e)}")
+    finally:
+        shutdown_executors()
+        media_worker.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
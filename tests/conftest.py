@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The bot's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep module-level settings independent of a local .env
+os.environ.setdefault("METRICS_ENABLED", "false")
+os.environ.setdefault("TRACING_ENABLED", "false")
@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+from admission_control import MAX_INFLIGHT_PER_USER, AdmissionController, CommandPolicy, PriorityGate
+
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return SimpleNamespace(delete=self.delete)
+
+    async def delete(self):
+        pass
+
+
+def make_update(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_message=FakeMessage())
+
+
+def test_queued_requests_count_toward_the_inflight_cap():
+    controller = AdmissionController({"chat": CommandPolicy("groq", 0, rate=1000, burst=1000)})
+    controller._gates["groq"] = PriorityGate(1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def handler(update, context):
+            await release.wait()
+
+        wrapped = controller.wrap(handler, "chat")
+        # Another user holds the only slot, so user 1's requests queue behind it
+        tasks = [asyncio.create_task(wrapped(make_update(2), None))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(wrapped(make_update(1), None)) for _ in range(MAX_INFLIGHT_PER_USER)]
+        await asyncio.sleep(0)
+        assert controller._inflight[1] == MAX_INFLIGHT_PER_USER
+
+        extra = make_update(1)
+        await wrapped(extra, None)
+        assert "several requests" in extra.effective_message.replies[0]
+        assert controller._gates["groq"].queue_depth == MAX_INFLIGHT_PER_USER
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert controller._inflight == {}
+    assert controller._gates["groq"].active == 0
+    assert controller.rejected == 1
+
+
+def test_cancelled_waiter_gives_back_its_inflight_count():
+    controller = AdmissionController({"chat": CommandPolicy("groq", 0, rate=1000, burst=1000)})
+    controller._gates["groq"] = PriorityGate(1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def handler(update, context):
+            await release.wait()
+
+        wrapped = controller.wrap(handler, "chat")
+        holder = asyncio.create_task(wrapped(make_update(2), None))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(wrapped(make_update(1), None))
+        await asyncio.sleep(0)
+        assert controller._inflight[1] == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert 1 not in controller._inflight
+        release.set()
+        await holder
+
+    asyncio.run(main())
+    assert controller._gates["groq"].active == 0
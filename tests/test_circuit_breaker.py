@@ -0,0 +1,214 @@
+import asyncio
+
+import pytest
+
+from circuit_breaker import (
+    BreakerRegistry,
+    CircuitBreaker,
+    CircuitOpenError,
+    CLOSED,
+    HALF_OPEN,
+    Hedger,
+    OPEN,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+
+
+def make_breaker(**kwargs):
+    options = {"window": 10, "min_calls": 4, "failure_rate": 0.5, "slow_call_seconds": 5, "open_seconds": 60}
+    options.update(kwargs)
+    return CircuitBreaker("groq", "model", **options)
+
+
+def fail(breaker, times=1):
+    for _ in range(times):
+        breaker.acquire()
+        breaker.record(0.1, ok=False)
+
+
+def test_stays_closed_until_min_calls():
+    breaker = make_breaker()
+    fail(breaker, 3)
+    assert breaker.state == CLOSED
+
+
+def test_opens_at_failure_rate():
+    breaker = make_breaker()
+    for ok in (True, True, False):
+        breaker.acquire()
+        breaker.record(0.1, ok=ok)
+    assert breaker.state == CLOSED
+    fail(breaker)
+    assert breaker.state == OPEN
+
+
+def test_slow_calls_count_as_failures():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.acquire()
+        breaker.record(10, ok=True)
+    assert breaker.state == OPEN
+
+
+def test_open_circuit_rejects_calls():
+    breaker = make_breaker()
+    fail(breaker, 4)
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.acquire()
+    assert excinfo.value.retry_after > 0
+    assert breaker.rejected == 1
+
+
+def test_half_open_admits_one_probe_and_closes_on_success():
+    breaker = make_breaker(open_seconds=0)
+    fail(breaker, 4)
+    breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+    breaker.record(0.1, ok=True)
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_reopens():
+    breaker = make_breaker()
+    fail(breaker, 4)
+    breaker.open_seconds = 0
+    breaker.acquire()
+    breaker.open_seconds = 60
+    breaker.record(0.1, ok=False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+
+def test_released_probe_can_be_retried():
+    breaker = make_breaker(open_seconds=0)
+    fail(breaker, 4)
+    breaker.acquire()
+    breaker.release()
+    breaker.acquire()
+    assert breaker.state == HALF_OPEN
+
+
+def guarded_failures(registry, error, times=5, scope=None):
+    for _ in range(times):
+        with pytest.raises(type(error)):
+            with registry.guard("groq", "model", scope):
+                raise error
+
+
+def test_client_errors_are_not_counted():
+    registry = BreakerRegistry(enabled=True)
+    guarded_failures(registry, StatusError(401))
+    guarded_failures(registry, StatusError(400))
+    breaker = registry.get("groq", "model")
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls"] == 0
+
+
+@pytest.mark.parametrize("error", [StatusError(429), StatusError(503), TimeoutError("timed out")])
+def test_transient_errors_open_the_circuit(error):
+    registry = BreakerRegistry(enabled=True)
+    guarded_failures(registry, error)
+    assert registry.get("groq", "model").state == OPEN
+
+
+def test_user_key_scope_has_its_own_circuit():
+    registry = BreakerRegistry(enabled=True)
+    seen = []
+    registry.add_observer(lambda provider, model, duration, ok: seen.append(ok))
+    guarded_failures(registry, StatusError(429), scope="user-key")
+    assert registry.get("groq", "model", "user-key").state == OPEN
+    assert registry.get("groq", "model").state == CLOSED
+    # A user's failing key says nothing about the model, so observers don't see it
+    assert seen == []
+    with registry.guard("groq", "model", "other-key"):
+        pass
+    assert seen == [True]
+
+
+def test_timer_restart_excludes_queueing():
+    registry = BreakerRegistry(enabled=True)
+    durations = []
+    registry.add_observer(lambda provider, model, duration, ok: durations.append(duration))
+    with registry.guard("groq", "model") as timer:
+        timer.started -= 30  # As if the call had waited 30s for a pool slot
+        timer.restart()
+    assert durations[0] < 1
+    assert registry.get("groq", "model").state == CLOSED
+
+
+def test_failover_reports_the_fallback_model():
+    registry = BreakerRegistry(enabled=True)
+    hedger = Hedger(registry, {("groq", "primary"): "fallback"}, enabled=False)
+
+    async def call(model):
+        if model == "primary":
+            raise CircuitOpenError("groq", model, 30)
+        return f"answer from {model}"
+
+    result, model = asyncio.run(hedger.run("groq", "primary", call))
+    assert (result, model) == ("answer from fallback", "fallback")
+
+
+def test_hedge_reports_the_model_that_answered_first():
+    registry = BreakerRegistry(enabled=True)
+    hedger = Hedger(registry, {("groq", "primary"): "fallback"}, enabled=True, budget=1.0)
+    hedger.calls = 10  # Room in the hedge budget
+
+    async def call(model):
+        await asyncio.sleep(10 if model == "primary" else 0)
+        return model
+
+    registry.get("groq", "primary").hedge_delay = lambda: 0.01
+    result, model = asyncio.run(hedger.run("groq", "primary", call))
+    assert (result, model) == ("fallback", "fallback")
+    assert hedger.hedges == 1
+
+
+def test_losing_stream_is_closed_when_both_answer_together():
+    registry = BreakerRegistry(enabled=True)
+    hedger = Hedger(registry, {("groq", "primary"): "fallback"}, enabled=True, budget=1.0)
+    hedger.calls = 10
+    registry.get("groq", "primary").hedge_delay = lambda: 0.01
+
+    class Stream:
+        def __init__(self, model):
+            self.model = model
+            self.closed = False
+
+        async def close(self):
+            self.closed = True
+
+    streams = []
+
+    async def main():
+        gate = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.05, gate.set)
+
+        async def call(model):
+            await gate.wait()
+            streams.append(Stream(model))
+            return streams[-1]
+
+        return await hedger.run("groq", "primary", call)
+
+    stream, model = asyncio.run(main())
+    assert len(streams) == 2
+    assert stream.model == model and not stream.closed
+    assert [s.closed for s in streams if s is not stream] == [True]
+
+
+def test_call_without_fallback_reports_its_model():
+    hedger = Hedger(BreakerRegistry(enabled=True), {}, enabled=True)
+
+    async def call(model):
+        return "ok"
+
+    assert asyncio.run(hedger.run("groq", "solo", call)) == ("ok", "solo")
@@ -0,0 +1,37 @@
+import pytest
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from media_jobs import TransientJobError, is_transient
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+
+
+class DownloadError(Exception):
+    pass
+
+
+@pytest.mark.parametrize("error", [
+    TransientJobError("try again"),
+    RetryAfter(5),
+    TimedOut(),
+    TimeoutError(),
+    StatusError(429),
+    StatusError(503),
+    DownloadError("ERROR: unable to download video data: HTTP Error 429: Too Many Requests"),
+])
+def test_transient_job_errors_are_retried(error):
+    assert is_transient(error)
+
+
+@pytest.mark.parametrize("error", [
+    BadRequest("Message is too long"),
+    StatusError(401),
+    DownloadError("ERROR: Video unavailable"),
+    ValueError("bad input"),
+])
+def test_permanent_job_errors_are_not_retried(error):
+    assert not is_transient(error)
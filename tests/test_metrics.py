@@ -0,0 +1,40 @@
+import pytest
+
+from metrics import Histogram
+
+
+def test_quantile_is_none_without_observations():
+    histogram = Histogram("test_seconds", "Test", buckets=(1, 2, 4))
+    assert histogram.quantile(0.5) is None
+
+
+def test_quantile_interpolates_within_a_bucket():
+    histogram = Histogram("test_seconds", "Test", buckets=(1, 2, 4))
+    for _ in range(4):
+        histogram.observe(1.5)
+    # All samples are in (1, 2]: the median sits halfway through that bucket
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert histogram.quantile(1.0) == pytest.approx(2.0)
+
+
+def test_quantile_spans_buckets():
+    histogram = Histogram("test_seconds", "Test", buckets=(1, 2, 4))
+    for value in (0.5, 0.5, 3, 3):
+        histogram.observe(value)
+    assert histogram.quantile(0.25) == pytest.approx(0.5)
+    assert histogram.quantile(0.75) == pytest.approx(3.0)
+
+
+def test_quantile_in_open_bucket_returns_highest_finite_bound():
+    histogram = Histogram("test_seconds", "Test", buckets=(1, 2))
+    histogram.observe(10)
+    assert histogram.quantile(0.99) == 2
+
+
+def test_quantile_is_per_label_set():
+    histogram = Histogram("test_seconds", "Test", labelnames=("handler",), buckets=(1, 2, 4))
+    histogram.observe(0.5, handler="fast")
+    histogram.observe(3, handler="slow")
+    assert histogram.quantile(1.0, handler="fast") == pytest.approx(1.0)
+    assert histogram.quantile(1.0, handler="slow") == pytest.approx(4.0)
+    assert histogram.quantile(0.5, handler="other") is None
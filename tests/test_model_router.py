@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from circuit_breaker import breakers
+from model_router import ModelRouter, TaskConfig
+
+
+def make_router(policy, candidates, costs=None, slo=1.0, **kwargs):
+    options = {"alpha": 1.0, "max_error_rate": 0.5, "explore_rate": 0.0, "sticky_users": 100}
+    options.update(kwargs)
+    tasks = {"chat": TaskConfig("groq", tuple(candidates), policy, slo)}
+    return ModelRouter(tasks, costs or {}, **options)
+
+
+def test_fixed_policy_uses_first_candidate():
+    router = make_router("fixed", ["router-a", "router-b"])
+    router.observe("groq", "router-a", 9.0, True)
+    router.observe("groq", "router-b", 0.1, True)
+    assert router.choose("chat") == "router-a"
+
+
+def test_fastest_prefers_lowest_latency():
+    router = make_router("fastest", ["router-a", "router-b"])
+    router.observe("groq", "router-a", 2.0, True)
+    router.observe("groq", "router-b", 0.5, True)
+    assert router.choose("chat") == "router-b"
+
+
+def test_cheapest_picks_cheapest_model_within_slo():
+    router = make_router("cheapest", ["router-a", "router-b", "router-c"], costs={
+        "router-a": 3.0, "router-b": 1.0, "router-c": 0.5,
+    })
+    router.observe("groq", "router-a", 0.2, True)
+    router.observe("groq", "router-b", 0.4, True)
+    router.observe("groq", "router-c", 3.0, True)
+    assert router.choose("chat") == "router-b"
+
+
+def test_cheapest_falls_back_to_fastest_when_slo_missed():
+    router = make_router("cheapest", ["router-a", "router-b"], costs={"router-a": 0.1, "router-b": 1.0})
+    router.observe("groq", "router-a", 4.0, True)
+    router.observe("groq", "router-b", 2.0, True)
+    assert router.choose("chat") == "router-b"
+
+
+def test_models_with_high_error_rate_are_skipped():
+    router = make_router("fastest", ["router-a", "router-b"])
+    router.observe("groq", "router-a", 0.1, False)
+    router.observe("groq", "router-b", 1.0, True)
+    assert router.choose("chat") == "router-b"
+
+
+def test_models_with_open_circuit_are_skipped():
+    router = make_router("fastest", ["router-open", "router-b"])
+    router.observe("groq", "router-b", 1.0, True)
+    breakers.get("groq", "router-open")._open()
+    assert router.choose("chat") == "router-b"
+
+
+def test_all_unhealthy_uses_first_candidate():
+    router = make_router("fastest", ["router-a", "router-b"])
+    router.observe("groq", "router-a", 0.1, False)
+    router.observe("groq", "router-b", 0.1, False)
+    assert router.choose("chat") == "router-a"
+
+
+def test_sticky_keeps_a_users_model():
+    router = make_router("sticky", ["router-a", "router-b"])
+    router.observe("groq", "router-a", 0.5, True)
+    router.observe("groq", "router-b", 1.0, True)
+    assert router.choose("chat", user_id=1) == "router-a"
+    router.observe("groq", "router-a", 2.0, True)
+    assert router.choose("chat", user_id=1) == "router-a"
+    assert router.choose("chat", user_id=2) == "router-b"
+
+
+def test_explore_picks_are_not_made_sticky(monkeypatch):
+    router = make_router("sticky", ["router-a", "router-b"])
+    router.observe("groq", "router-a", 0.5, True)
+    router.observe("groq", "router-b", 1.0, True)
+    assert router.choose("chat", user_id=1) == "router-a"
+    router.explore_rate = 1.0
+    monkeypatch.setattr("model_router.random.choice", lambda candidates: "router-b")
+    assert router.choose("chat", user_id=1) == "router-b"
+    router.explore_rate = 0.0
+    assert router.choose("chat", user_id=1) == "router-a"
+
+
+def test_sticky_map_is_bounded():
+    router = make_router("sticky", ["router-a", "router-b"], sticky_users=2)
+    for user_id in range(5):
+        router.choose("chat", user_id=user_id)
+    assert len(router._sticky) == 2
+
+
+def test_observe_ignores_unrouted_models():
+    router = make_router("fastest", ["router-a"])
+    router.observe("groq", "something-else", 0.1, True)
+    assert router.stats() == {}
+
+
+@pytest.mark.parametrize("ok,error_rate", [(True, 0.0), (False, 1.0)])
+def test_observe_updates_error_rate(ok, error_rate):
+    router = make_router("fastest", ["router-a"])
+    router.observe("groq", "router-a", 0.1, ok)
+    assert router.stats()["router-a"]["error_rate"] == error_rate
+
+
+def test_failed_enhancement_counts_against_the_model(monkeypatch):
+    import image_generator
+    import retry_policy
+    from provider_executor import run_provider
+
+    class StatusError(Exception):
+        status_code = 503
+
+    class FailingGroq:
+        class chat:
+            class completions:
+                @staticmethod
+                def create(**kwargs):
+                    raise StatusError("Error code: 503")
+
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("TOGETHER_API_KEY", "test")
+    monkeypatch.setattr(image_generator.registry, "groq", lambda api_key: FailingGroq)
+    monkeypatch.setattr(retry_policy.retry_engine, "enabled", False)
+    generator = image_generator.AIImageGenerator()
+    router = make_router("fastest", ["router-enhance"])
+    monkeypatch.setattr(breakers, "_observers", [router.observe])
+
+    with pytest.raises(StatusError):
+        asyncio.run(run_provider("groq", generator.request_enhancement, "a cat", model="router-enhance"))
+    assert router.stats()["router-enhance"]["error_rate"] == 1.0
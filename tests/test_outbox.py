@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from telegram.error import Forbidden, RetryAfter
+
+from outbox import Outbox
+
+
+class FakeBot:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return text
+
+
+def make_outbox(**kwargs):
+    options = {"global_rate": 1000, "chat_rate": 1000, "chat_burst": 100, "max_retries": 1, "path": None}
+    options.update(kwargs)
+    return Outbox(**options)
+
+
+def test_flood_waits_do_not_use_up_retries():
+    outbox = make_outbox()
+    bot = FakeBot([RetryAfter(0.01)] * 5)
+    assert asyncio.run(outbox.send(bot, 1, "hello")) == "hello"
+    assert bot.calls == 6
+    assert outbox.rate_limited == 5
+    assert outbox.retries == 0
+    assert outbox.sent == 1
+
+
+def test_flood_waits_are_capped():
+    outbox = make_outbox(max_rate_limit_waits=2)
+    bot = FakeBot([RetryAfter(0.01)] * 5)
+    with pytest.raises(RetryAfter):
+        asyncio.run(outbox.send(bot, 1, "hello"))
+    assert bot.calls == 3
+    assert outbox.failed == 1
+
+
+def test_blocked_chats_are_not_retried():
+    outbox = make_outbox()
+    bot = FakeBot([Forbidden("bot was blocked by the user")])
+    with pytest.raises(Forbidden):
+        asyncio.run(outbox.send(bot, 1, "hello"))
+    assert bot.calls == 1
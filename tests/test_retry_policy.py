@@ -0,0 +1,170 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from retry_policy import RetryBudget, RetryEngine, RetryPolicy, classify, retry_after
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None, message=None):
+        super().__init__(message or f"Error code: {status_code}")
+        self.status_code = status_code
+        self.headers = headers
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+class DownloadError(Exception):
+    pass
+
+
+@pytest.mark.parametrize("error,reason", [
+    (RetryAfter(5), "rate_limited"),
+    (TimedOut(), "timeout"),
+    (NetworkError("reset"), "network"),
+    (StatusError(429), "rate_limited"),
+    (StatusError(503), "server_error"),
+    (StatusError(408), "server_error"),
+    (APIConnectionError("refused"), "network"),
+    (TimeoutError(), "network"),
+    (DownloadError("ERROR: unable to download: HTTP Error 429: Too Many Requests"), "rate_limited"),
+    (DownloadError("ERROR: HTTP Error 503: Service Unavailable"), "server_error"),
+])
+def test_classify_transient_errors(error, reason):
+    assert classify(error) == reason
+
+
+@pytest.mark.parametrize("error", [
+    BadRequest("Chat not found"),
+    Forbidden("bot was blocked by the user"),
+    StatusError(400),
+    StatusError(401),
+    StatusError(403),
+    DownloadError("ERROR: HTTP Error 404: Not Found"),
+    ValueError("bad input"),
+])
+def test_classify_permanent_errors(error):
+    assert classify(error) is None
+
+
+def test_retry_after_from_telegram():
+    assert retry_after(RetryAfter(7)) == 7
+    assert retry_after(RetryAfter(timedelta(seconds=3))) == 3
+
+
+def test_retry_after_header_seconds():
+    assert retry_after(StatusError(429, headers={"retry-after": "12"})) == 12
+
+
+def test_retry_after_header_milliseconds_wins():
+    headers = {"retry-after-ms": "1500", "retry-after": "12"}
+    assert retry_after(StatusError(429, headers=headers)) == 1.5
+
+
+def test_retry_after_header_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    delay = retry_after(StatusError(503, headers={"retry-after": format_datetime(when, usegmt=True)}))
+    assert 25 <= delay <= 30
+
+
+def test_retry_after_ignores_garbage_and_missing_headers():
+    assert retry_after(StatusError(429, headers={"retry-after": "soon"})) is None
+    assert retry_after(StatusError(429)) is None
+    assert retry_after(ValueError()) is None
+
+
+def test_budget_runs_out_and_refills_per_call():
+    budget = RetryBudget(ratio=0.5, maximum=2)
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_budget_is_capped():
+    budget = RetryBudget(ratio=1, maximum=2)
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 2
+
+
+FAST = RetryPolicy(max_attempts=5, base_delay=0, max_delay=0, deadline=30)
+
+
+def flaky(failures, error):
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return "ok"
+    return func, calls
+
+
+def test_sync_call_retries_transient_errors():
+    func, calls = flaky(2, StatusError(503))
+    assert RetryEngine(enabled=True).call_sync("test", func, policy=FAST) == "ok"
+    assert len(calls) == 3
+
+
+def test_permanent_errors_are_not_retried():
+    func, calls = flaky(2, StatusError(401))
+    with pytest.raises(StatusError):
+        RetryEngine(enabled=True).call_sync("test", func, policy=FAST)
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_attempts():
+    func, calls = flaky(10, StatusError(503))
+    engine = RetryEngine(enabled=True)
+    with pytest.raises(StatusError):
+        engine.call_sync("test", func, policy=RetryPolicy(max_attempts=3, base_delay=0, max_delay=0, deadline=30))
+    assert len(calls) == 3
+    assert engine.stats()["test"]["giveups"] == 1
+
+
+def test_gives_up_when_retry_after_passes_the_deadline():
+    func, calls = flaky(1, StatusError(429, headers={"retry-after": "60"}))
+    with pytest.raises(StatusError):
+        RetryEngine(enabled=True).call_sync("test", func, policy=FAST)
+    assert len(calls) == 1
+
+
+def test_gives_up_when_budget_is_exhausted():
+    engine = RetryEngine(enabled=True)
+    engine._budgets["test"] = RetryBudget(ratio=0, maximum=1)
+    func, calls = flaky(10, StatusError(503))
+    with pytest.raises(StatusError):
+        engine.call_sync("test", func, policy=FAST)
+    # One banked retry, then the budget is empty
+    assert len(calls) == 2
+
+
+def test_disabled_engine_does_not_retry():
+    func, calls = flaky(1, StatusError(503))
+    with pytest.raises(StatusError):
+        RetryEngine(enabled=False).call_sync("test", func, policy=FAST)
+    assert len(calls) == 1
+
+
+def test_async_call_retries_and_reports_each_retry():
+    func, calls = flaky(2, TimedOut())
+    retries = []
+
+    async def attempt():
+        return func()
+
+    result = asyncio.run(RetryEngine(enabled=True).call(
+        "test", attempt, policy=FAST, on_retry=lambda error, delay: retries.append(error)
+    ))
+    assert result == "ok"
+    assert len(retries) == 2
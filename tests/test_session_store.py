@@ -0,0 +1,30 @@
+import time
+
+from session_store import SessionStore
+
+
+def make_store(**kwargs):
+    store = SessionStore(**kwargs)
+    for user_id in range(6):
+        store.get_or_create(user_id).groq_api_key = f"key-{user_id}"
+    return store
+
+
+def test_evicted_session_gets_its_own_key_back():
+    store = SessionStore(max_sessions=1, idle_ttl=100)
+    store.get_or_create(1).groq_api_key = "mine"
+    store.get_or_create(2)
+    assert store[1].groq_api_key == "mine"
+
+
+def test_kept_keys_are_bounded_like_sessions():
+    store = make_store(max_sessions=2, idle_ttl=100)
+    assert len(store) == 2
+    assert list(store._api_keys) == [2, 3]
+
+
+def test_kept_keys_expire_with_the_idle_ttl():
+    store = make_store(max_sessions=2, idle_ttl=0.05)
+    time.sleep(0.06)
+    store.evict_expired()
+    assert len(store._api_keys) == 0
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from tracing import Tracer
+
+
+class RecordingExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, spans):
+        self.traces.append([span.name for span in spans])
+
+    def close(self):
+        pass
+
+
+def make_tracer(**kwargs):
+    exporter = RecordingExporter()
+    options = {"enabled": True, "slow_threshold": 60, "sample_rate": 0.0}
+    options.update(kwargs)
+    return Tracer(exporter, **options), exporter
+
+
+def test_fast_successful_trace_is_dropped_at_zero_sample_rate():
+    tracer, exporter = make_tracer()
+    with tracer.start_trace("update"):
+        with tracer.span("provider"):
+            pass
+    assert exporter.traces == []
+    assert tracer.dropped_traces == 1
+
+
+def test_sampled_trace_is_exported_with_its_children():
+    tracer, exporter = make_tracer(sample_rate=1.0)
+    with tracer.start_trace("update"):
+        with tracer.span("provider"):
+            pass
+    assert exporter.traces == [["provider", "update"]]
+    assert tracer.exported_traces == 1
+
+
+def test_failed_root_is_always_kept():
+    tracer, exporter = make_tracer()
+    with pytest.raises(RuntimeError):
+        with tracer.start_trace("update"):
+            raise RuntimeError("boom")
+    assert exporter.traces == [["update"]]
+
+
+def test_failed_child_keeps_the_trace_even_if_handled():
+    tracer, exporter = make_tracer()
+    with tracer.start_trace("update"):
+        try:
+            with tracer.span("provider"):
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+    assert exporter.traces == [["provider", "update"]]
+
+
+def test_slow_trace_is_kept():
+    tracer, exporter = make_tracer(slow_threshold=0.01)
+    with tracer.start_trace("update"):
+        time.sleep(0.02)
+    assert exporter.traces == [["update"]]
+
+
+def test_spans_beyond_the_limit_are_dropped():
+    tracer, exporter = make_tracer(sample_rate=1.0, max_spans=2)
+    with tracer.start_trace("update") as root:
+        for _ in range(3):
+            with tracer.span("db"):
+                pass
+    assert exporter.traces == [["db", "db", "update"]]
+    assert root.dropped == 1
+
+
+def test_disabled_tracer_exports_nothing():
+    tracer, exporter = make_tracer(enabled=False, sample_rate=1.0)
+    with tracer.start_trace("update"):
+        with tracer.span("provider"):
+            pass
+    assert exporter.traces == []
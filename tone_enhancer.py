@@ -1,9 +1,12 @@
-from groq import AsyncGroq
 import os
 import asyncio
 from typing import Optional
 import logging
 from dotenv import load_dotenv
+from client_registry import registry
+from circuit_breaker import breakers, hedged
+from model_router import router
+from retry_policy import retry_call
 
 # Configure logging
 logging.basicConfig(
@@ -24,13 +27,14 @@ class ToneEnhancer:
         
         self.last_enhanced_text = None
 
-    async def enhance_text(self, text: str, prompt: str = DEFAULT_PROMPT) -> tuple[bool, str, str]:
+    async def enhance_text(self, text: str, prompt: str = DEFAULT_PROMPT, user_id=None) -> tuple[bool, str, str]:
         """
         Enhance the given text using Groq's LLM.
         
         Args:
             text (str): The text to enhance
             prompt (str, optional): Custom prompt for text enhancement
+            user_id (optional): Telegram user ID, used by the sticky routing policy
             
         Returns:
             tuple[bool, str, str]: (success, enhanced_text, error_message)
@@ -44,26 +48,14 @@ class ToneEnhancer:
 
             logger.info(f"Enhancing text: {text[:100]}...")
             
-            # Create Groq client for this request
-            groq_client = AsyncGroq(api_key=self.groq_api_key)
+            # Reuse the pooled async Groq client
+            groq_client = registry.async_groq(self.groq_api_key)
             
-            # Create the streaming response
-            response = await groq_client.chat.completions.create(
-                model="llama3-8b-8192",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a text editor. You will be given a prompt and a text to edit. Edit the text to match the prompt, and only respond with the full edited version of the text - do not include any other information, context, or explanation. If you add on to the text, respond with the full version, not just the new portion. Do not include the prompt or otherwise preface your response. Do not enclose the response in quotes."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Prompt: {prompt}\nText: {text}"
-                    }
-                ],
-                stream=True,
-                max_tokens=1024,
-                temperature=0.7
-            )
+            # Create the streaming response on the routed model, hedged with its fallback
+            model = router.choose("tone", user_id)
+            response, _ = await hedged("groq", model, lambda model: retry_call(
+                "groq", lambda: self._open_stream(groq_client, model, text, prompt)
+            ))
 
             # Process the streaming response
             result = ""
@@ -80,6 +72,25 @@ class ToneEnhancer:
             logger.error(error_msg)
             return False, "", error_msg
 
+    async def _open_stream(self, groq_client, model: str, text: str, prompt: str):
+        with breakers.guard("groq", model):
+            return await groq_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a text editor. You will be given a prompt and a text to edit. Edit the text to match the prompt, and only respond with the full edited version of the text - do not include any other information, context, or explanation. If you add on to the text, respond with the full version, not just the new portion. Do not include the prompt or otherwise preface your response. Do not enclose the response in quotes."
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Prompt: {prompt}\nText: {text}"
+                    }
+                ],
+                stream=True,
+                max_tokens=1024,
+                temperature=0.7
+            )
+
 async def main():
     # Example usage
     enhancer = ToneEnhancer()
@@ -0,0 +1,310 @@
+"""Lightweight request tracing.
+
+Each update gets a trace: a root span opened around the handler, plus nested
+spans for the stages it goes through (Telegram downloads, provider calls, DB
+writes, replies). Spans carry attributes such as byte counts, model names and
+token usage. The current span lives in a ``contextvars`` variable, so it
+follows ``await`` chains and tasks created from a traced handler, and provider
+calls carry it onto their worker threads.
+
+Traces are decided on when their root span ends ("tail sampling"): traces
+in which any span failed (handlers catch their own errors, so usually only a
+child span does) and traces slower than ``TRACING_SLOW_THRESHOLD`` are
+always exported, others with probability ``TRACING_SAMPLE_RATE``. Exported spans are appended
+to ``TRACING_EXPORT_PATH`` as JSON lines, using OpenTelemetry field names so
+a slow request can be reconstructed end to end by ``traceId``.
+
+Background jobs store the trace ID of the update that enqueued them and open
+their own root span under the same ID.
+"""
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+TRACING_EXPORT_PATH = os.getenv('TRACING_EXPORT_PATH', 'bot_traces.jsonl')
+TRACING_SLOW_THRESHOLD = float(os.getenv('TRACING_SLOW_THRESHOLD', '5'))  # Seconds
+TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', '0.01'))
+TRACING_MAX_SPANS = int(os.getenv('TRACING_MAX_SPANS', '256'))  # Per trace
+
+# Payload key used to carry a trace across the media job queue
+TRACE_ID_KEY = "trace_id"
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def _attribute_value(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "attributes", "start", "end",
+        "_started", "_ended", "error", "root", "_finished", "exported", "dropped",
+        "child_failed"
+    )
+
+    def __init__(self, name: str, trace_id: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.attributes = {key: _attribute_value(value) for key, value in attributes.items()}
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._ended: Optional[float] = None
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self.root = parent.root if parent else self
+        # Only used on root spans: finished descendants waiting for the export decision
+        self._finished: Optional[List["Span"]] = [] if parent is None else None
+        self.exported = False
+        self.dropped = 0
+        self.child_failed = False  # Only used on root spans: a descendant recorded an error
+
+    @property
+    def duration(self) -> float:
+        return (self._ended or time.perf_counter()) - self._started
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = _attribute_value(value)
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {str(error)}"
+
+    def finish(self):
+        self._ended = time.perf_counter()
+        self.end = self.start + (self._ended - self._started)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": int(self.start * 1e9),
+            "endTimeUnixNano": int((self.end or time.time()) * 1e9),
+            "durationMs": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+        if self.dropped:
+            data["droppedSpans"] = self.dropped
+        return data
+
+
+class _NoopSpan:
+    """Stand-in when tracing is off or there is no active trace."""
+
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a file from a background thread."""
+
+    def __init__(self, path: str = TRACING_EXPORT_PATH):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[List[Dict[str, Any]]]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put([span.to_dict() for span in spans])
+
+    def _run(self):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                while True:
+                    batch = self._queue.get()
+                    if batch is None:
+                        break
+                    for record in batch:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    f.flush()
+        except OSError as e:
+            logger.error(f"Trace export to {self.path} failed: {str(e)}")
+
+    def close(self, timeout: float = 5.0):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+
+class Tracer:
+    """Creates spans and hands finished traces to the exporter."""
+
+    def __init__(
+        self,
+        exporter: JsonLinesExporter,
+        enabled: bool = TRACING_ENABLED,
+        slow_threshold: float = TRACING_SLOW_THRESHOLD,
+        sample_rate: float = TRACING_SAMPLE_RATE,
+        max_spans: int = TRACING_MAX_SPANS
+    ):
+        self.exporter = exporter
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.exported_traces = 0
+        self.dropped_traces = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def start_trace(self, name: str, trace_id: Optional[str] = None, **attributes) -> Iterator[Span]:
+        """Open a root span, continuing ``trace_id`` if given."""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        with self._activate(Span(name, trace_id or _new_id(16), None, attributes)) as span:
+            yield span
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Open a child of the current span; a no-op outside a trace."""
+        parent = _current_span.get()
+        if parent is None or not self.enabled:
+            yield NOOP_SPAN
+            return
+        with self._activate(Span(name, parent.trace_id, parent, attributes)) as span:
+            yield span
+
+    @contextmanager
+    def _activate(self, span: Span) -> Iterator[Span]:
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        root = span.root
+        with self._lock:
+            if span is not root:
+                if span.error is not None:
+                    root.child_failed = True
+                if root._finished is None:
+                    # Outlived its root (e.g. a background task); follow the root's decision
+                    export = [span] if root.exported else None
+                elif len(root._finished) < self.max_spans:
+                    root._finished.append(span)
+                    export = None
+                else:
+                    root.dropped += 1
+                    export = None
+            else:
+                keep = (
+                    span.error is not None
+                    or span.child_failed
+                    or span.duration >= self.slow_threshold
+                    or random.random() < self.sample_rate
+                )
+                export = root._finished + [root] if keep else None
+                root._finished = None
+                root.exported = keep
+                if keep:
+                    self.exported_traces += 1
+                else:
+                    self.dropped_traces += 1
+        if export:
+            self.exporter.export(export)
+
+    def close(self):
+        self.exporter.close()
+
+
+tracer = Tracer(JsonLinesExporter())
+start_trace = tracer.start_trace
+span = tracer.span
+
+
+def current_span():
+    """The active span, or a no-op span outside a trace."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def current_trace_id() -> Optional[str]:
+    active = _current_span.get()
+    return active.trace_id if active else None
+
+
+def set_attributes(**attributes):
+    """Set attributes on the active span."""
+    current_span().set_attributes(**attributes)
+
+
+def update_attributes(update) -> Dict[str, Any]:
+    """Span attributes identifying a Telegram update."""
+    attributes = {"update_id": getattr(update, "update_id", None)}
+    user = getattr(update, "effective_user", None)
+    chat = getattr(update, "effective_chat", None)
+    if user is not None:
+        attributes["user_id"] = user.id
+    if chat is not None:
+        attributes["chat_id"] = chat.id
+    return attributes
+
+
+def record_token_usage(response):
+    """Copy token counts from a Groq/Together (``usage``) or Gemini (``usage_metadata``) response."""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        set_attributes(
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None)
+        )
+        return
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        set_attributes(
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            completion_tokens=getattr(usage, "candidates_token_count", None)
+        )
@@ -5,13 +5,15 @@ import subprocess
 from pathlib import Path
 from telegram import Update
 from telegram.ext import CallbackContext, ContextTypes
-import google.generativeai as genai
 from dotenv import load_dotenv
-import yt_dlp
-from youtube_transcript_api import YouTubeTranscriptApi
-from pytube import YouTube
+from client_registry import registry
+from provider_executor import run_provider
+from retry_policy import retry_sync
+from single_flight import youtube_flights
+from tracing import span, record_token_usage
 import re
-import browser_cookie3
+# google.generativeai, yt_dlp, youtube_transcript_api and browser_cookie3 are
+# slow to import, so they are imported inside the functions that need them
 
 # Load environment variables
 load_dotenv()
@@ -28,11 +30,10 @@ logger = logging.getLogger(__name__)
 MEDIA_FOLDER = Path(__file__).parent / "medias"
 MEDIA_FOLDER.mkdir(parents=True, exist_ok=True)
 
-# Configure Gemini
+# Configure Gemini (applied when the first model is built)
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY not found in environment variables")
-genai.configure(api_key=GEMINI_API_KEY)
 
 # Prompts
 SUMMARY_PROMPT = """
@@ -73,17 +74,19 @@ def initialize():
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("GEMINI_API_KEY not found in environment variables")
-    genai.configure(api_key=api_key)
+    registry.set_gemini_api_key(api_key)
 
 def get_insights(video_path):
     """Get insights from a video using Gemini Vision."""
     try:
-        # Initialize Gemini model with the newer 1.5 Flash version
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        # Get the cached Gemini 1.5 Flash model
+        model = registry.gemini_model('gemini-1.5-flash')
         
         # Read video file
-        with open(video_path, 'rb') as f:
-            video_data = f.read()
+        with span("gemini.read_video") as current:
+            with open(video_path, 'rb') as f:
+                video_data = f.read()
+            current.set_attribute("bytes", len(video_data))
             
         # Create video part
         video_part = {
@@ -92,16 +95,18 @@ def get_insights(video_path):
         }
         
         # Generate content with specific config
-        response = model.generate_content(
-            contents=[
-                "Analyze this video and describe what's happening, including key events, objects, and people. Be concise but detailed.",
-                video_part
-            ],
-            generation_config={
-                "temperature": 0.4,
-                "max_output_tokens": 2048
-            }
-        )
+        with span("gemini.generate_content", model='gemini-1.5-flash'):
+            response = model.generate_content(
+                contents=[
+                    "Analyze this video and describe what's happening, including key events, objects, and people. Be concise but detailed.",
+                    video_part
+                ],
+                generation_config={
+                    "temperature": 0.4,
+                    "max_output_tokens": 2048
+                }
+            )
+            record_token_usage(response)
         
         return response.text
         
@@ -209,6 +214,8 @@ def get_video_info(video_id):
 
 def get_browser_cookies():
     """Get cookies from installed browsers."""
+    import browser_cookie3
+
     cookies = {}
     browsers = [
         (browser_cookie3.chrome, "Chrome"),
@@ -275,7 +282,7 @@ def download_youtube_audio(video_id, output_dir):
         logging.info(f"Downloading audio from: {url}")
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+            retry_sync("youtube", lambda: ydl.download([url]))
             
         # Find the output file
         wav_file = os.path.join(output_dir, 'audio.wav')
@@ -338,7 +345,7 @@ def download_youtube_video(video_id, output_dir):
         logging.info(f"Downloading video from: {url}")
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+            info = retry_sync("youtube", lambda: ydl.extract_info(url, download=True))
             video_file = ydl.prepare_filename(info)
             
         if os.path.exists(video_file) and os.path.getsize(video_file) > 0:
@@ -395,25 +402,19 @@ def generate_captions_from_audio(video_id):
                 audio_data = recognizer.record(source)
                 logging.info("Audio data recorded successfully")
                 
-            # Perform speech recognition with error handling and retries
-            for attempt in range(3):
-                try:
-                    logging.info(f"Speech recognition attempt {attempt + 1}")
-                    text = recognizer.recognize_google(audio_data)
-                    if text:
-                        logging.info("Speech recognition successful")
-                        return text
-                    logging.warning(f"Empty transcription result on attempt {attempt + 1}")
-                except sr.UnknownValueError:
-                    logging.warning(f"Speech recognition failed on attempt {attempt + 1}")
-                except sr.RequestError as e:
-                    logging.error(f"Speech recognition service error: {str(e)}")
-                    break
-                
-                if attempt < 2:
-                    time.sleep(2)
+            # Perform speech recognition; service errors are retried with backoff
+            try:
+                text = retry_sync("speech", lambda: recognizer.recognize_google(audio_data))
+                if text:
+                    logging.info("Speech recognition successful")
+                    return text
+                logging.warning("Empty transcription result")
+            except sr.UnknownValueError:
+                logging.warning("Speech recognition could not understand the audio")
+            except sr.RequestError as e:
+                logging.error(f"Speech recognition service error: {str(e)}")
             
-            logging.error("All speech recognition attempts failed")
+            logging.error("Speech recognition failed")
             return None
             
         except Exception as e:
@@ -436,6 +437,8 @@ def generate_captions_from_audio(video_id):
 
 def extract_transcript_details(youtube_video_url):
     """Extract transcript from YouTube video and handle cases where transcripts are unavailable."""
+    from youtube_transcript_api import YouTubeTranscriptApi
+
     try:
         # Extract video ID
         if "youtube.com/watch?v=" in youtube_video_url:
@@ -447,24 +450,24 @@ def extract_transcript_details(youtube_video_url):
             return None
 
         try:
-            # Try to get manual captions first
-            transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['en'])
+            # Try to get manual captions first; rate limits and outages are retried
+            transcript_list = retry_sync("youtube", lambda: YouTubeTranscriptApi.get_transcript(video_id, languages=['en']))
             transcript = " ".join([item["text"] for item in transcript_list])
             return transcript
         except Exception as e:
             logging.warning(f"No manual captions available: {str(e)}")
             try:
                 # If manual captions fail, try auto-generated ones
-                transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['en-US'])
+                transcript_list = retry_sync("youtube", lambda: YouTubeTranscriptApi.get_transcript(video_id, languages=['en-US']))
                 transcript = " ".join([item["text"] for item in transcript_list])
                 return transcript
             except Exception as e:
                 logging.warning(f"No auto-generated captions available: {str(e)}")
                 try:
                     # If both fail, try to get any available transcript
-                    transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
+                    transcript_list = retry_sync("youtube", lambda: YouTubeTranscriptApi.list_transcripts(video_id))
                     transcript = transcript_list.find_transcript(['en'])
-                    transcript_list = transcript.fetch()
+                    transcript_list = retry_sync("youtube", transcript.fetch)
                     transcript = " ".join([item["text"] for item in transcript_list])
                     return transcript
                 except Exception as e:
@@ -486,15 +489,23 @@ def extract_transcript_details(youtube_video_url):
 def generate_gemini_content(transcript_text, prompt):
     """Generate content using Gemini Pro model."""
     try:
-        model = genai.GenerativeModel("gemini-pro")
+        model = registry.gemini_model("gemini-pro")
         response = model.generate_content(prompt + transcript_text)
         return response.text
     except Exception as e:
         logging.error(f"Error generating content: {str(e)}")
         raise
 
-def process_youtube_video(video_id):
+def youtube_video_info(video_id):
+    """Metadata (title, duration...) of a YouTube video, without downloading it."""
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        return ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+
+async def process_youtube_video(video_id):
     """Process YouTube video: download, summarize, and cleanup."""
+
     try:
         # Create temp directory
         temp_dir = os.path.join(MEDIA_FOLDER, f"temp_video_{video_id}_{int(time.time())}")
@@ -503,19 +514,18 @@ def process_youtube_video(video_id):
         
         try:
             # Download video
-            video_file = download_youtube_video(video_id, temp_dir)
+            video_file = await run_provider("youtube", download_youtube_video, video_id, temp_dir)
             if not video_file:
                 return None
                 
             # Get video info for the summary
-            with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-                video_info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
-                title = video_info.get('title', 'Unknown Title')
-                duration = video_info.get('duration', 0)
+            video_info = await run_provider("youtube", youtube_video_info, video_id)
+            title = video_info.get('title', 'Unknown Title')
+            duration = video_info.get('duration', 0)
                 
-            # Pass to summarize function
+            # Pass to summarize function; audio extraction and conversion run in the media worker pool
             from video_summary import summarize_video
-            summary = summarize_video(video_file, title, duration)
+            summary = await summarize_video(video_file, title, duration)
             
             return summary
             
@@ -537,6 +547,104 @@ def process_youtube_video(video_id):
         logging.error(f"Error in process_youtube_video: {str(e)}")
         return None
 
+def download_youtube_for_summary(url, video_id):
+    """Download a YouTube video's audio for summarization.
+
+    Returns:
+        tuple: (title, duration in seconds)
+    """
+    import yt_dlp
+
+    # Configure yt-dlp with advanced options
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': str(MEDIA_FOLDER / f'{video_id}.%(ext)s'),
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }],
+        # Advanced options to bypass restrictions
+        'quiet': True,
+        'no_warnings': True,
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android'],  # Use android client
+                'player_skip': ['webpage', 'configs'],  # Skip unnecessary data
+            }
+        },
+        # Use various clients to avoid bot detection
+        'external_downloader_args': ['--add-header', 'User-Agent:Mozilla/5.0 (Android 12; Mobile; rv:68.0) Gecko/68.0 Firefox/96.0'],
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Android 12; Mobile; rv:68.0) Gecko/68.0 Firefox/96.0',
+            'Accept-Language': 'en-US,en;q=0.5',
+        },
+    }
+    
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        try:
+            info = retry_sync("youtube", lambda: ydl.extract_info(url, download=True))
+        except Exception as first_error:
+            logger.warning(f"First attempt failed: {str(first_error)}")
+            # Try alternate format on failure
+            ydl_opts.update({
+                'format': 'worstaudio/worst',  # Try worst quality as fallback
+                'extractor_args': {
+                    'youtube': {
+                        'player_client': ['ios'],  # Try iOS client
+                    }
+                }
+            })
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl2:
+                info = retry_sync("youtube", lambda: ydl2.extract_info(url, download=True))
+    
+    return info.get('title', 'Video'), info.get('duration', 0)
+
+def summarize_youtube_video(title, duration):
+    """Generate a summary for a downloaded YouTube video with Gemini."""
+    # Get the cached Gemini model
+    model = registry.gemini_model('gemini-pro')
+    
+    with span("gemini.generate_content", model='gemini-pro'):
+        response = model.generate_content(
+            f"Title: {title}\nDuration: {duration//60}:{duration%60:02d}\n\n{SUMMARY_PROMPT}"
+        )
+        record_token_usage(response)
+    return response.text.strip()
+
+def cleanup_youtube_files(video_id):
+    """Remove files downloaded for a YouTube video."""
+    try:
+        for file in MEDIA_FOLDER.glob(f"{video_id}.*"):
+            file.unlink()
+    except Exception as e:
+        logger.error(f"Error cleaning up files: {str(e)}")
+
+async def summarize_youtube(url, video_id, on_downloaded=None):
+    """Download and summarize a YouTube video.
+
+    Concurrent calls for the same video ID share a single download and
+    Gemini call. ``on_downloaded(title, duration)`` is only called for the
+    request that actually runs the pipeline.
+
+    Returns:
+        tuple: (title, duration in seconds, summary)
+    """
+    async def pipeline():
+        try:
+            title, duration = await run_provider("youtube", download_youtube_for_summary, url, video_id)
+            if on_downloaded:
+                try:
+                    await on_downloaded(title, duration)
+                except Exception as e:
+                    logger.warning(f"Error reporting download progress: {str(e)}")
+            summary = await run_provider("gemini", summarize_youtube_video, title, duration)
+            return title, duration, summary
+        finally:
+            cleanup_youtube_files(video_id)
+
+    return await youtube_flights.do(video_id, pipeline)
+
 async def handle_youtube_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the youtube_summary command."""
     try:
@@ -561,68 +669,16 @@ async def handle_youtube_command(update: Update, context: ContextTypes.DEFAULT_T
             "Processing your YouTube video... This may take a few minutes."
         )
 
-        try:
-            # Configure yt-dlp with advanced options
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': str(MEDIA_FOLDER / f'{video_id}.%(ext)s'),
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                # Advanced options to bypass restrictions
-                'quiet': True,
-                'no_warnings': True,
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android'],  # Use android client
-                        'player_skip': ['webpage', 'configs'],  # Skip unnecessary data
-                    }
-                },
-                # Use various clients to avoid bot detection
-                'external_downloader_args': ['--add-header', 'User-Agent:Mozilla/5.0 (Android 12; Mobile; rv:68.0) Gecko/68.0 Firefox/96.0'],
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Android 12; Mobile; rv:68.0) Gecko/68.0 Firefox/96.0',
-                    'Accept-Language': 'en-US,en;q=0.5',
-                },
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                try:
-                    info = ydl.extract_info(url, download=True)
-                except Exception as first_error:
-                    logger.warning(f"First attempt failed: {str(first_error)}")
-                    # Try alternate format on failure
-                    ydl_opts.update({
-                        'format': 'worstaudio/worst',  # Try worst quality as fallback
-                        'extractor_args': {
-                            'youtube': {
-                                'player_client': ['ios'],  # Try iOS client
-                            }
-                        }
-                    })
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl2:
-                        info = ydl2.extract_info(url, download=True)
-                
-                title = info.get('title', 'Video')
-                duration = info.get('duration', 0)
-                
-                await processing_msg.edit_text(
-                    f"Downloaded: {title}\n"
-                    f"Duration: {duration//60}:{duration%60:02d}\n"
-                    "Generating summary..."
-                )
-
-            # Initialize Gemini
-            model = genai.GenerativeModel('gemini-pro')
-            
-            # Generate summary
-            response = model.generate_content(
-                f"Title: {title}\nDuration: {duration//60}:{duration%60:02d}\n\n{SUMMARY_PROMPT}"
+        async def on_downloaded(title, duration):
+            await processing_msg.edit_text(
+                f"Downloaded: {title}\n"
+                f"Duration: {duration//60}:{duration%60:02d}\n"
+                "Generating summary..."
             )
-            
-            summary = response.text.strip()
+
+        try:
+            # Download and summarize off the event loop, shared with identical requests
+            title, duration, summary = await summarize_youtube(url, video_id, on_downloaded)
             
             # Send summary
             await processing_msg.edit_text(
@@ -637,14 +693,6 @@ async def handle_youtube_command(update: Update, context: ContextTypes.DEFAULT_T
                 "Please try again or contact support if the issue persists."
             )
 
-        finally:
-            # Cleanup
-            try:
-                for file in MEDIA_FOLDER.glob(f"{video_id}.*"):
-                    file.unlink()
-            except Exception as e:
-                logger.error(f"Error cleaning up files: {str(e)}")
-
     except Exception as e:
         logger.error(f"Error in handle_youtube_command: {str(e)}")
         await update.message.reply_text(
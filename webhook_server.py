@@ -0,0 +1,178 @@
+"""Webhook serving mode for the Telegram bot.
+
+Instead of long-polling ``getUpdates``, Telegram POSTs each update to an
+embedded aiohttp server. Requests must carry the configured secret token,
+and updates are rejected with 503 (Telegram retries later) once more than
+``WEBHOOK_MAX_QUEUE`` accepted updates are still unfinished. With concurrent
+updates PTB drains ``update_queue`` into tasks at once, so its depth says
+nothing about load; :class:`InFlightUpdateProcessor` counts updates from the
+moment they are queued until their handlers finish instead. Several
+workers can run behind a load balancer; only one of them needs
+``WEBHOOK_REGISTER=true`` to call ``setWebhook``.
+"""
+import os
+import hmac
+import signal
+import asyncio
+import logging
+from typing import Any, Awaitable, Optional, Set
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application, SimpleUpdateProcessor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public URL Telegram should call
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_QUEUE = int(os.getenv('WEBHOOK_MAX_QUEUE', '1000'))  # Unfinished updates before 503s
+WEBHOOK_MAX_CONCURRENT_UPDATES = int(os.getenv('WEBHOOK_MAX_CONCURRENT_UPDATES', '256'))
+WEBHOOK_REGISTER = os.getenv('WEBHOOK_REGISTER', 'true').lower() == 'true'
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class InFlightUpdateProcessor(SimpleUpdateProcessor):
+    """Update processor that knows how many tracked updates are unfinished."""
+
+    def __init__(self, max_concurrent_updates: int = WEBHOOK_MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._tracked: Set[int] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tracked)
+
+    def track(self, update: object):
+        """Count ``update`` as in flight until its processing finishes."""
+        self._tracked.add(id(update))
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        try:
+            await coroutine
+        finally:
+            self._tracked.discard(id(update))
+
+
+class WebhookServer:
+    """aiohttp server that feeds Telegram updates into an Application."""
+
+    def __init__(
+        self,
+        application: Application,
+        listen: str = WEBHOOK_LISTEN,
+        port: int = WEBHOOK_PORT,
+        path: str = WEBHOOK_PATH,
+        secret_token: Optional[str] = WEBHOOK_SECRET,
+        max_queue_size: int = WEBHOOK_MAX_QUEUE
+    ):
+        processor = application.update_processor
+        if not isinstance(processor, InFlightUpdateProcessor):
+            raise ValueError("Webhook mode needs an application built with InFlightUpdateProcessor")
+        self.application = application
+        self.processor = processor
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_queue_size = max_queue_size
+        self.accepted = 0
+        self.rejected = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Validate, parse and enqueue one update."""
+        if self.secret_token:
+            received = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(received, self.secret_token):
+                logger.warning(f"Rejected webhook call with bad secret from {request.remote}")
+                return web.Response(status=403)
+
+        if self.processor.in_flight >= self.max_queue_size:
+            # Telegram redelivers on non-2xx, so this applies backpressure
+            self.rejected += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.error(f"Invalid webhook payload: {str(e)}")
+            return web.Response(status=400)
+
+        self.processor.track(update)
+        await self.application.update_queue.put(update)
+        self.accepted += 1
+        return web.Response(status=200)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "in_flight": self.processor.in_flight,
+            "max_in_flight": self.max_queue_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+        })
+
+    async def start(self):
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_webhook(application: Application, drop_pending_updates: bool = True):
+    """Run the application in webhook mode until SIGINT/SIGTERM."""
+    if WEBHOOK_REGISTER and not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL not found in environment variables")
+
+    server = WebhookServer(application)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Signal handlers are not available on Windows event loops
+            pass
+
+    async with application:
+        # post_init/post_shutdown only run automatically with run_polling/run_webhook
+        if application.post_init:
+            await application.post_init(application)
+
+        if WEBHOOK_REGISTER:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                drop_pending_updates=drop_pending_updates,
+                max_connections=100
+            )
+            logger.info(f"Registered webhook {WEBHOOK_URL}")
+
+        await application.start()
+        await server.start()
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)